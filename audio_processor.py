@@ -0,0 +1,165 @@
+"""Audio operations run entirely inside ffmpeg: extract, convert, normalize loudness, trim
+
+Audio is never decoded in Python; ffmpeg streams it from file to file. The
+stream is copied untouched whenever its codec already fits the target
+container (the AAC track of an MP4 into .m4a, an MP3 trimmed to .mp3), and
+encoded only when it does not.
+"""
+import json
+import logging
+import os
+from typing import List, Optional
+
+from ffmpeg_runner import run_ffmpeg
+from instrumentation import conversion_stage
+from job_manager import annotate_job
+from media_probe import probe_file
+from workspace import job_path
+
+logger = logging.getLogger(__name__)
+
+AUDIO_ENCODERS = {
+    'mp3': ['-c:a', 'libmp3lame', '-q:a', '2'],
+    'wav': ['-c:a', 'pcm_s16le'],
+    'aac': ['-c:a', 'aac', '-b:a', '192k'],
+    'm4a': ['-c:a', 'aac', '-b:a', '192k'],
+    'ogg': ['-c:a', 'libvorbis', '-q:a', '5'],
+    'flac': ['-c:a', 'flac'],
+}
+
+# Codecs each output format takes as-is
+COPY_CODECS = {
+    'mp3': {'mp3'},
+    'aac': {'aac'},
+    'm4a': {'aac', 'alac'},
+    'ogg': {'vorbis', 'opus', 'flac'},
+    'flac': {'flac'},
+    'wav': {'pcm_s16le', 'pcm_s24le', 'pcm_s32le', 'pcm_f32le', 'pcm_u8'},
+}
+
+# Format that keeps a codec without re-encoding, for "original audio" extraction
+NATIVE_FORMATS = {'aac': 'm4a', 'alac': 'm4a', 'mp3': 'mp3', 'vorbis': 'ogg', 'opus': 'ogg', 'flac': 'flac',
+                  'pcm_s16le': 'wav', 'pcm_s24le': 'wav', 'pcm_s32le': 'wav', 'pcm_f32le': 'wav', 'pcm_u8': 'wav'}
+
+# EBU R128 targets; -16 LUFS is the usual level for podcasts and streaming
+LOUDNESS_TARGET = "I=-16:TP=-1.5:LRA=11"
+
+
+def audio_codec_args(codec: Optional[str], audio_format: str) -> List[str]:
+    """Copy the stream when its codec fits the format, otherwise encode"""
+    if codec in COPY_CODECS.get(audio_format, ()):
+        return ['-c:a', 'copy']
+    return AUDIO_ENCODERS.get(audio_format, AUDIO_ENCODERS['mp3'])
+
+
+def output_format(input_path: str, codec: Optional[str]) -> str:
+    """Keep the input's format when we can write it, else the codec's native one"""
+    ext = os.path.splitext(input_path)[1].lower().lstrip('.')
+    if ext in AUDIO_ENCODERS:
+        return ext
+    return NATIVE_FORMATS.get(codec, 'mp3')
+
+
+def parse_loudnorm(stderr: str) -> dict:
+    """The JSON block loudnorm prints at the end of an analysis pass"""
+    start, end = stderr.rfind('{'), stderr.rfind('}')
+    if start < 0 or end < start:
+        raise ValueError("loudnorm printed no measurements")
+    return json.loads(stderr[start:end + 1])
+
+
+async def audio_info(input_path: str) -> dict:
+    info = await probe_file(input_path)
+    if not info.get('audio_codec'):
+        raise ValueError("The file has no audio track")
+    return info
+
+
+class AudioProcessor:
+    @staticmethod
+    @conversion_stage("convert_audio")
+    async def convert(input_path: str, audio_format: Optional[str] = None, progress_callback=None) -> str:
+        """Convert an audio file, or extract the audio of a video; audio_format None keeps the codec"""
+        info = await audio_info(input_path)
+        codec = info['audio_codec']
+        audio_format = audio_format or NATIVE_FORMATS.get(codec, 'mp3')
+        base_name = os.path.splitext(os.path.basename(input_path))[0]
+        output_path = job_path(f"audio_{base_name}.{audio_format}")
+
+        codec_args = audio_codec_args(codec, audio_format)
+        copy = codec_args[-1] == 'copy'
+        annotate_job('audio_path', "copy" if copy else "encode")
+        status = "Extracting audio..." if copy else "Converting audio..."
+        if progress_callback:
+            await progress_callback(10, status)
+
+        await run_ffmpeg(['-i', input_path, '-map', '0:a:0', '-vn', '-sn', '-dn', *codec_args, output_path],
+                         info.get('duration'), progress_callback, status=status, progress_range=(10, 99))
+
+        if progress_callback:
+            await progress_callback(100, "Audio ready!")
+        return output_path
+
+    @staticmethod
+    @conversion_stage("normalize_audio")
+    async def normalize(input_path: str, progress_callback=None) -> str:
+        """Two-pass EBU R128 loudness normalization: measure, then apply linearly"""
+        info = await audio_info(input_path)
+        audio_format = output_format(input_path, info['audio_codec'])
+        base_name = os.path.splitext(os.path.basename(input_path))[0]
+        output_path = job_path(f"normalized_{base_name}.{audio_format}")
+        duration = info.get('duration')
+
+        if progress_callback:
+            await progress_callback(5, "Measuring loudness...")
+        stderr = await run_ffmpeg(['-i', input_path, '-map', '0:a:0',
+                                   '-af', f"loudnorm={LOUDNESS_TARGET}:print_format=json", '-f', 'null', '-'],
+                                  duration, progress_callback, status="Measuring loudness...",
+                                  progress_range=(5, 50))
+        measured = parse_loudnorm(stderr)
+        annotate_job('input_lufs', measured.get('input_i'))
+
+        loudnorm = (f"loudnorm={LOUDNESS_TARGET}:measured_I={measured['input_i']}"
+                    f":measured_TP={measured['input_tp']}:measured_LRA={measured['input_lra']}"
+                    f":measured_thresh={measured['input_thresh']}:offset={measured['target_offset']}:linear=true")
+        # loudnorm resamples to 192 kHz internally; go back to the source rate
+        sample_rate = str(info.get('sample_rate') or 48000)
+        await run_ffmpeg(['-i', input_path, '-map', '0:a:0', '-vn', '-af', loudnorm, '-ar', sample_rate,
+                          *AUDIO_ENCODERS[audio_format], output_path],
+                         duration, progress_callback, status="Normalizing loudness...", progress_range=(50, 99))
+
+        if progress_callback:
+            await progress_callback(100, "Normalization completed!")
+        return output_path
+
+    @staticmethod
+    @conversion_stage("trim_audio")
+    async def trim(input_path: str, start: float, end: Optional[float] = None, progress_callback=None) -> str:
+        """Keep start..end seconds (end None = to the end), copying the stream when the format allows"""
+        info = await audio_info(input_path)
+        duration = info.get('duration')
+        if duration and start >= duration:
+            raise ValueError(f"Start {start}s is past the end of the audio ({duration:.1f}s)")
+        if end is not None and end <= start:
+            raise ValueError("The end of the cut must come after its start")
+
+        codec = info['audio_codec']
+        audio_format = output_format(input_path, codec)
+        base_name = os.path.splitext(os.path.basename(input_path))[0]
+        output_path = job_path(f"trimmed_{base_name}.{audio_format}")
+        codec_args = audio_codec_args(codec, audio_format)
+        annotate_job('audio_path', "copy" if codec_args[-1] == 'copy' else "encode")
+
+        if progress_callback:
+            await progress_callback(10, "Trimming audio...")
+        # Seeking on the input jumps straight to the start instead of decoding up to it;
+        # audio packets are a few ms long, so even a stream copy cuts precisely enough
+        stop = min(end, duration or end) if end is not None else duration
+        limit = ['-t', f"{end - start:.3f}"] if end is not None else []
+        await run_ffmpeg(['-ss', f"{start:.3f}", '-i', input_path, *limit, '-map', '0:a:0', '-vn',
+                          *codec_args, output_path],
+                         stop - start if stop else None, progress_callback, status="Trimming audio...", progress_range=(10, 99))
+
+        if progress_callback:
+            await progress_callback(100, "Trim completed!")
+        return output_path
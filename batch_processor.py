@@ -0,0 +1,186 @@
+"""Batch mode: one operation applied to many files, results streamed into a ZIP
+
+Items are downloaded and converted concurrently within the worker budget.
+Each result is appended to the archive as soon as it is ready and then
+deleted, so disk use stays at about one archive plus the results in flight.
+Image-to-PDF instead combines every image into a single PDF, in order.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+import zipfile
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import BATCH_CONCURRENCY, BATCH_DOWNLOAD_CONCURRENCY, BATCH_PROGRESS_INTERVAL
+from image_processor import ImageProcessor
+from instrumentation import stage
+from video_processor import VideoProcessor
+from workspace import job_path
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# Already compressed formats are stored as they are; deflating them only burns CPU
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.docx', '.zip', '.mp4', '.mkv', '.mp3', '.m4a'}
+
+
+class BatchOperation:
+    """What to do with every item: produce maps one input to one output, combine maps all inputs to one"""
+
+    def __init__(self, label: str, extensions: Tuple[str, ...],
+                 produce: Optional[Callable[[str], Awaitable[str]]] = None,
+                 combine: Optional[Callable[[List[str]], Awaitable[str]]] = None):
+        self.label = label
+        self.extensions = extensions
+        self.produce = produce
+        self.combine = combine
+
+    def accepts(self, item: dict) -> bool:
+        return (item.get('file_ext') or '').lower() in self.extensions
+
+
+BATCH_OPERATIONS: Dict[str, BatchOperation] = {
+    'jpg': BatchOperation("Convert to JPG", IMAGE_EXTENSIONS,
+                          produce=lambda path: VideoProcessor.convert_document(path, 'jpg')),
+    'png': BatchOperation("Convert to PNG", IMAGE_EXTENSIONS,
+                          produce=lambda path: VideoProcessor.convert_document(path, 'png')),
+    'resize50': BatchOperation("Resize to 50%", IMAGE_EXTENSIONS + ('.webp',),
+                               produce=lambda path: ImageProcessor.resize(path, scale_percent=50)),
+    'compress250': BatchOperation("Compress to 250 KB", IMAGE_EXTENSIONS + ('.webp',),
+                                  produce=lambda path: ImageProcessor.compress(path, 250)),
+    'pdf': BatchOperation("Images to one PDF", IMAGE_EXTENSIONS + ('.webp',), combine=ImageProcessor.to_pdf),
+    'txt': BatchOperation("PDF to TXT", ('.pdf',),
+                          produce=lambda path: VideoProcessor.convert_document(path, 'txt')),
+    'docxpdf': BatchOperation("DOCX to PDF", ('.doc', '.docx'),
+                              produce=lambda path: VideoProcessor.convert_document(path, 'pdf')),
+}
+
+
+def operations_for(items: List[dict]) -> List[str]:
+    """Operations that apply to every item of a batch"""
+    return [name for name, operation in BATCH_OPERATIONS.items() if all(operation.accepts(item) for item in items)]
+
+
+def item_name(index: int, item: dict, output_path: str) -> str:
+    """Archive name: position in the batch, original name, new extension"""
+    original = item.get('original_filename') or ''
+    stem = os.path.splitext(original)[0] if original and original != 'file' else "file"
+    return f"{index + 1:02d}_{stem}{os.path.splitext(output_path)[1]}"
+
+
+class ZipStreamWriter:
+    """Appends finished files to a ZIP archive, one at a time and off the event loop"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._zip = zipfile.ZipFile(path, 'w', allowZip64=True)
+        self._lock = asyncio.Lock()
+
+    async def add(self, source_path: str, arcname: str, remove: bool = True):
+        ext = os.path.splitext(source_path)[1].lower()
+        compression = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        async with self._lock:
+            await asyncio.to_thread(self._zip.write, source_path, arcname, compression)
+            self.count += 1
+        if remove:
+            os.unlink(source_path)
+
+    async def close(self):
+        async with self._lock:
+            await asyncio.to_thread(self._zip.close)
+
+
+class BatchProgress:
+    """Aggregates per-item completion into one throttled progress report"""
+
+    def __init__(self, total: int, progress_callback=None, interval: float = BATCH_PROGRESS_INTERVAL):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.progress_callback = progress_callback
+        self.interval = interval
+        self._last_report = 0.0
+
+    async def item_finished(self, ok: bool):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        finished = self.done + self.failed
+        if finished == self.total or time.monotonic() - self._last_report >= self.interval:
+            await self.report()
+
+    async def report(self, status: Optional[str] = None):
+        self._last_report = time.monotonic()
+        if self.progress_callback:
+            finished = self.done + self.failed
+            text = status or f"{finished}/{self.total} files processed" + (f", {self.failed} failed" if self.failed else "")
+            await self.progress_callback(finished * 100 // max(self.total, 1), text)
+
+
+class BatchResult:
+    def __init__(self, output_path: str, succeeded: int, failures: List[Tuple[str, str]]):
+        self.output_path = output_path
+        self.succeeded = succeeded
+        self.failures = failures  # (item name, reason)
+
+
+async def run_batch(items: List[dict], operation_name: str, fetch: Callable[[dict], Awaitable[str]],
+                    progress_callback=None) -> BatchResult:
+    """Apply a batch operation to every item; fetch returns the local path of an item"""
+    operation = BATCH_OPERATIONS[operation_name]
+    progress = BatchProgress(len(items), progress_callback)
+    downloads = asyncio.Semaphore(BATCH_DOWNLOAD_CONCURRENCY)
+    workers = asyncio.Semaphore(BATCH_CONCURRENCY)
+    failures: List[Tuple[str, str]] = []
+
+    async def download(index: int, item: dict) -> Optional[str]:
+        if not operation.accepts(item):
+            failures.append((item_name(index, item, ''), "unsupported file type"))
+            return None
+        try:
+            async with downloads:
+                return await fetch(item)
+        except Exception as e:
+            logger.warning(f"Batch item {index + 1} download failed: {e}")
+            failures.append((item_name(index, item, ''), "download failed"))
+            return None
+
+    await progress.report("Starting...")
+
+    if operation.combine is not None:
+        paths = await asyncio.gather(*(download(index, item) for index, item in enumerate(items)))
+        paths = [path for path in paths if path]
+        if not paths:
+            raise ValueError("No file in the batch could be processed")
+        await progress.report(f"Combining {len(paths)} files...")
+        output_path = await operation.combine(paths)
+        return BatchResult(output_path, len(paths), failures)
+
+    archive = ZipStreamWriter(job_path(f"batch_{uuid.uuid4().hex[:8]}.zip"))
+
+    async def process(index: int, item: dict):
+        input_path = await download(index, item)
+        ok = False
+        if input_path:
+            try:
+                async with workers:
+                    output_path = await operation.produce(input_path)
+                await archive.add(output_path, item_name(index, item, output_path))
+                ok = True
+            except Exception as e:
+                logger.warning(f"Batch item {index + 1} failed: {e}")
+                failures.append((item_name(index, item, ''), str(e) or type(e).__name__))
+        await progress.item_finished(ok)
+
+    try:
+        async with stage(f"batch_{operation_name}"):
+            await asyncio.gather(*(process(index, item) for index, item in enumerate(items)))
+    finally:
+        await archive.close()
+    if archive.count == 0:
+        raise ValueError("No file in the batch could be processed")
+    return BatchResult(archive.path, archive.count, failures)
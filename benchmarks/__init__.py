@@ -0,0 +1,7 @@
+"""Offline benchmarks for the media processing code
+
+Run from the repository root, e.g. `python -m benchmarks.bench_compress`, or
+`python -m benchmarks.suite run` for the full suite with JSON results.
+Fixtures are generated locally (ffmpeg, reportlab, python-docx, Pillow),
+nothing is downloaded.
+"""
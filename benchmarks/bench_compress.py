@@ -0,0 +1,63 @@
+"""Compare target-size compression: legacy moviepy path vs ffmpeg two-pass / fast
+
+The moviepy run needs pip install -r benchmarks/requirements.txt; pass
+--skip-moviepy to compare the ffmpeg modes only.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.fixtures import fixture_path, make_video
+from video_processor import VideoProcessor, compression_bitrates
+
+
+def compress_with_moviepy(input_path: str, target_size_mb: int) -> str:
+    """The pre-ffmpeg implementation (with its bitrate kwarg fixed)"""
+    from moviepy.editor import VideoFileClip
+    output_path = fixture_path("moviepy_compressed.mp4")
+    clip = VideoFileClip(input_path)
+    video_kbps, _ = compression_bitrates(target_size_mb, clip.duration, True)
+    clip.write_videofile(output_path, bitrate=f"{video_kbps}k", verbose=False, logger=None)
+    clip.close()
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--duration', type=int, default=30)
+    parser.add_argument('--target-mb', type=int, default=5)
+    parser.add_argument('--skip-moviepy', action='store_true')
+    args = parser.parse_args()
+
+    source = make_video(args.width, args.height, args.duration)
+    print(f"Source: {source} ({os.path.getsize(source) / 1024 / 1024:.1f} MB), target {args.target_mb} MB")
+
+    runs = []
+    if not args.skip_moviepy:
+        runs.append(("moviepy", lambda: compress_with_moviepy(source, args.target_mb)))
+    runs.append(("ffmpeg two-pass",
+                 lambda: asyncio.run(VideoProcessor.compress_video(source, args.target_mb, mode="two_pass"))))
+    runs.append(("ffmpeg fast",
+                 lambda: asyncio.run(VideoProcessor.compress_video(source, args.target_mb, mode="fast"))))
+
+    results = []
+    for name, run in runs:
+        started = time.perf_counter()
+        output = run()
+        elapsed = time.perf_counter() - started
+        size_mb = os.path.getsize(output) / 1024 / 1024
+        results.append((name, elapsed, size_mb))
+        os.unlink(output)
+
+    baseline = results[0][1]
+    print(f"{'method':<18}{'seconds':>10}{'size MB':>10}{'vs target':>11}{'speedup':>9}")
+    for name, elapsed, size_mb in results:
+        error = (size_mb - args.target_mb) / args.target_mb * 100
+        print(f"{name:<18}{elapsed:>10.2f}{size_mb:>10.2f}{error:>+10.1f}%{baseline / elapsed:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
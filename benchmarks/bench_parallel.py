@@ -0,0 +1,53 @@
+"""Wall-clock comparison of single-process vs segment-parallel libx264 encoding"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.fixtures import fixture_path, make_video
+from ffmpeg_runner import run_ffmpeg
+from media_probe import probe_file
+from parallel_encode import available_cores, encode_parallel
+
+VIDEO_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p']
+AUDIO_ARGS = ['-c:a', 'aac', '-b:a', '128k']
+
+
+async def single(source: str, output: str):
+    await run_ffmpeg(['-i', source, '-map', '0:v:0', '-map', '0:a?', *VIDEO_ARGS, *AUDIO_ARGS, output])
+
+
+async def parallel(source: str, output: str, segments: int):
+    await encode_parallel(source, output, VIDEO_ARGS, AUDIO_ARGS, segments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--duration', type=int, default=180)
+    parser.add_argument('--segments', type=int, default=available_cores())
+    args = parser.parse_args()
+
+    source = make_video(args.width, args.height, args.duration)
+    print(f"Source: {source}, {available_cores()} cores available, {args.segments} segments")
+
+    results = []
+    for name, make_run in [("single process", lambda out: single(source, out)),
+                           (f"{args.segments} segments", lambda out: parallel(source, out, args.segments))]:
+        output = fixture_path(f"parallel_bench_{len(results)}.mp4")
+        started = time.perf_counter()
+        asyncio.run(make_run(output))
+        elapsed = time.perf_counter() - started
+        info = asyncio.run(probe_file(output))
+        results.append((name, elapsed, info.get('duration'), os.path.getsize(output) / 1024 / 1024))
+        os.unlink(output)
+
+    baseline = results[0][1]
+    print(f"{'mode':<18}{'seconds':>10}{'duration':>10}{'size MB':>10}{'speedup':>9}")
+    for name, elapsed, duration, size_mb in results:
+        print(f"{name:<18}{elapsed:>10.2f}{duration:>10.2f}{size_mb:>10.2f}{baseline / elapsed:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import subprocess
+import tempfile
+
+from config import FFMPEG_BINARY
+
+FIXTURE_DIR = os.getenv('BENCH_FIXTURE_DIR', os.path.join(tempfile.gettempdir(), "bench_fixtures"))
+
+
+def fixture_path(name: str) -> str:
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    return os.path.join(FIXTURE_DIR, name)
+
+
+def make_video(width: int, height: int, duration: int, fps: int = 30, container: str = "mp4") -> str:
+    """Synthetic test pattern video with a sine tone, generated once and reused"""
+    path = fixture_path(f"testsrc_{width}x{height}_{duration}s_{fps}fps.{container}")
+    if os.path.exists(path):
+        return path
+    subprocess.run([
+        FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        # High quality source so compression has real work to do
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '12', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '192k', '-shortest', path,
+    ], check=True)
+    return path
+
+
+def make_audio(duration: int, fmt: str = "mp3") -> str:
+    """Two-tone stereo audio that swells in volume, so loudness normalization has work to do"""
+    path = fixture_path(f"tone_{duration}s.{fmt}")
+    if os.path.exists(path):
+        return path
+    subprocess.run([
+        FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f"sine=frequency=220:sample_rate=44100:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=330:sample_rate=44100:duration={duration}",
+        '-filter_complex', f"[0][1]amerge=inputs=2,volume='0.1+0.9*t/{duration}':eval=frame",
+        path,
+    ], check=True)
+    return path
+
+
+def make_pdf(pages: int) -> str:
+    """Text PDF with `pages` pages of lorem-style lines (reportlab)"""
+    path = fixture_path(f"document_{pages}p.pdf")
+    if os.path.exists(path):
+        return path
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(path, pagesize=letter)
+    for page in range(pages):
+        y = 750
+        for line in range(45):
+            c.drawString(50, y, f"Page {page + 1}, line {line + 1}: the quick brown fox jumps over the lazy dog")
+            y -= 15
+        c.showPage()
+    c.save()
+    return path
+
+
+def make_docx(paragraphs: int) -> str:
+    """DOCX with `paragraphs` short paragraphs (python-docx)"""
+    path = fixture_path(f"document_{paragraphs}para.docx")
+    if os.path.exists(path):
+        return path
+    from docx import Document
+
+    doc = Document()
+    for n in range(paragraphs):
+        doc.add_paragraph(f"Paragraph {n + 1}: the quick brown fox jumps over the lazy dog.")
+    doc.save(path)
+    return path
+
+
+def make_image(width: int, height: int, fmt: str = "jpg") -> str:
+    """Large photo-like image (gradient plus noise, so it does not compress to nothing)"""
+    path = fixture_path(f"image_{width}x{height}.{fmt}")
+    if os.path.exists(path):
+        return path
+    from PIL import Image
+
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    if fmt == "jpg":
+        image.save(path, quality=92)
+    else:
+        image.save(path)
+    return path
@@ -0,0 +1,311 @@
+"""Benchmark suite for VideoProcessor/ImageProcessor with JSON results and regression checks
+
+    python -m benchmarks.suite run --repeat 5 --output before.json
+    python -m benchmarks.suite run --repeat 5 --output after.json
+    python -m benchmarks.suite compare before.json after.json --threshold 10
+
+Each case is timed over repeated runs recording wall time, CPU time (this
+process plus ffmpeg and pool worker children) and the peak RSS of the whole
+process tree. `compare` exits with status 1 when a case's median wall time
+regressed by more than the threshold.
+
+`run` also reports startup costs, each measured in fresh interpreters: the
+import time of the main modules, and the latency of a first request with and
+without the background warm-up the bot does after starting.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import psutil
+
+from benchmarks.fixtures import make_audio, make_docx, make_image, make_pdf, make_video
+from audio_processor import AudioProcessor
+from image_processor import ImageProcessor
+from media_probe import clear_probe_cache
+from process_pool import process_pool
+from video_processor import VideoProcessor
+
+
+def cases(quick: bool) -> List[Tuple[str, Callable[[], Awaitable]]]:
+    """(name, coroutine factory) pairs; fixtures are generated before timing starts"""
+    seconds = 5 if quick else 20
+    small = make_video(640, 360, seconds)
+    hd = make_video(1280, 720, seconds)
+    merge_parts = [make_video(640, 360, max(2, seconds // 4))] * 3
+    pdf = make_pdf(20 if quick else 200)
+    pdf_small = make_pdf(5 if quick else 20)
+    docx_file = make_docx(200 if quick else 2000)
+    photo = make_image(2000, 1500) if quick else make_image(6000, 4000)
+    png = make_image(1000, 800, "png") if quick else make_image(3000, 2000, "png")
+    song = make_audio(30 if quick else 180)
+
+    return [
+        ("get_file_info/video", lambda: VideoProcessor.get_file_info(small)),
+        ("convert_video/remux_mkv", lambda: VideoProcessor.convert_video(small, "mkv")),
+        ("convert_video/transcode_avi", lambda: VideoProcessor.convert_video(small, "avi")),
+        ("compress_video/fast_720p", lambda: VideoProcessor.compress_video(hd, 1, mode="fast")),
+        ("compress_video/two_pass_720p", lambda: VideoProcessor.compress_video(hd, 1, mode="two_pass")),
+        ("merge_videos/3_parts", lambda: VideoProcessor.merge_videos(merge_parts)),
+        ("video_to_audio/mp3", lambda: VideoProcessor.video_to_audio(small, "mp3")),
+        ("video_to_audio/copy", lambda: VideoProcessor.video_to_audio(small)),
+        ("audio/convert_ogg", lambda: AudioProcessor.convert(song, "ogg")),
+        ("audio/normalize", lambda: AudioProcessor.normalize(song)),
+        ("audio/trim_copy", lambda: AudioProcessor.trim(song, 5, 25)),
+        ("convert_document/pdf_txt", lambda: VideoProcessor.convert_document(pdf, "txt")),
+        ("convert_document/pdf_docx", lambda: VideoProcessor.convert_document(pdf_small, "docx")),
+        ("convert_document/docx_pdf", lambda: VideoProcessor.convert_document(docx_file, "pdf")),
+        ("convert_document/png_jpg", lambda: VideoProcessor.convert_document(png, "jpg")),
+        ("image/resize_50", lambda: ImageProcessor.resize(photo, scale_percent=50)),
+        ("image/compress_200kb", lambda: ImageProcessor.compress(photo, 200)),
+        ("image/rotate_90", lambda: ImageProcessor.rotate(photo, 90)),
+    ]
+
+
+# Imported in this order by a fresh interpreter each
+STARTUP_MODULES = ["config", "media_probe", "image_processor", "video_processor", "bot"]
+FIRST_REQUEST_CASES = ["get_file_info/video", "convert_document/pdf_txt", "image/resize_50"]
+
+
+def tree_cpu_seconds() -> float:
+    """CPU time of this process, reaped children (ffmpeg) and live children (pool workers)"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    reaped = resource.getrusage(resource.RUSAGE_CHILDREN)
+    total = own.ru_utime + own.ru_stime + reaped.ru_utime + reaped.ru_stime
+    for child in psutil.Process().children(recursive=True):
+        try:
+            times = child.cpu_times()
+            total += times.user + times.system
+        except psutil.Error:
+            pass
+    return total
+
+
+class PeakMemory:
+    """Samples the RSS of the whole process tree from a background thread"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        me = psutil.Process()
+        rss = 0
+        for process in [me, *me.children(recursive=True)]:
+            try:
+                rss += process.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def remove_output(result):
+    if isinstance(result, str) and os.path.exists(result):
+        if os.path.isdir(result):
+            shutil.rmtree(result, ignore_errors=True)
+        else:
+            os.unlink(result)
+
+
+async def run_suite(repeat: int, quick: bool, only: List[str]) -> Dict[str, dict]:
+    await process_pool.start()
+    results = {}
+    try:
+        selected = [(name, factory) for name, factory in cases(quick)
+                    if not only or any(name.startswith(prefix) for prefix in only)]
+        for name, factory in selected:
+            # One untimed run to warm caches and pool workers
+            remove_output(await factory())
+            walls, cpus, peaks = [], [], []
+            for _ in range(repeat):
+                # Every run starts cold: no memoized ffprobe results
+                clear_probe_cache()
+                cpu_before = tree_cpu_seconds()
+                with PeakMemory() as memory:
+                    started = time.perf_counter()
+                    result = await factory()
+                    walls.append(time.perf_counter() - started)
+                cpus.append(tree_cpu_seconds() - cpu_before)
+                peaks.append(memory.peak / 2**20)
+                remove_output(result)
+            results[name] = {
+                'wall_s': [round(w, 4) for w in walls],
+                'cpu_s': [round(c, 4) for c in cpus],
+                'peak_rss_mb': [round(p, 1) for p in peaks],
+                'median_wall_s': round(statistics.median(walls), 4),
+                'median_cpu_s': round(statistics.median(cpus), 4),
+                'max_peak_rss_mb': round(max(peaks), 1),
+            }
+            print(f"{name:<32}{results[name]['median_wall_s']:>10.3f}s wall"
+                  f"{results[name]['median_cpu_s']:>10.3f}s cpu{results[name]['max_peak_rss_mb']:>9.1f} MB")
+    finally:
+        await process_pool.stop()
+    return results
+
+
+def fresh_python(*args: str) -> str:
+    """Stdout of a new interpreter: nothing imported, no pool, no warm-up"""
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True,
+                          env={**os.environ, 'WARM_UP': '0'}).stdout
+
+
+def import_seconds(module: str, repeat: int) -> float:
+    """Median time for a fresh interpreter to import module"""
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    return round(statistics.median(float(fresh_python('-c', code).split()[-1]) for _ in range(repeat)), 4)
+
+
+async def first_request(name: str, quick: bool, warm: bool) -> dict:
+    """Latency of the first and second run of a case in this (fresh) process"""
+    factory = dict(cases(quick))[name]
+    timings = {}
+    try:
+        if warm:
+            from bot import warm_up
+            started = time.perf_counter()
+            await warm_up()
+            timings['warm_up_s'] = round(time.perf_counter() - started, 4)
+        for run in ('first_s', 'second_s'):
+            clear_probe_cache()
+            started = time.perf_counter()
+            remove_output(await factory())
+            timings[run] = round(time.perf_counter() - started, 4)
+    finally:
+        await process_pool.stop()
+    return timings
+
+
+def startup_report(repeat: int, quick: bool) -> dict:
+    imports = {module: import_seconds(module, repeat) for module in STARTUP_MODULES}
+    requests = {}
+    for name in FIRST_REQUEST_CASES:
+        args = ['-m', 'benchmarks.suite', 'first-request', name] + (['--quick'] if quick else [])
+        cold = json.loads(fresh_python(*args).splitlines()[-1])
+        warmed = json.loads(fresh_python(*args, '--warm').splitlines()[-1])
+        requests[name] = {'cold_first_s': cold['first_s'], 'steady_s': cold['second_s'],
+                          'warm_up_s': warmed['warm_up_s'], 'warmed_first_s': warmed['first_s']}
+    print(f"{'import':<32}{'s':>10}")
+    for module, seconds in imports.items():
+        print(f"{module:<32}{seconds:>10.3f}")
+    print(f"{'first request':<32}{'cold s':>10}{'steady s':>10}{'warm-up s':>11}{'warmed s':>10}")
+    for name, r in requests.items():
+        print(f"{name:<32}{r['cold_first_s']:>10.3f}{r['steady_s']:>10.3f}{r['warm_up_s']:>11.3f}"
+              f"{r['warmed_first_s']:>10.3f}")
+    return {'import_s': imports, 'first_request': requests}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    """Print per-case changes; returns the number of regressions beyond threshold percent"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"base {base['environment'].get('commit')} -> new {new['environment'].get('commit')}, "
+          f"threshold {threshold:.0f}%")
+    print(f"{'case':<32}{'base s':>10}{'new s':>10}{'change':>9}  {'cpu':>8}{'memory':>9}")
+    regressions = 0
+    for name, result in new['results'].items():
+        old = base['results'].get(name)
+        if old is None:
+            print(f"{name:<32}{'-':>10}{result['median_wall_s']:>10.3f}      new")
+            continue
+        change = (result['median_wall_s'] - old['median_wall_s']) / old['median_wall_s'] * 100
+        cpu_change = (result['median_cpu_s'] - old['median_cpu_s']) / max(old['median_cpu_s'], 1e-9) * 100
+        memory_change = (result['max_peak_rss_mb'] - old['max_peak_rss_mb']) / max(old['max_peak_rss_mb'], 1e-9) * 100
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<32}{old['median_wall_s']:>10.3f}{result['median_wall_s']:>10.3f}{change:>+8.1f}%"
+              f"  {cpu_change:>+7.1f}%{memory_change:>+8.1f}%{flag}")
+    if 'startup' in base and 'startup' in new:
+        # Informational: cold start numbers are too noisy to fail on
+        print(f"{'import / first request':<32}{'base s':>10}{'new s':>10}{'change':>9}")
+        pairs = [(module, base['startup']['import_s'].get(module), seconds)
+                 for module, seconds in new['startup']['import_s'].items()]
+        pairs += [(name, base['startup']['first_request'].get(name, {}).get('cold_first_s'), r['cold_first_s'])
+                  for name, r in new['startup']['first_request'].items()]
+        for name, old, value in pairs:
+            if old:
+                print(f"{name:<32}{old:>10.3f}{value:>10.3f}{(value - old) / old * 100:>+8.1f}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run the benchmarks and write JSON results")
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--quick', action='store_true', help="smaller fixtures for a fast smoke run")
+    run.add_argument('--only', nargs='*', default=[], help="case name prefixes, e.g. compress_video image/")
+    run.add_argument('--output', default="benchmark_results.json")
+    run.add_argument('--skip-startup', action='store_true', help="skip import time and first request latency")
+    first = commands.add_parser('first-request', help="time one case in this fresh process (used by run)")
+    first.add_argument('case', choices=FIRST_REQUEST_CASES)
+    first.add_argument('--quick', action='store_true')
+    first.add_argument('--warm', action='store_true', help="run the bot's warm-up first")
+    diff = commands.add_parser('compare', help="compare two result files")
+    diff.add_argument('base')
+    diff.add_argument('new')
+    diff.add_argument('--threshold', type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        sys.exit(1 if compare(args.base, args.new, args.threshold) else 0)
+    if args.command == 'first-request':
+        print(json.dumps(asyncio.run(first_request(args.case, args.quick, args.warm))))
+        return
+
+    results = asyncio.run(run_suite(args.repeat, args.quick, args.only))
+    output = {'environment': environment(), 'repeat': args.repeat, 'quick': args.quick, 'results': results}
+    if not args.skip_startup:
+        output['startup'] = startup_report(args.repeat, args.quick)
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
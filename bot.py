@@ -6,18 +6,44 @@ from telegram import (
     InlineKeyboardMarkup,
     InputFile
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
     CallbackQueryHandler, 
     ContextTypes,
+    TypeHandler,
+    ApplicationHandlerStop,
     filters
 )
-from config import BOT_TOKEN, get_temp_path, get_file_type, SUPPORTED_DOCUMENT_FORMATS, SUPPORTED_IMAGE_FORMATS
+from config import BOT_TOKEN, BOT_MODE, WEBHOOK_URL, WEBHOOK_SECRET, TELEGRAM_API_URL, MERGE_MAX_FILES, BATCH_MAX_FILES, BATCH_COLLECT_DELAY, PROCESS_TIMEOUT, UPDATE_CLAIM_TTL, PARALLEL_ENCODE, WARM_UP, TELEGRAM_UPLOAD_LIMIT_MB, get_file_type, SUPPORTED_AUDIO_FORMATS, SUPPORTED_DOCUMENT_FORMATS, SUPPORTED_IMAGE_FORMATS
 from user_manager import user_manager
+from state_store import state_store
 from video_processor import VideoProcessor
+from image_processor import ImageProcessor
+from audio_processor import AUDIO_ENCODERS, AudioProcessor
+from video_split import split_video
+from batch_processor import BATCH_OPERATIONS, operations_for, run_batch
+from quality_governor import PREFERENCES
+from cost_model import estimate_cost, estimate_total
+from rate_limiter import admit_upload
+from job_manager import job_manager, Job, QueueFullError, UserLimitError
+from result_cache import result_cache
+from process_pool import process_pool
+from status_updater import status_updater
+from media_probe import probe_file, warm_up as warm_up_probes
+from ffmpeg_runner import FFmpegError
+from workspace import workspace_manager, InsufficientSpaceError
+from job_manager import current_job
+from metrics import registry, BYTES_OUT, UPLOADS_THROTTLED
+from instrumentation import stage, timed
+from http_server import HttpServer, LoopLagMonitor, health_handler, webhook_handler, webhook_route
 import asyncio
+import math
+import signal
+import time
+from typing import Optional, Tuple
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +58,9 @@ MAIN_MENU = [
     [
         InlineKeyboardButton("🖼️ Image Tools", callback_data="image_tools"),
         InlineKeyboardButton("🔊 Audio Tools", callback_data="audio_tools")
+    ],
+    [
+        InlineKeyboardButton("📦 Batch Mode", callback_data="batch_start")
     ]
 ]
 
@@ -49,9 +78,17 @@ VIDEO_MENU = [
         InlineKeyboardButton("🔊 Extract Audio", callback_data="video_audio_menu"),
         InlineKeyboardButton("🎵 Merge Video+Audio", callback_data="video_av_merge_menu")
     ],
+    [InlineKeyboardButton("⚙️ Encoding Quality", callback_data="video_quality_menu")],
     [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
 ]
 
+# Encoding quality preference (kept in the user's session)
+QUALITY_OPTIONS = {
+    'auto': "🤖 Auto - best quality the current load allows",
+    'fast': "⚡ Fast - smaller, quicker encodes",
+    'best': "💎 Best - slower, highest quality",
+}
+
 # Document Tools Menu
 DOCUMENT_MENU = [
     [
@@ -93,6 +130,31 @@ VIDEO_FORMATS = [
     [InlineKeyboardButton("🔙 Back", callback_data="video_tools")]
 ]
 
+# Video Split Modes (by part length, number of parts, or size per part)
+SPLIT_OPTIONS = [
+    [InlineKeyboardButton("⏱️ 1 min", callback_data="vsplit_time_60"),
+     InlineKeyboardButton("⏱️ 5 min", callback_data="vsplit_time_300"),
+     InlineKeyboardButton("⏱️ 10 min", callback_data="vsplit_time_600")],
+    [InlineKeyboardButton("2 parts", callback_data="vsplit_count_2"),
+     InlineKeyboardButton("3 parts", callback_data="vsplit_count_3"),
+     InlineKeyboardButton("4 parts", callback_data="vsplit_count_4")],
+    [InlineKeyboardButton(f"📦 {TELEGRAM_UPLOAD_LIMIT_MB} MB", callback_data=f"vsplit_size_{TELEGRAM_UPLOAD_LIMIT_MB}"),
+     InlineKeyboardButton("📦 25 MB", callback_data="vsplit_size_25"),
+     InlineKeyboardButton("📦 10 MB", callback_data="vsplit_size_10")],
+    [InlineKeyboardButton("🔙 Back", callback_data="video_tools")]
+]
+
+# Video Compression Targets
+COMPRESS_TARGETS = [
+    [InlineKeyboardButton("10 MB", callback_data="vcompress_10_two_pass"),
+     InlineKeyboardButton("25 MB", callback_data="vcompress_25_two_pass"),
+     InlineKeyboardButton("50 MB", callback_data="vcompress_50_two_pass")],
+    [InlineKeyboardButton("⚡ Fast 10 MB", callback_data="vcompress_10_fast"),
+     InlineKeyboardButton("⚡ Fast 25 MB", callback_data="vcompress_25_fast"),
+     InlineKeyboardButton("⚡ Fast 50 MB", callback_data="vcompress_50_fast")],
+    [InlineKeyboardButton("🔙 Back", callback_data="video_tools")]
+]
+
 # Document Format Selection
 DOCUMENT_FORMATS = [
     [InlineKeyboardButton("PDF", callback_data="dformat_pdf"),
@@ -113,6 +175,68 @@ IMAGE_FORMATS = [
     [InlineKeyboardButton("🔙 Back", callback_data="image_tools")]
 ]
 
+# Image Resize Options
+IMAGE_RESIZE_OPTIONS = [
+    [InlineKeyboardButton("25%", callback_data="iresize_pct_25"),
+     InlineKeyboardButton("50%", callback_data="iresize_pct_50"),
+     InlineKeyboardButton("75%", callback_data="iresize_pct_75")],
+    [InlineKeyboardButton("Max 1280px", callback_data="iresize_max_1280"),
+     InlineKeyboardButton("Max 1920px", callback_data="iresize_max_1920")],
+    [InlineKeyboardButton("🔙 Back", callback_data="image_tools")]
+]
+
+# Image Compression Targets
+IMAGE_COMPRESS_TARGETS = [
+    [InlineKeyboardButton("100 KB", callback_data="icompress_100"),
+     InlineKeyboardButton("250 KB", callback_data="icompress_250")],
+    [InlineKeyboardButton("500 KB", callback_data="icompress_500"),
+     InlineKeyboardButton("1 MB", callback_data="icompress_1024")],
+    [InlineKeyboardButton("🔙 Back", callback_data="image_tools")]
+]
+
+# Image Rotation (clockwise degrees)
+IMAGE_ROTATIONS = [
+    [InlineKeyboardButton("↩️ 90° Left", callback_data="irotate_270"),
+     InlineKeyboardButton("↪️ 90° Right", callback_data="irotate_90")],
+    [InlineKeyboardButton("🔃 180°", callback_data="irotate_180")],
+    [InlineKeyboardButton("🔙 Back", callback_data="image_tools")]
+]
+
+# Audio Tools Menu
+AUDIO_MENU = [
+    [
+        InlineKeyboardButton("🔄 Convert Format", callback_data="audio_convert_menu"),
+        InlineKeyboardButton("📢 Normalize Loudness", callback_data="audio_normalize")
+    ],
+    [InlineKeyboardButton("✂️ Trim Audio", callback_data="audio_trim_menu")],
+    [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+]
+
+def audio_format_rows(prefix: str):
+    """One button per supported audio format, three to a row"""
+    buttons = [InlineKeyboardButton(ext.lstrip('.').upper(), callback_data=f"{prefix}{ext.lstrip('.')}")
+               for ext in SUPPORTED_AUDIO_FORMATS]
+    return [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+
+# Audio Format Selection
+AUDIO_FORMATS = audio_format_rows("aformat_") + [[InlineKeyboardButton("🔙 Back", callback_data="audio_tools")]]
+
+# Audio extraction from a video: the track as it is, or converted
+EXTRACT_AUDIO_FORMATS = (
+    [[InlineKeyboardButton("🎵 Original track (no re-encoding)", callback_data="vaudio_original")]]
+    + audio_format_rows("vaudio_")
+    + [[InlineKeyboardButton("🔙 Back", callback_data="video_tools")]]
+)
+
+# Audio Trim Presets (start_end in seconds)
+AUDIO_TRIM_PRESETS = [
+    [InlineKeyboardButton("First 30s", callback_data="atrim_0_30"),
+     InlineKeyboardButton("First 60s", callback_data="atrim_0_60")],
+    [InlineKeyboardButton("Skip first 10s", callback_data="atrim_10_end"),
+     InlineKeyboardButton("Skip first 30s", callback_data="atrim_30_end")],
+    [InlineKeyboardButton("🔙 Back", callback_data="audio_tools")]
+]
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send welcome message and main menu"""
     welcome_text = """
@@ -122,11 +246,13 @@ I can help you convert and process:
 • 🎥 Videos (Convert, Merge, Split, Compress)
 • 📄 Documents (PDF, DOCX, TXT conversions)
 • 🖼️ Images (Convert, Resize, Compress)
-• 🔊 Audio (Extract, Convert)
+• 🔊 Audio (Extract, Convert, Normalize, Trim)
 
 Simply send me a file to get started!
+Send an album, or use /batch, to process many files at once.
     """
     
+    user_manager.seen(update.effective_user)
     keyboard = InlineKeyboardMarkup(MAIN_MENU)
     await update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=keyboard)
 
@@ -144,33 +270,109 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle photo files"""
     await handle_file(update, context, 'image')
 
+async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle audio files and voice messages"""
+    await handle_file(update, context, 'audio')
+
+def parse_timestamp(text: str) -> float:
+    """Seconds from '90', '1:30' or '1:02:03.5'"""
+    seconds = 0.0
+    for part in text.split(':'):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(text)
+    return seconds
+
+def parse_time_range(text: str) -> Tuple[float, Optional[float]]:
+    """(start, end) from 'start end' or 'start-end'; end may be 'end'"""
+    parts = text.replace('-', ' ').split()
+    if len(parts) != 2:
+        raise ValueError(text)
+    start = parse_timestamp(parts[0])
+    end = None if parts[1].lower() == 'end' else parse_timestamp(parts[1])
+    if end is not None and end <= start:
+        raise ValueError(text)
+    return start, end
+
+def format_timestamp(seconds: float) -> str:
+    minutes, secs = divmod(seconds, 60)
+    return f"{int(minutes)}:{secs:04.1f}" if secs % 1 else f"{int(minutes)}:{int(secs):02d}"
+
+async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Text replies: the part of an audio file to keep, after ✂️ Trim Audio"""
+    user_id = update.message.from_user.id
+    if not await user_manager.pop_session_key(user_id, 'awaiting_trim', False):
+        return
+    try:
+        start, end = parse_time_range(update.message.text)
+    except ValueError:
+        await user_manager.update_session(user_id, awaiting_trim=True)
+        await update.message.reply_text("❌ Send the start and end of the part to keep, e.g. 0:30 1:45 "
+                                        "(or 0:30 end).")
+        return
+    label = f"{format_timestamp(start)} - {format_timestamp(end) if end is not None else 'end'}"
+    end_data = f"{end:g}" if end is not None else "end"
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(f"✂️ Keep {label}",
+                                                           callback_data=f"atrim_{start:g}_{end_data}")],
+                                     [InlineKeyboardButton("🔙 Back", callback_data="audio_tools")]])
+    await update.message.reply_text("Trim the audio to this part?", reply_markup=keyboard)
+
+@timed()
 async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_type: str):
     """Generic file handler"""
     user_id = update.message.from_user.id
+    user_manager.seen(update.message.from_user)
     
     try:
-        # Download the file
-        if file_type == 'video':
+        if update.message.video:
             file_obj = update.message.video
             file_ext = '.mp4'
-        elif file_type == 'image':
+        elif update.message.photo:
             file_obj = update.message.photo[-1]  # Highest resolution
             file_ext = '.jpg'
-        else:  # document
+        elif update.message.voice:
+            file_obj = update.message.voice
+            file_ext = '.ogg'  # always Opus in Ogg
+        elif update.message.audio:
+            file_obj = update.message.audio
+            file_ext = os.path.splitext(file_obj.file_name or '')[1].lower() or '.mp3'
+        else:  # document (possibly a video or image sent as a file)
             file_obj = update.message.document
             file_ext = os.path.splitext(file_obj.file_name)[1].lower()
         
-        file = await file_obj.get_file()
-        file_path = get_temp_path(f"{user_id}_{file_obj.file_id}{file_ext}")
-        await file.download_to_drive(file_path)
+        file_ref = {
+            'file_id': file_obj.file_id,
+            'file_unique_id': file_obj.file_unique_id,
+            'file_ext': file_ext,
+            'file_type': file_type,
+            'original_filename': getattr(file_obj, 'file_name', 'file'),
+            'file_size': file_obj.file_size,
+            # What Telegram already knows, used to estimate job costs
+            'duration': getattr(file_obj, 'duration', None),
+            'width': getattr(file_obj, 'width', None),
+            'height': getattr(file_obj, 'height', None),
+        }
+        
+        wait = admit_upload(user_id, file_obj.file_size or 0)
+        if wait:
+            await refuse_upload(update, user_id, wait)
+            return
+        
+        # Videos sent during a merge session are collected instead of opening a menu
+        session = await user_manager.get_session(user_id)
+        if 'merge_session' in session and file_type == 'video':
+            await add_to_merge_session(update, user_id, session, file_ref)
+            return
         
-        # Store file info
-        context.user_data['current_file'] = file_path
-        context.user_data['file_type'] = file_type
-        context.user_data['original_filename'] = getattr(file_obj, 'file_name', 'file')
+        # Albums and files sent in batch mode are collected into one batch
+        if update.message.media_group_id or session.get('batch', {}).get('explicit'):
+            await add_to_batch(update, context, user_id, session, file_ref)
+            return
         
-        # Get file info
-        file_info = await VideoProcessor.get_file_info(file_path)
+        # Store file info; the download itself is deferred until a job needs it,
+        # so results already in the cache never touch the file at all
+        session.update(file_ref)
+        user_manager.save_session(user_id, session)
         
         # Show appropriate menu based on file type
         if file_type == 'video':
@@ -182,19 +384,21 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_t
         elif file_type == 'image':
             keyboard = InlineKeyboardMarkup(IMAGE_MENU)
             menu_text = "🖼️ Image Tools"
+        elif file_type == 'audio':
+            keyboard = InlineKeyboardMarkup(AUDIO_MENU)
+            menu_text = "🔊 Audio Tools"
         else:
             keyboard = InlineKeyboardMarkup(MAIN_MENU)
             menu_text = "Main Menu"
         
+        # Telegram already tells us the basics
         info_text = f"✅ {file_type.upper()} received!\n"
-        info_text += f"📁 Size: {file_info['size'] / 1024 / 1024:.2f} MB\n"
+        info_text += f"📁 Size: {(file_obj.file_size or 0) / 1024 / 1024:.2f} MB\n"
         
-        if 'duration' in file_info:
-            info_text += f"⏱️ Duration: {file_info['duration']:.2f}s\n"
-        if 'resolution' in file_info:
-            info_text += f"📊 Resolution: {file_info['resolution']}\n"
-        if 'pages' in file_info:
-            info_text += f"📄 Pages: {file_info['pages']}\n"
+        if getattr(file_obj, 'duration', None):
+            info_text += f"⏱️ Duration: {file_obj.duration:.2f}s\n"
+        if getattr(file_obj, 'width', None) and getattr(file_obj, 'height', None):
+            info_text += f"📊 Resolution: {file_obj.width}x{file_obj.height}\n"
         
         await update.message.reply_text(info_text + f"\nWhat would you like to do?", reply_markup=keyboard)
         
@@ -202,6 +406,254 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_t
         logger.error(f"Error handling file: {e}")
         await update.message.reply_text("❌ Error processing file!")
 
+def merge_keyboard(count: int) -> InlineKeyboardMarkup:
+    """Buttons shown while collecting videos to merge"""
+    buttons = [InlineKeyboardButton("❌ Cancel", callback_data="merge_cancel")]
+    if count >= 2:
+        buttons.insert(0, InlineKeyboardButton(f"✅ Merge {count} videos", callback_data="merge_done"))
+    return InlineKeyboardMarkup([buttons])
+
+async def start_merge_session(query, context):
+    """Start collecting videos to merge, seeded with the current video if any"""
+    session = []
+    source = await current_source(query.from_user.id)
+    if source is not None and source['file_type'] == 'video':
+        session.append(source)
+    await user_manager.update_session(query.from_user.id, merge_session=session)
+    
+    await query.edit_message_text(
+        f"🔀 Merge mode: send the videos to join, in order (up to {MERGE_MAX_FILES}).\n"
+        f"📥 {len(session)} video(s) collected so far.",
+        reply_markup=merge_keyboard(len(session))
+    )
+
+async def add_to_merge_session(update, user_id: int, session: dict, file_ref: dict):
+    """Add an incoming video to the user's merge session"""
+    merge = session['merge_session']
+    if len(merge) >= MERGE_MAX_FILES:
+        await update.message.reply_text(f"⚠️ At most {MERGE_MAX_FILES} videos can be merged at once.",
+                                        reply_markup=merge_keyboard(len(merge)))
+        return
+    
+    merge.append(file_ref)
+    user_manager.save_session(user_id, session)
+    await update.message.reply_text(f"📥 Video {len(merge)} added.", reply_markup=merge_keyboard(len(merge)))
+
+BATCH_IDLE_RESTART = 60  # seconds; an album arriving later than this starts a new batch
+
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start an explicit batch session"""
+    await update.message.reply_text(**await start_batch_session(update.message.from_user.id))
+
+async def start_batch_session(user_id: int) -> dict:
+    """Open an empty batch; returns the reply describing it"""
+    await user_manager.update_session(user_id, batch={'items': [], 'explicit': True, 'updated': time.time()})
+    return {'text': f"📦 Batch mode: send up to {BATCH_MAX_FILES} photos or documents, "
+                    "then pick one operation for all of them.",
+            'reply_markup': InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data="batch_cancel")]])}
+
+def batch_keyboard(items: list) -> InlineKeyboardMarkup:
+    """One button per operation that applies to every item of the batch"""
+    buttons = [[InlineKeyboardButton(BATCH_OPERATIONS[name].label, callback_data=f"batch_{name}")]
+               for name in operations_for(items)]
+    buttons.append([InlineKeyboardButton("❌ Cancel", callback_data="batch_cancel")])
+    return InlineKeyboardMarkup(buttons)
+
+# Pending "batch collected" replies by user, reset by every new file
+batch_menu_timers = {}
+
+async def add_to_batch(update, context, user_id: int, session: dict, file_ref: dict):
+    """Collect a file into the user's batch and (re)schedule the batch menu"""
+    batch = session.get('batch')
+    if batch is None or (not batch.get('explicit') and time.time() - batch['updated'] > BATCH_IDLE_RESTART):
+        batch = session['batch'] = {'items': [], 'explicit': False}
+    if len(batch['items']) >= BATCH_MAX_FILES:
+        if not batch.get('limit_warned'):
+            batch['limit_warned'] = True
+            await update.message.reply_text(f"⚠️ At most {BATCH_MAX_FILES} files per batch; the rest are ignored.")
+        user_manager.save_session(user_id, session)
+        return
+    batch['items'].append(file_ref)
+    batch['updated'] = time.time()
+    user_manager.save_session(user_id, session)
+    
+    pending = batch_menu_timers.pop(user_id, None)
+    if pending is not None:
+        pending.cancel()
+    batch_menu_timers[user_id] = context.application.create_task(
+        show_batch_menu(context.bot, update.message.chat_id, user_id))
+
+async def show_batch_menu(bot, chat_id: int, user_id: int):
+    """Once files stop arriving, offer the operations for the whole batch"""
+    await asyncio.sleep(BATCH_COLLECT_DELAY)
+    batch_menu_timers.pop(user_id, None)
+    items = (await user_manager.get_session(user_id)).get('batch', {}).get('items', [])
+    if not items:
+        return
+    text = f"📦 {len(items)} file(s) in this batch. Choose what to do with all of them:"
+    if not operations_for(items):
+        text = (f"📦 {len(items)} file(s) in this batch, but no operation applies to all of them.\n"
+                "Batches work with photos/images or documents of one kind.")
+    await bot.send_message(chat_id, text, reply_markup=batch_keyboard(items))
+
+def quality_keyboard(current: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(("✅ " if name == current else "") + label, callback_data=f"vquality_{name}")]
+         for name, label in QUALITY_OPTIONS.items()]
+        + [[InlineKeyboardButton("🔙 Back", callback_data="video_tools")]])
+
+async def quality_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the encoding quality preference"""
+    current = (await user_manager.get_session(update.message.from_user.id)).get('quality', 'auto')
+    await update.message.reply_text("⚙️ Encoding quality for video conversions:", reply_markup=quality_keyboard(current))
+
+# Until when each user has been told they are sending too fast (one notice per wait)
+throttle_notices = {}
+
+async def refuse_upload(update, user_id: int, wait: float):
+    """Tell a user over their upload limits to slow down, once per throttling period"""
+    UPLOADS_THROTTLED.inc()
+    logger.info(f"Upload of user {user_id} throttled for {wait:.0f}s")
+    now = time.monotonic()
+    if throttle_notices.get(user_id, 0) > now:
+        return
+    throttle_notices[user_id] = now + wait
+    await update.message.reply_text(f"🐢 You are sending files faster than I can take them. "
+                                    f"Please wait {math.ceil(wait)}s before sending more.")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the user their job counts and recent queue waits"""
+    user_id = update.message.from_user.id
+    stats = await user_manager.get_stats(user_id) or {}
+    waits = job_manager.wait_stats(user_id)
+    text = f"📊 Jobs: {stats.get('jobs', 0)} ({stats.get('failed_jobs', 0)} failed)\n"
+    if waits:
+        text += (f"🕒 Queue wait over your last {waits['jobs']} job(s): average {waits['mean_wait_s']:.1f}s, "
+                 f"longest {waits['max_wait_s']:.1f}s")
+    else:
+        text += "🕒 No queue waits recorded yet."
+    await update.message.reply_text(text)
+
+async def current_source(user_id: int) -> dict:
+    """Snapshot of the user's current file, or None if nothing was sent yet"""
+    session = await user_manager.get_session(user_id)
+    if 'file_id' not in session:
+        return None
+    source = {key: session.get(key) for key in
+              ('file_id', 'file_unique_id', 'file_ext', 'file_type', 'original_filename', 'file_size',
+               'duration', 'width', 'height', 'pages')}
+    return source
+
+async def ensure_local_file(bot, source: dict, user_id: int) -> str:
+    """Local path of the source file, downloading it unless another job already did
+
+    The download is shared between jobs on the same file and held until the
+    current job finishes.
+    """
+    job = current_job.get()
+    if job is not None:
+        # Small single-file jobs get a workspace on tmpfs when that is enabled
+        workspace_manager.for_job(job, expected_bytes=source.get('file_size'))
+    
+    async def download(path):
+        async with stage("download", bytes_in=source.get('file_size') or 0):
+            file = await bot.get_file(source['file_id'])
+            await file.download_to_drive(path)
+    
+    return await workspace_manager.acquire_source(source['file_unique_id'], source['file_ext'],
+                                                  source.get('file_size'), download)
+
+async def send_video(bot, chat_id: int, caption: str, path: str = None, file_id: str = None,
+                     filename: str = None):
+    """Send an MP4 as a streamable video, with its duration, size and a thumbnail"""
+    if file_id:
+        async with stage("send_video_cached"):
+            return await bot.send_video(chat_id=chat_id, video=file_id, caption=caption, supports_streaming=True)
+    info = await probe_file(path)
+    thumbnail = None
+    try:
+        thumbnail_path = await VideoProcessor.make_thumbnail(path, info.get('duration'))
+        with open(thumbnail_path, 'rb') as thumb:
+            thumbnail = InputFile(thumb.read(), filename="thumbnail.jpg")
+        os.unlink(thumbnail_path)
+    except (FFmpegError, OSError) as e:
+        logger.warning(f"No thumbnail for {path}: {e}")
+    BYTES_OUT.inc(os.path.getsize(path), stage="send_video")
+    async with stage("send_video"):
+        with open(path, 'rb') as file:
+            return await bot.send_video(
+                chat_id=chat_id, caption=caption, video=InputFile(file, filename=filename),
+                duration=round(info['duration']) if info.get('duration') else None,
+                width=info.get('width'), height=info.get('height'), supports_streaming=True,
+                thumbnail=thumbnail)
+
+async def send_output(bot, chat_id: int, kind: str, caption: str, path: str = None,
+                      file_id: str = None, filename: str = None):
+    """Send a result as a photo, video or document, either uploading path or reusing file_id"""
+    if kind == 'video':
+        return await send_video(bot, chat_id, caption, path, file_id, filename)
+    send = bot.send_photo if kind == 'photo' else bot.send_document
+    field = 'photo' if kind == 'photo' else 'document'
+    if file_id:
+        async with stage(f"send_{kind}_cached"):
+            return await send(chat_id=chat_id, caption=caption, **{field: file_id})
+    BYTES_OUT.inc(os.path.getsize(path), stage=f"send_{kind}")
+    async with stage(f"send_{kind}"):
+        with open(path, 'rb') as file:
+            payload = InputFile(file) if kind == 'photo' else InputFile(file, filename=filename)
+            return await send(chat_id=chat_id, caption=caption, **{field: payload})
+
+def sent_file_id(message, kind: str) -> str:
+    """file_id Telegram assigned to the file we just sent"""
+    if kind == 'photo':
+        return message.photo[-1].file_id
+    if kind == 'video':
+        # Telegram keeps files it cannot play as documents
+        return (message.video or message.document).file_id
+    return message.document.file_id
+
+async def answer_from_cache(query, context, source: dict, operation: str, params: dict,
+                            kind: str, filename: Optional[str], caption: str, description: str) -> bool:
+    """Send a cached result right from the handler, so a repeat request never waits in the queue
+
+    Returns False on a miss; the caller then queues a job that ends in deliver_cached.
+    """
+    key = result_cache.make_key(source['file_unique_id'], operation, params)
+    entry = result_cache.get(key)
+    if entry and entry['kind'] != kind:
+        # Produced before results of this operation were sent another way
+        result_cache.invalidate(key)
+        entry = None
+    if entry is None:
+        return False
+    chat_id = query.message.chat_id
+    try:
+        await send_output(context.bot, chat_id, entry['kind'], caption, file_id=entry['file_id'])
+    except BadRequest as e:
+        logger.warning(f"Cached file_id rejected ({e}), falling back")
+        if not (entry['path'] and os.path.exists(entry['path'])):
+            result_cache.invalidate(key)
+            return False
+        message = await send_output(context.bot, chat_id, entry['kind'], caption,
+                                    path=entry['path'], filename=filename)
+        result_cache.refresh(key, sent_file_id(message, entry['kind']))
+    logger.info(f"Served {operation} {params} from cache")
+    await final_status(query, f"✅ {description} done!")
+    return True
+
+async def deliver_cached(context, chat_id: int, user_id: int, source: dict, operation: str, params: dict,
+                         produce, kind: str, filename: Optional[str], caption: str):
+    """Convert, send and cache a result answer_from_cache did not have"""
+    key = result_cache.make_key(source['file_unique_id'], operation, params)
+    input_path = await ensure_local_file(context.bot, source, user_id)
+    output_path = await produce(input_path)
+    message = await send_output(context.bot, chat_id, kind, caption, path=output_path, filename=filename)
+    job = current_job.get()
+    if job is not None and job.meta.get('quality_degraded'):
+        logger.info(f"Not caching {operation} {params}: quality was lowered for load")
+        return
+    result_cache.put(key, sent_file_id(message, kind), kind, output_path)
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle inline button clicks"""
     query = update.callback_query
@@ -227,15 +679,81 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = InlineKeyboardMarkup(IMAGE_MENU)
         await query.edit_message_text("🖼️ Image Tools - Choose an action:", reply_markup=keyboard)
     
+    elif data == "audio_tools":
+        keyboard = InlineKeyboardMarkup(AUDIO_MENU)
+        await query.edit_message_text("🔊 Audio Tools - Choose an action:", reply_markup=keyboard)
+    
     # Video conversions
     elif data == "video_convert_menu":
         keyboard = InlineKeyboardMarkup(VIDEO_FORMATS)
         await query.edit_message_text("Select output video format:", reply_markup=keyboard)
     
+    elif data == "video_quality_menu":
+        current = (await user_manager.get_session(user_id)).get('quality', 'auto')
+        await query.edit_message_text("⚙️ Encoding quality for video conversions:",
+                                      reply_markup=quality_keyboard(current))
+    
+    elif data.startswith("vquality_"):
+        preference = data.replace("vquality_", "")
+        if preference not in PREFERENCES:
+            preference = 'auto'
+        await user_manager.update_session(user_id, quality=preference)
+        await query.edit_message_text(f"⚙️ Encoding quality set to {QUALITY_OPTIONS[preference]}",
+                                      reply_markup=InlineKeyboardMarkup(VIDEO_MENU))
+    
     elif data.startswith("vformat_"):
         format_type = data.replace("vformat_", "")
         await process_video_conversion(query, context, format_type)
     
+    elif data == "video_merge_menu":
+        await start_merge_session(query, context)
+    
+    elif data == "merge_done":
+        await process_video_merge(query, context)
+    
+    elif data == "merge_cancel":
+        await user_manager.pop_session_key(user_id, 'merge_session')
+        await query.edit_message_text("🔀 Merge cancelled.")
+    
+    # Batch mode
+    elif data == "batch_start":
+        await query.edit_message_text(**await start_batch_session(user_id))
+    
+    elif data == "batch_cancel":
+        await user_manager.pop_session_key(user_id, 'batch')
+        await query.edit_message_text("📦 Batch cancelled.")
+    
+    elif data.startswith("batch_"):
+        await process_batch(query, context, data.replace("batch_", ""))
+    
+    elif data == "video_split_menu":
+        keyboard = InlineKeyboardMarkup(SPLIT_OPTIONS)
+        await query.edit_message_text(
+            "Split the video into:\n"
+            "• ⏱️ parts of a given length\n"
+            "• a given number of parts\n"
+            "• 📦 parts of at most a given size\n"
+            "Cuts land on keyframes, so parts are not re-encoded and lengths vary slightly.",
+            reply_markup=keyboard
+        )
+    
+    elif data.startswith("vsplit_"):
+        mode, value = data.replace("vsplit_", "").split("_", 1)
+        await process_video_split(query, context, mode, int(value))
+    
+    elif data == "video_compress_menu":
+        keyboard = InlineKeyboardMarkup(COMPRESS_TARGETS)
+        await query.edit_message_text(
+            "Select target size:\n"
+            "• Plain sizes use two-pass encoding and land close to the target\n"
+            "• ⚡ Fast is a single pass that stays under the target",
+            reply_markup=keyboard
+        )
+    
+    elif data.startswith("vcompress_"):
+        target_mb, mode = data.replace("vcompress_", "").split("_", 1)
+        await process_video_compression(query, context, int(target_mb), mode)
+    
     # Document conversions
     elif data == "doc_convert_menu":
         keyboard = InlineKeyboardMarkup(DOCUMENT_FORMATS)
@@ -254,6 +772,62 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         format_type = data.replace("iformat_", "")
         await process_image_conversion(query, context, format_type)
     
+    elif data == "img_resize_menu":
+        keyboard = InlineKeyboardMarkup(IMAGE_RESIZE_OPTIONS)
+        await query.edit_message_text("Select new size:", reply_markup=keyboard)
+    
+    elif data.startswith("iresize_"):
+        mode, value = data.replace("iresize_", "").split("_", 1)
+        await process_image_edit(query, context, "resize", {mode: int(value)})
+    
+    elif data == "img_compress_menu":
+        keyboard = InlineKeyboardMarkup(IMAGE_COMPRESS_TARGETS)
+        await query.edit_message_text("Select maximum file size:", reply_markup=keyboard)
+    
+    elif data.startswith("icompress_"):
+        target_kb = int(data.replace("icompress_", ""))
+        await process_image_edit(query, context, "compress", {'target_kb': target_kb})
+    
+    elif data == "img_rotate_menu":
+        keyboard = InlineKeyboardMarkup(IMAGE_ROTATIONS)
+        await query.edit_message_text("Select rotation:", reply_markup=keyboard)
+    
+    elif data.startswith("irotate_"):
+        degrees = int(data.replace("irotate_", ""))
+        await process_image_edit(query, context, "rotate", {'degrees': degrees})
+    
+    # Audio
+    elif data == "video_audio_menu":
+        keyboard = InlineKeyboardMarkup(EXTRACT_AUDIO_FORMATS)
+        await query.edit_message_text("Extract the soundtrack as:", reply_markup=keyboard)
+    
+    elif data.startswith("vaudio_"):
+        audio_format = data.replace("vaudio_", "")
+        await process_audio_job(query, context, "convert",
+                                {'format': None if audio_format == "original" else audio_format}, 'video')
+    
+    elif data == "audio_convert_menu":
+        keyboard = InlineKeyboardMarkup(AUDIO_FORMATS)
+        await query.edit_message_text("Select output audio format:", reply_markup=keyboard)
+    
+    elif data.startswith("aformat_"):
+        await process_audio_job(query, context, "convert", {'format': data.replace("aformat_", "")})
+    
+    elif data == "audio_normalize":
+        await process_audio_job(query, context, "normalize", {})
+    
+    elif data == "audio_trim_menu":
+        await user_manager.update_session(user_id, awaiting_trim=True)
+        keyboard = InlineKeyboardMarkup(AUDIO_TRIM_PRESETS)
+        await query.edit_message_text("✂️ Choose a cut, or send the part to keep as start and end, "
+                                      "e.g. 0:30 1:45", reply_markup=keyboard)
+    
+    elif data.startswith("atrim_"):
+        start, end = data.replace("atrim_", "").split("_")
+        await user_manager.pop_session_key(user_id, 'awaiting_trim')
+        await process_audio_job(query, context, "trim",
+                                {'start': float(start), 'end': None if end == "end" else float(end)})
+    
     # Specific document operations
     elif data == "doc_pdf_docx":
         await process_document_conversion(query, context, "docx")
@@ -263,138 +837,599 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif data == "doc_docx_pdf":
         await process_document_conversion(query, context, "pdf")
+    
+    # Job control
+    elif data.startswith("cancel_job_"):
+        job_id = int(data.replace("cancel_job_", ""))
+        if await job_manager.cancel(job_id, user_id):
+            await final_status(query, "🛑 Job cancelled.")
+        else:
+            await query.edit_message_text("ℹ️ This job has already finished.")
+
+def cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    """Keyboard with a single cancel button for a job"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_job_{job_id}")]])
+
+async def enqueue_job(query, context, description, runner, expected_bytes=None, cost=None, inputs=1):
+    """Submit a job to the worker pool and tell the user where it stands
+
+    expected_bytes and cost default to those of the user's current file;
+    inputs is the number of files the job downloads.
+    """
+    if expected_bytes is None or cost is None:
+        source = await current_source(query.from_user.id)
+        expected_bytes = (source or {}).get('file_size') or 0 if expected_bytes is None else expected_bytes
+        cost = estimate_cost(source, description) if cost is None else cost
+    
+    # A double tap, or the same press delivered to two instances, must not start two jobs
+    claim_key = f"job:{query.message.chat_id}:{query.message.message_id}"
+    if not await state_store.claim(claim_key, PROCESS_TIMEOUT + 60):
+        logger.info(f"Ignoring duplicate request {claim_key}: {description}")
+        return None
+    try:
+        # Refuse up front rather than failing halfway through a download
+        await workspace_manager.ensure_space(expected_bytes)
+    except InsufficientSpaceError as e:
+        logger.warning(f"Refusing job for user {query.from_user.id}: {e}")
+        state_store.release(claim_key)
+        await query.edit_message_text("💾 Not enough free disk space right now. Please try again later.")
+        return None
+    try:
+        job = job_manager.submit(query.from_user.id, query.message.chat_id, description, runner, cost)
+    except UserLimitError:
+        state_store.release(claim_key)
+        await query.edit_message_text(
+            f"⏳ You already have {job_manager.max_queued_per_user} jobs waiting.\n"
+            "Please wait for them to finish before starting more."
+        )
+        return None
+    except QueueFullError:
+        state_store.release(claim_key)
+        await query.edit_message_text(
+            f"⏳ The bot is busy right now ({job_manager.queue_depth} jobs waiting).\n"
+            "Please try again in a few minutes."
+        )
+        return None
+    
+    workspace_manager.plan_job(job, expected_bytes, inputs)
+    job.on_finish(lambda: state_store.release(claim_key))
+    job.on_finish(lambda: user_manager.job_finished(job.user_id, job.state))
+    job.on_finish(lambda: status_updater.discard(query.message.chat_id, query.message.message_id))
+    
+    position = job_manager.position(job)
+    if position:
+        # A job a worker already picked up may have posted progress by now
+        await query.edit_message_text(
+            f"🕒 {description} queued - you are #{position} in queue.",
+            reply_markup=cancel_keyboard(job.id)
+        )
+    context.application.create_task(report_job_outcome(query, job))
+    return job
+
+def progress_reporter(query, job: Job, title: str):
+    """Progress callback showing '<title> N%' on the job's message, through the status updater"""
+    keyboard = cancel_keyboard(job.id)
+    
+    async def progress_callback(progress, status):
+        status_updater.update(query.get_bot(), query.message.chat_id, query.message.message_id,
+                              f"{title} {progress}%\n{status}", keyboard)
+    return progress_callback
+
+async def final_status(query, text: str):
+    """Replace a job's progress message for good: queued progress updates are dropped first"""
+    job = current_job.get()
+    if job is not None:
+        job.reported = True
+    await status_updater.close(query.message.chat_id, query.message.message_id)
+    await query.edit_message_text(text)
+
+async def report_job_outcome(query, job: Job):
+    """Tell the user about jobs that ended without reporting themselves"""
+    await job.done.wait()
+    if job.reported:
+        return
+    try:
+        if job.state == Job.DONE:
+            # The result went out as its own message; retire the progress bar and its Cancel button
+            await final_status(query, f"✅ {job.description} done!")
+        elif job.state == Job.TIMEOUT:
+            await final_status(query, "⌛ The job took too long and was stopped.")
+        elif job.state == Job.FAILED:
+            await final_status(query, "❌ The job failed unexpectedly!")
+    except Exception as e:
+        logger.warning(f"Could not report outcome of job {job.id}: {e}")
 
 async def process_video_conversion(query, context, output_format):
-    """Process video conversion"""
-    if 'current_file' not in context.user_data:
+    """Queue a video conversion job"""
+    source = await current_source(query.from_user.id)
+    if source is None:
         await query.edit_message_text("❌ Please send a video file first!")
         return
+    quality = (await user_manager.get_session(query.from_user.id)).get('quality', 'auto')
+    description = f"Video conversion to {output_format.upper()}"
+    params = {'format': output_format, 'quality': quality}
+    # Telegram streams MP4 only; other containers are plain files to it
+    kind = 'video' if output_format == 'mp4' else 'document'
+    filename, caption = f"converted.{output_format}", f"✅ Video converted to {output_format.upper()}!"
+    if await answer_from_cache(query, context, source, "convert_video", params, kind, filename, caption,
+                               description):
+        return
+    
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, "🔄 Converting video...")
+        
+        async def produce(input_path):
+            return await VideoProcessor.convert_video(input_path, output_format, quality, progress_callback,
+                                                      parallel=PARALLEL_ENCODE)
+        
+        try:
+            await deliver_cached(
+                context, query.message.chat_id, job.user_id, source,
+                "convert_video", params, produce, kind, filename, caption
+            )
+            
+        except Exception as e:
+            logger.error(f"Video conversion error: {e}")
+            await final_status(query, "❌ Error during video conversion!")
     
-    await query.edit_message_text("🔄 Starting video conversion...")
+    await enqueue_job(query, context, description, run,
+                      cost=estimate_cost(source, 'convert_video'))
+
+async def process_video_merge(query, context):
+    """Queue a merge of the videos collected in the merge session"""
+    sources = await user_manager.pop_session_key(query.from_user.id, 'merge_session', [])
+    if len(sources) < 2:
+        await query.edit_message_text("❌ Send at least two videos to merge!")
+        return
     
-    async def progress_callback(progress, status):
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, "🔄 Merging videos...")
+        
         try:
-            await query.edit_message_text(f"🔄 Converting video... {progress}%\n{status}")
-        except:
-            pass
+            await progress_callback(0, "Downloading videos...")
+            input_paths = [await ensure_local_file(context.bot, source, job.user_id) for source in sources]
+            output_path = await VideoProcessor.merge_videos(input_paths, progress_callback)
+            
+            await send_output(context.bot, query.message.chat_id, 'document',
+                              f"✅ {len(sources)} videos merged!", path=output_path,
+                              filename=f"merged{os.path.splitext(output_path)[1]}")
+            
+        except Exception as e:
+            logger.error(f"Video merge error: {e}")
+            await final_status(query, "❌ Error during video merge!")
     
-    try:
-        output_path = await VideoProcessor.convert_video(
-            context.user_data['current_file'],
-            output_format,
-            "high",
-            progress_callback
-        )
+    await enqueue_job(query, context, f"Merge of {len(sources)} videos", run,
+                      expected_bytes=sum(source['file_size'] or 0 for source in sources),
+                      cost=estimate_total(sources, 'merge_videos'), inputs=len(sources))
+
+async def process_video_split(query, context, mode, value):
+    """Queue a keyframe split of the current video; parts are sent as ffmpeg finishes them"""
+    source = await current_source(query.from_user.id)
+    if source is None or source.get('file_type') != 'video':
+        await query.edit_message_text("❌ Please send a video file first!")
+        return
+    if mode == 'size' and source['file_size'] and source['file_size'] <= value * 1024 * 1024:
+        await query.edit_message_text(f"ℹ️ This video is already smaller than {value} MB.")
+        return
+    
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, "✂️ Splitting video...")
+        stem = os.path.splitext(source.get('original_filename') or "")[0] or "video"
+        sent = 0
         
-        # Send the converted file
-        with open(output_path, 'rb') as file:
-            await context.bot.send_document(
-                chat_id=query.message.chat_id,
-                document=InputFile(file, filename=f"converted.{output_format}"),
-                caption=f"✅ Video converted to {output_format.upper()}!"
-            )
+        try:
+            input_path = await ensure_local_file(context.bot, source, job.user_id)
+            async for part in split_video(input_path, mode, value, progress_callback):
+                await send_output(context.bot, query.message.chat_id, 'document',
+                                  f"🎞️ Part {part['index']} ({format_timestamp(part['start'])} - "
+                                  f"{format_timestamp(part['end'])})", path=part['path'],
+                                  filename=f"{stem}_part{part['index']:02d}{source['file_ext']}")
+                os.unlink(part['path'])  # free the space while later parts are still being written
+                sent += 1
+            await final_status(query, f"✅ Video split into {sent} parts!")
+            
+        except ValueError as e:
+            await final_status(query, f"❌ {e}")
+        except Exception as e:
+            logger.error(f"Video split error: {e}")
+            await final_status(query, f"❌ Error during video split after {sent} parts!" if sent
+                               else "❌ Error during video split!")
+    
+    await enqueue_job(query, context, "Video split", run, cost=estimate_cost(source, 'split_video'))
+
+async def process_batch(query, context, operation_name):
+    """Queue one operation over every file of the user's batch, delivered as a ZIP (or one PDF)"""
+    batch = await user_manager.pop_session_key(query.from_user.id, 'batch') or {}
+    items = batch.get('items', [])
+    if not items:
+        await query.edit_message_text("❌ This batch is empty or was already processed. Send the files again!")
+        return
+    operation = BATCH_OPERATIONS[operation_name]
+    
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, f"📦 {operation.label}...")
         
-        # Clean up
-        os.unlink(output_path)
+        try:
+            result = await run_batch(items, operation_name,
+                                     lambda item: ensure_local_file(context.bot, item, job.user_id),
+                                     progress_callback)
+            caption = f"✅ {operation.label}: {result.succeeded} of {len(items)} files done."
+            if result.failures:
+                names = ", ".join(name for name, _ in result.failures[:10])
+                caption += f"\n⚠️ {len(result.failures)} failed: {names}"
+            filename = "batch.pdf" if operation.combine else "batch.zip"
+            await send_output(context.bot, query.message.chat_id, 'document', caption,
+                              path=result.output_path, filename=filename)
+            await final_status(query, f"✅ {operation.label}: {result.succeeded} of {len(items)} files done.")
+            
+        except Exception as e:
+            logger.error(f"Batch {operation_name} error: {e}")
+            await final_status(query, "❌ Error while processing the batch!")
+    
+    await enqueue_job(query, context, f"Batch {operation.label.lower()} ({len(items)} files)", run,
+                      expected_bytes=sum(item.get('file_size') or 0 for item in items),
+                      cost=estimate_total(items, operation_name), inputs=len(items))
+
+async def process_video_compression(query, context, target_mb, mode):
+    """Queue a video compression job"""
+    source = await current_source(query.from_user.id)
+    if source is None:
+        await query.edit_message_text("❌ Please send a video file first!")
+        return
+    if source['file_size'] and source['file_size'] <= target_mb * 1024 * 1024:
+        await query.edit_message_text(f"ℹ️ This video is already smaller than {target_mb} MB.")
+        return
+    description = f"Video compression to {target_mb} MB"
+    params = {'target_mb': target_mb, 'mode': mode}
+    caption = f"✅ Video compressed to under {target_mb} MB!"
+    if await answer_from_cache(query, context, source, "compress_video", params, 'video', "compressed.mp4",
+                               caption, description):
+        return
+    
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, "🔄 Compressing video...")
         
-    except Exception as e:
-        logger.error(f"Video conversion error: {e}")
-        await query.edit_message_text("❌ Error during video conversion!")
+        async def produce(input_path):
+            return await VideoProcessor.compress_video(input_path, target_mb, progress_callback, mode,
+                                                       parallel=PARALLEL_ENCODE)
+        
+        try:
+            await deliver_cached(
+                context, query.message.chat_id, job.user_id, source,
+                "compress_video", params, produce, 'video', "compressed.mp4", caption
+            )
+            
+        except Exception as e:
+            logger.error(f"Video compression error: {e}")
+            await final_status(query, "❌ Error during video compression!")
+    
+    await enqueue_job(query, context, description, run,
+                      cost=estimate_cost(source, 'compress_video'))
 
 async def process_document_conversion(query, context, output_format):
-    """Process document conversion"""
-    if 'current_file' not in context.user_data:
+    """Queue a document conversion job"""
+    source = await current_source(query.from_user.id)
+    if source is None:
         await query.edit_message_text("❌ Please send a document file first!")
         return
+    description = f"Document conversion to {output_format.upper()}"
+    params = {'format': output_format}
+    filename, caption = f"converted.{output_format}", f"✅ Document converted to {output_format.upper()}!"
+    if await answer_from_cache(query, context, source, "convert_document", params, 'document', filename, caption,
+                               description):
+        return
     
-    await query.edit_message_text("🔄 Starting document conversion...")
-    
-    async def progress_callback(progress, status):
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, "🔄 Converting document...")
+        
+        async def produce(input_path):
+            return await VideoProcessor.convert_document(input_path, output_format, progress_callback)
+        
         try:
-            await query.edit_message_text(f"🔄 Converting document... {progress}%\n{status}")
-        except:
-            pass
+            await deliver_cached(
+                context, query.message.chat_id, job.user_id, source,
+                "convert_document", params, produce, 'document', filename, caption
+            )
+            
+        except Exception as e:
+            logger.error(f"Document conversion error: {e}")
+            await final_status(query, "❌ Error during document conversion!")
     
-    try:
-        output_path = await VideoProcessor.convert_document(
-            context.user_data['current_file'],
-            output_format,
-            progress_callback
-        )
+    await enqueue_job(query, context, description, run)
+
+async def process_image_conversion(query, context, output_format):
+    """Queue an image conversion job"""
+    source = await current_source(query.from_user.id)
+    if source is None:
+        await query.edit_message_text("❌ Please send an image file first!")
+        return
+    description = f"Image conversion to {output_format.upper()}"
+    params, filename = {'format': output_format}, f"converted.{output_format}"
+    # PDFs go out as documents, everything else as a photo
+    if output_format == 'pdf':
+        kind, caption = 'document', "✅ Image converted to PDF!"
+    else:
+        kind, caption = 'photo', f"✅ Image converted to {output_format.upper()}!"
+    if await answer_from_cache(query, context, source, "convert_image", params, kind, filename, caption,
+                               description):
+        return
+    
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, "🔄 Converting image...")
+        
+        async def produce(input_path):
+            return await VideoProcessor.convert_document(input_path, output_format, progress_callback)
         
-        # Send the converted file
-        with open(output_path, 'rb') as file:
-            await context.bot.send_document(
-                chat_id=query.message.chat_id,
-                document=InputFile(file, filename=f"converted.{output_format}"),
-                caption=f"✅ Document converted to {output_format.upper()}!"
+        try:
+            await deliver_cached(
+                context, query.message.chat_id, job.user_id, source,
+                "convert_image", params, produce, kind, filename, caption
             )
+            
+        except Exception as e:
+            logger.error(f"Image conversion error: {e}")
+            await final_status(query, "❌ Error during image conversion!")
+    
+    await enqueue_job(query, context, description, run)
+
+AUDIO_PROGRESS = {'convert': "🔄 Converting audio...", 'normalize': "📢 Normalizing loudness...",
+                  'trim': "✂️ Trimming audio..."}
+AUDIO_PAST_TENSE = {'normalize': "normalized", 'trim': "trimmed"}
+
+async def process_audio_job(query, context, operation, params, source_type='audio'):
+    """Queue an audio convert (or extraction from a video), normalize or trim job"""
+    source = await current_source(query.from_user.id)
+    if source is None or source.get('file_type') != source_type:
+        await query.edit_message_text(f"❌ Please send {'a video' if source_type == 'video' else 'an audio file'} first!")
+        return
+    if operation == "convert" and source_type == 'video':
+        caption = "✅ Audio extracted!"
+    elif operation == "convert":
+        caption = f"✅ Audio converted to {params['format'].upper()}!"
+    elif operation == "normalize":
+        caption = "✅ Loudness normalized!"
+    else:
+        caption = "✅ Audio trimmed!"
+    
+    # Named after the original file; left to the output path when its format
+    # is only known after probing (original track, unusual input formats)
+    stem = os.path.splitext(source.get('original_filename') or "")[0] or "audio"
+    ext = params.get('format') or source['file_ext'].lstrip('.')
+    filename = None
+    if operation == "convert" and params['format']:
+        filename = f"{stem}.{ext}"
+    elif operation != "convert" and ext in AUDIO_ENCODERS:
+        filename = f"{stem}_{AUDIO_PAST_TENSE[operation]}.{ext}"
+    if await answer_from_cache(query, context, source, f"audio_{operation}", params, 'document', filename,
+                               caption, f"Audio {operation}"):
+        return
+    
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, AUDIO_PROGRESS[operation])
         
-        # Clean up
-        os.unlink(output_path)
+        async def produce(input_path):
+            if operation == "normalize":
+                return await AudioProcessor.normalize(input_path, progress_callback)
+            if operation == "trim":
+                return await AudioProcessor.trim(input_path, params['start'], params['end'], progress_callback)
+            return await AudioProcessor.convert(input_path, params['format'], progress_callback)
         
-    except Exception as e:
-        logger.error(f"Document conversion error: {e}")
-        await query.edit_message_text("❌ Error during document conversion!")
+        try:
+            await deliver_cached(
+                context, query.message.chat_id, job.user_id, source,
+                f"audio_{operation}", params, produce,
+                'document', filename, caption
+            )
+        except ValueError as e:
+            await final_status(query, f"❌ {e}")
+        except Exception as e:
+            logger.error(f"Audio {operation} error: {e}")
+            await final_status(query, f"❌ Error during audio {operation}!")
+    
+    await enqueue_job(query, context, f"Audio {operation}", run,
+                      cost=estimate_cost(source, f"audio_{operation}"))
 
-async def process_image_conversion(query, context, output_format):
-    """Process image conversion"""
-    if 'current_file' not in context.user_data:
+PAST_TENSE = {'resize': "resized", 'compress': "compressed", 'rotate': "rotated"}
+
+async def process_image_edit(query, context, operation, params):
+    """Queue an image resize, compress or rotate job"""
+    source = await current_source(query.from_user.id)
+    if source is None or source.get('file_type') != 'image':
         await query.edit_message_text("❌ Please send an image file first!")
         return
+    # Compression always yields JPEG; PNG/WEBP keep their format otherwise
+    ext = source.get('file_ext', '').lower()
+    if operation == "compress" or ext not in ('.png', '.webp'):
+        ext = '.jpg'
+    captions = {
+        'resize': "✅ Image resized!",
+        'compress': f"✅ Image compressed to under {params.get('target_kb')} KB!",
+        'rotate': "✅ Image rotated!",
+    }
+    # Sent as a document so Telegram does not recompress the result
+    filename, caption = f"{PAST_TENSE[operation]}{ext}", captions[operation]
+    if await answer_from_cache(query, context, source, f"image_{operation}", params, 'document', filename,
+                               caption, f"Image {operation}"):
+        return
     
-    await query.edit_message_text("🔄 Starting image conversion...")
-    
-    async def progress_callback(progress, status):
+    async def run(job: Job):
+        progress_callback = progress_reporter(query, job, "🔄 Processing image...")
+        
+        async def produce(input_path):
+            if operation == "resize":
+                return await ImageProcessor.resize(input_path, params.get('pct'), params.get('max'), progress_callback)
+            if operation == "compress":
+                return await ImageProcessor.compress(input_path, params['target_kb'], progress_callback)
+            return await ImageProcessor.rotate(input_path, params['degrees'], progress_callback)
+        
         try:
-            await query.edit_message_text(f"🔄 Converting image... {progress}%\n{status}")
-        except:
-            pass
+            await deliver_cached(
+                context, query.message.chat_id, job.user_id, source,
+                f"image_{operation}", params, produce, 'document', filename, caption
+            )
+            
+        except Exception as e:
+            logger.error(f"Image {operation} error: {e}")
+            await final_status(query, f"❌ Error during image {operation}!")
     
+    await enqueue_job(query, context, f"Image {operation}", run)
+
+http_server = HttpServer()
+loop_lag = LoopLagMonitor()
+
+def health_checks() -> dict:
+    """Liveness details reported by /health"""
+    return {
+        'mode': BOT_MODE,
+        'queue_depth': job_manager.queue_depth,
+        'active_jobs': job_manager.active_count,
+        'job_workers': job_manager.workers_alive,
+        'pool_workers': process_pool.alive_workers,
+        # The pool may still be warming up, or start on first use with WARM_UP off
+        'workers_ok': (job_manager.workers_alive == job_manager.max_concurrent
+                       and (process_pool.alive_workers > 0 or not process_pool.started)),
+    }
+
+async def metrics_endpoint(method, headers, body):
+    """/metrics in Prometheus text format"""
+    return 200, "text/plain; version=0.0.4", registry.render().encode()
+
+def register_gauges():
+    """Gauges read from the services at scrape time"""
+    registry.gauge("bot_queue_depth", "Jobs waiting in the queue", callback=lambda: job_manager.queue_depth)
+    registry.gauge("bot_active_jobs", "Jobs running", callback=lambda: job_manager.active_count)
+    registry.gauge("bot_job_workers_alive", "Live job worker tasks", callback=lambda: job_manager.workers_alive)
+    registry.gauge("bot_pool_workers_alive", "Live conversion worker processes",
+                   callback=lambda: process_pool.alive_workers)
+    registry.gauge("bot_cache_hits_total", "Result cache hits", callback=lambda: result_cache.hits)
+    registry.gauge("bot_cache_misses_total", "Result cache misses", callback=lambda: result_cache.misses)
+    registry.gauge("bot_cache_bytes", "Bytes of cached outputs on disk", callback=lambda: result_cache.total_bytes)
+    registry.gauge("bot_workspace_bytes", "Bytes tracked in the workspace",
+                   callback=lambda: workspace_manager.used_bytes)
+    registry.gauge("bot_users_with_recent_jobs", "Users with queue waits on record",
+                   callback=lambda: len(job_manager.user_waits))
+    registry.gauge("bot_user_mean_wait_max_seconds", "Highest mean queue wait of any single user",
+                   callback=job_manager.worst_mean_wait)
+    registry.gauge("bot_event_loop_lag_current_seconds", "Most recent event loop lag", callback=lambda: loop_lag.lag)
+
+async def claim_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop updates another instance (or a run before a restart) already handled"""
+    if not await state_store.claim(f"update:{update.update_id}", UPDATE_CLAIM_TTL):
+        logger.info(f"Skipping update {update.update_id}, already handled")
+        raise ApplicationHandlerStop
+
+async def notify_interrupted_jobs(bot):
+    """Tell users whose jobs were lost when this instance last stopped"""
+    for record in await state_store.take_interrupted_jobs():
+        logger.warning(f"Job {record['key']} was interrupted by a restart: {record.get('description')}")
+        try:
+            await bot.send_message(record['chat_id'], f"⚠️ The bot restarted while working on your request "
+                                                      f"({record.get('description')}). Please send it again.")
+        except Exception as e:
+            logger.warning(f"Could not notify chat {record.get('chat_id')}: {e}")
+
+async def warm_up():
+    """Start the worker pool and load conversion backends while the bot is already answering"""
+    started = time.perf_counter()
     try:
-        output_path = await VideoProcessor.convert_document(
-            context.user_data['current_file'],
-            output_format,
-            progress_callback
-        )
-        
-        # Send the converted file
-        if output_format == 'pdf':
-            with open(output_path, 'rb') as file:
-                await context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=InputFile(file, filename="converted.pdf"),
-                    caption="✅ Image converted to PDF!"
-                )
-        else:
-            with open(output_path, 'rb') as file:
-                await context.bot.send_photo(
-                    chat_id=query.message.chat_id,
-                    photo=InputFile(file),
-                    caption=f"✅ Image converted to {output_format.upper()}!"
-                )
-        
-        # Clean up
-        os.unlink(output_path)
-        
+        await process_pool.start()
+        await asyncio.to_thread(warm_up_probes)
     except Exception as e:
-        logger.error(f"Image conversion error: {e}")
-        await query.edit_message_text("❌ Error during image conversion!")
+        logger.warning(f"Warm-up failed, backends will load on first use: {e}")
+        return
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+async def post_init(application: Application):
+    """Start background services once the event loop is running"""
+    await state_store.start()
+    await notify_interrupted_jobs(application.bot)
+    await workspace_manager.start()
+    await result_cache.start()
+    await job_manager.start()
+    if WARM_UP:
+        # Menus are served meanwhile; a job that needs the pool first starts it itself
+        application.bot_data['warm_up'] = asyncio.create_task(warm_up())
+    loop_lag.start()
+    register_gauges()
+    http_server.route("/health", health_handler(loop_lag, health_checks))
+    http_server.route("/metrics", metrics_endpoint)
+    if BOT_MODE == 'webhook':
+        http_server.route(webhook_route(), webhook_handler(application))
+    await http_server.start()
+
+async def post_shutdown(application: Application):
+    """Stop background services"""
+    warm_up_task = application.bot_data.pop('warm_up', None)
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+    await http_server.stop()
+    await loop_lag.stop()
+    await job_manager.stop()
+    await status_updater.stop()
+    await process_pool.stop()
+    await workspace_manager.stop()
+    await result_cache.stop()
+    await state_store.stop()
+
+async def run_webhook(application: Application):
+    """Serve updates pushed by Telegram to our HTTP server until SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    async with application:
+        await post_init(application)
+        await application.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + webhook_route(),
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=40,
+            )
+            logger.info(f"Webhook registered at {WEBHOOK_URL}")
+        else:
+            logger.warning("WEBHOOK_URL not set: accepting updates POSTed locally only")
+        try:
+            await stop.wait()
+        finally:
+            await application.stop()
+            await post_shutdown(application)
 
 def main():
     """Start the bot"""
-    application = Application.builder().token(BOT_TOKEN).build()
+    if BOT_MODE == 'webhook' and not WEBHOOK_SECRET:
+        logger.error("BOT_MODE=webhook requires WEBHOOK_SECRET (1-256 of A-Z, a-z, 0-9, _ and -); not starting")
+        raise SystemExit(1)
+    builder = Application.builder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if BOT_MODE == 'webhook':
+        # Updates arrive through our HTTP server, not getUpdates
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Add handlers
+    application.add_handler(TypeHandler(Update, claim_update), group=-1)
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("batch", batch_command))
+    application.add_handler(CommandHandler("quality", quality_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(MessageHandler(filters.VIDEO, handle_video))
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    application.add_handler(MessageHandler(filters.AUDIO | filters.VOICE, handle_audio))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     application.add_handler(CallbackQueryHandler(button_handler))
     
     # Start bot
-    print("Advanced File Converter Bot is running...")
-    application.run_polling()
+    print(f"Advanced File Converter Bot is running ({BOT_MODE})...")
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,6 @@
 import os
 import logging
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +10,19 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
     logging.warning("BOT_TOKEN not found in environment variables")
 
+# Update delivery: 'polling' or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public https base URL; unset = don't register with Telegram
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Alternative Bot API server (local testing / self-hosted telegram-bot-api)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# HTTP server for the webhook, /health and /metrics (served in both modes)
+HTTP_HOST = os.getenv('HTTP_HOST', '0.0.0.0')
+HTTP_PORT = int(os.getenv('PORT', 8080))
+HEALTH_MAX_LOOP_LAG = 2.0  # seconds; a loop blocked longer reports unhealthy
+
 # File handling
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
 
@@ -16,6 +30,32 @@ MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
 TEMP_DIR = "/app/temp_files"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Workspace: per-job directories and downloads under TEMP_DIR
+WORKSPACE_MAX_BYTES = int(os.getenv('WORKSPACE_MAX_BYTES', 5 * 1024 * 1024 * 1024))  # 5GB disk budget
+WORKSPACE_MIN_FREE_BYTES = 512 * 1024 * 1024  # refuse downloads that would leave less free
+WORKSPACE_SOURCE_TTL = 3600  # seconds an unused download is kept for follow-up jobs
+WORKSPACE_SWEEP_INTERVAL = 60  # seconds
+# Optional tmpfs (e.g. /dev/shm) for small files; empty disables it
+WORKSPACE_TMPFS_DIR = os.getenv('WORKSPACE_TMPFS_DIR', '')
+WORKSPACE_TMPFS_MAX_FILE = int(os.getenv('WORKSPACE_TMPFS_MAX_FILE', 20 * 1024 * 1024))
+
+# Persistent data (mounted as a volume in docker-compose)
+DATA_DIR = os.getenv('DATA_DIR', "/app/data")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 1024 * 1024 * 1024))  # 1GB of cached outputs
+CACHE_MAX_ENTRIES = 10000
+CACHE_FLUSH_INTERVAL = 5.0  # seconds index changes are batched before one write
+
+# Shared state (sessions, job records, users): 'sqlite' or 'memory'. Instances
+# that open the same database file share sessions and never handle an update twice.
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite').lower()
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', os.path.join(DATA_DIR, "state.db"))
+STATE_FLUSH_INTERVAL = 0.2  # seconds writes are batched before one commit
+SESSION_TTL = 24 * 3600  # seconds a user's current file is remembered
+STATE_JOB_RETENTION = 7 * 24 * 3600  # seconds finished job records are kept
+UPDATE_CLAIM_TTL = 24 * 3600  # Telegram keeps retrying undelivered updates for about a day
+INSTANCE_ID = os.getenv('INSTANCE_ID') or socket.gethostname()
+
 # Supported formats
 SUPPORTED_VIDEO_FORMATS = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v']
 SUPPORTED_AUDIO_FORMATS = ['.mp3', '.wav', '.aac', '.m4a', '.ogg', '.flac']
@@ -26,6 +66,66 @@ SUPPORTED_DOCUMENT_FORMATS = ['.pdf', '.doc', '.docx', '.txt', '.rtf', '.odt']
 MAX_QUEUE_SIZE = 5
 PROCESS_TIMEOUT = 1800  # 30 minutes
 MAX_CONCURRENT_PROCESSES = 3
+MERGE_MAX_FILES = 10
+
+# Video splitting
+SPLIT_MAX_PARTS = 50
+SPLIT_POLL_INTERVAL = 0.5  # seconds between checks for finished parts
+TELEGRAM_UPLOAD_LIMIT_MB = int(os.getenv('TELEGRAM_UPLOAD_LIMIT_MB', 50))  # 2000 with a local Bot API server
+
+# Videos sent for streaming playback
+THUMBNAIL_SIZE = 320  # Telegram's limit for either side of a video thumbnail
+
+# Fair scheduling between users
+USER_MAX_RUNNING = 2  # jobs of one user running at once
+USER_MAX_QUEUED = 3  # jobs of one user waiting at once
+SHORT_JOB_COST = 30  # estimated seconds of work; cheaper jobs count as short
+
+# Per-user upload limits (token buckets: sustained rate and burst)
+UPLOAD_FILES_PER_MINUTE = int(os.getenv('UPLOAD_FILES_PER_MINUTE', 30))
+UPLOAD_FILES_BURST = 60  # an album or batch arrives all at once
+UPLOAD_MB_PER_MINUTE = int(os.getenv('UPLOAD_MB_PER_MINUTE', 1024))
+UPLOAD_MB_BURST = 2048
+
+# Segment-parallel encoding of long videos
+PARALLEL_ENCODE = os.getenv('PARALLEL_ENCODE', '1') == '1'
+PARALLEL_ENCODE_MIN_DURATION = 120  # seconds; shorter inputs use a single ffmpeg process
+PARALLEL_ENCODE_MAX_SEGMENTS = 8
+
+# Load-aware encoding quality; off = always the requested quality tier
+QUALITY_GOVERNOR = os.getenv('QUALITY_GOVERNOR', '1') == '1'
+
+# Progress message edits: one per chat every STATUS_UPDATE_INTERVAL seconds at most, and
+# STATUS_UPDATES_PER_SECOND across all chats, below Telegram's ~30 messages/s so sends keep headroom
+STATUS_UPDATE_INTERVAL = float(os.getenv('STATUS_UPDATE_INTERVAL', '2'))
+STATUS_UPDATES_PER_SECOND = 15
+
+# Worker processes for CPU-bound document/image conversions
+PROCESS_POOL_WORKERS = max(1, min(os.cpu_count() or 1, MAX_CONCURRENT_PROCESSES))
+PROCESS_TASK_TIMEOUT = 600  # seconds per conversion task
+PDF2DOCX_PARALLEL_MIN_PAGES = 50  # pdf2docx converts pages in parallel from this size
+# Its processes per conversion: each pool worker gets its share of the cores, so
+# several large PDFs at once do not oversubscribe the CPU
+PDF2DOCX_PROCESSES = max(1, (os.cpu_count() or 1) // PROCESS_POOL_WORKERS)
+PDF_TEXT_CHUNK_PAGES = 10  # pages per text extraction task
+# Start the pool and load conversion backends in the background right after startup;
+# off = everything loads on first use
+WARM_UP = os.getenv('WARM_UP', '1') == '1'
+
+# Batch mode: one operation over a media group or a batch session
+BATCH_MAX_FILES = 50
+BATCH_COLLECT_DELAY = 1.5  # seconds without a new file before the batch menu is shown
+BATCH_CONCURRENCY = PROCESS_POOL_WORKERS  # items converted at once
+BATCH_DOWNLOAD_CONCURRENCY = 4
+BATCH_PROGRESS_INTERVAL = 2.0  # seconds between status message edits
+
+# Image pipeline memory bounds
+IMAGE_MAX_PIXELS = 200_000_000  # larger images are rejected as decompression bombs
+IMAGE_MAX_DECODE_BYTES = int(os.getenv('IMAGE_MAX_DECODE_BYTES', 512 * 1024 * 1024))  # per decoded image
+
+# External tools
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.getenv('FFPROBE_BINARY', 'ffprobe')
 
 # Docker specific settings
 IS_DOCKER = os.path.exists('/.dockerenv')
@@ -48,22 +148,3 @@ def get_file_type(filename: str) -> str:
         return 'document'
     else:
         return 'unknown'
-
-def cleanup_old_files(max_age_hours: int = 24):
-    """Clean up files older than specified hours"""
-    import time
-    import glob
-    
-    current_time = time.time()
-    max_age_seconds = max_age_hours * 3600
-    
-    for file_pattern in ['*.mp4', '*.mp3', '*.jpg', '*.png', '*.pdf', '*.docx']:
-        for file_path in glob.glob(get_temp_path(file_pattern)):
-            try:
-                if os.path.isfile(file_path):
-                    file_age = current_time - os.path.getmtime(file_path)
-                    if file_age > max_age_seconds:
-                        os.unlink(file_path)
-                        logging.info(f"Cleaned up old file: {file_path}")
-            except Exception as e:
-                logging.error(f"Error cleaning up file {file_path}: {e}")
@@ -0,0 +1,248 @@
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Codecs each target container can carry as-is (stream copy). MP4 could hold
+# more (vp9, av1, opus, flac), but many players, Telegram's included, reject those
+CONTAINER_CODECS = {
+    'mp4': {
+        'video': {'h264', 'hevc', 'mpeg4'},
+        'audio': {'aac', 'mp3', 'ac3', 'eac3', 'alac'},
+    },
+    'mov': {
+        'video': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'},
+        'audio': {'aac', 'mp3', 'ac3', 'alac', 'pcm_s16le', 'pcm_s24le'},
+    },
+    'mkv': {
+        'video': {'h264', 'hevc', 'mpeg4', 'mpeg2video', 'vp8', 'vp9', 'av1', 'theora', 'mjpeg'},
+        'audio': {'aac', 'mp3', 'ac3', 'eac3', 'dts', 'opus', 'vorbis', 'flac', 'alac',
+                  'pcm_s16le', 'pcm_s24le'},
+    },
+    'webm': {
+        'video': {'vp8', 'vp9', 'av1'},
+        'audio': {'opus', 'vorbis'},
+    },
+    'avi': {
+        'video': {'mpeg4', 'h264', 'mjpeg', 'msmpeg4v2', 'msmpeg4v3'},
+        'audio': {'mp3', 'ac3', 'pcm_s16le'},
+    },
+    'wmv': {
+        'video': {'wmv1', 'wmv2', 'wmv3', 'vc1'},
+        'audio': {'wmav1', 'wmav2'},
+    },
+}
+
+# Encoders used when a container needs its streams re-encoded
+CONTAINER_ENCODERS = {
+    'mp4': {'video': 'libx264', 'audio': 'aac'},
+    'mkv': {'video': 'libx264', 'audio': 'aac'},
+    'mov': {'video': 'libx264', 'audio': 'aac'},
+    'webm': {'video': 'libvpx-vp9', 'audio': 'libopus'},
+    'avi': {'video': 'mpeg4', 'audio': 'libmp3lame'},
+    'wmv': {'video': 'wmv2', 'audio': 'wmav2'},
+}
+
+# Containers whose index (moov atom) can be written first, so players start before the download ends
+FASTSTART_FORMATS = {'mp4', 'mov', 'm4v'}
+
+REMUX = "remux"          # every stream copied
+PARTIAL = "partial"      # some streams copied, the rest transcoded
+TRANSCODE = "transcode"  # every stream re-encoded
+
+
+def video_encoder_args(encoder: str, settings: dict) -> List[str]:
+    """Quality arguments for a video encoder from a quality_settings entry"""
+    if encoder == 'libx264':
+        return ['-c:v', 'libx264', '-crf', settings['crf'], '-preset', settings['preset'], '-pix_fmt', 'yuv420p']
+    if encoder == 'libvpx-vp9':
+        # Constant quality mode needs an explicit zero bitrate
+        return ['-c:v', 'libvpx-vp9', '-crf', str(int(settings['crf']) + 8), '-b:v', '0',
+                '-deadline', 'good', '-cpu-used', '4', '-row-mt', '1']
+    # mpeg4/wmv2 have no CRF; map it onto the qscale range
+    return ['-c:v', encoder, '-q:v', str(max(2, int(settings['crf']) // 6))]
+
+
+def muxer_args(output_format: str) -> List[str]:
+    """Muxer options for progressive playback: the muxer moves the index to the front as it finishes"""
+    if output_format.lstrip('.').lower() in FASTSTART_FORMATS:
+        return ['-movflags', '+faststart']
+    return []
+
+
+class ConversionPlan:
+    """Per-stream copy/transcode decisions for one conversion"""
+
+    def __init__(self, output_format: str, video_copy: Optional[bool], audio_copy: Optional[bool],
+                 video_args: List[str], audio_args: List[str], video_encoder: Optional[str] = None):
+        self.output_format = output_format
+        self.video_copy = video_copy  # None when the input has no such stream
+        self.audio_copy = audio_copy
+        self.video_args = video_args
+        self.audio_args = audio_args
+        self.video_encoder = video_encoder  # set when the video is re-encoded
+
+    def set_video_quality(self, settings: dict, filters: List[str] = ()):
+        """Re-derive the video encoder arguments from another quality tier, with optional filters"""
+        if self.video_encoder is None:
+            return
+        self.video_args = video_encoder_args(self.video_encoder, settings)
+        if filters:
+            self.video_args = ['-vf', ','.join(filters), *self.video_args]
+
+    @property
+    def args(self) -> List[str]:
+        """Complete output arguments for a single ffmpeg run"""
+        # Drop subtitle/data streams the target container may not support
+        return ['-map', '0:v:0?', '-map', '0:a?', *self.video_args, *self.audio_args, '-sn', '-dn',
+                *muxer_args(self.output_format)]
+
+    @property
+    def path(self) -> str:
+        decisions = [d for d in (self.video_copy, self.audio_copy) if d is not None]
+        if decisions and all(decisions):
+            return REMUX
+        if any(decisions):
+            return PARTIAL
+        return TRANSCODE
+
+    def describe(self) -> str:
+        def word(copy):
+            return "-" if copy is None else ("copy" if copy else "encode")
+        return f"{self.path} (video: {word(self.video_copy)}, audio: {word(self.audio_copy)})"
+
+
+def plan_conversion(info: dict, output_format: str, settings: dict, force_transcode: bool = False) -> ConversionPlan:
+    """Decide which streams of a probed input can be copied into output_format
+
+    `info` is a media_probe.probe_file result. Only the first video stream and
+    the audio streams are mapped; every audio stream must fit the container for
+    audio to be copied.
+    """
+    allowed = CONTAINER_CODECS.get(output_format, CONTAINER_CODECS['mp4'])
+    encoders = CONTAINER_ENCODERS.get(output_format, CONTAINER_ENCODERS['mp4'])
+
+    video_codec = info.get('video_codec')
+    audio_codecs = [s.get('codec_name') for s in info.get('streams', []) if s.get('codec_type') == 'audio']
+
+    video_copy = None
+    if video_codec:
+        video_copy = not force_transcode and video_codec in allowed['video']
+    audio_copy = None
+    if audio_codecs:
+        audio_copy = not force_transcode and all(codec in allowed['audio'] for codec in audio_codecs)
+
+    video_args = []
+    if video_copy:
+        video_args = ['-c:v', 'copy']
+        if video_codec == 'hevc' and output_format in ('mp4', 'mov'):
+            # Apple players only accept HEVC tagged as hvc1
+            video_args += ['-tag:v', 'hvc1']
+    elif video_codec:
+        video_args = video_encoder_args(encoders['video'], settings)
+    audio_args = []
+    if audio_copy:
+        audio_args = ['-c:a', 'copy']
+    elif audio_codecs:
+        audio_args = ['-c:a', encoders['audio']]
+
+    plan = ConversionPlan(output_format, video_copy, audio_copy, video_args, audio_args,
+                          video_encoder=encoders['video'] if video_codec and not video_copy else None)
+    logger.info(f"Conversion plan to {output_format}: {plan.describe()} "
+                f"[input video={video_codec}, audio={','.join(filter(None, audio_codecs)) or '-'}]")
+    return plan
+
+
+# Encoders able to reproduce a codec when one merge input must be made to match the others
+CODEC_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+    'vp9': 'libvpx-vp9',
+    'vp8': 'libvpx',
+    'mpeg4': 'mpeg4',
+    'aac': 'aac',
+    'mp3': 'libmp3lame',
+    'opus': 'libopus',
+    'vorbis': 'libvorbis',
+    'ac3': 'ac3',
+    'flac': 'flac',
+}
+
+# Near-transparent quality settings for those encoders
+ENCODER_QUALITY = {
+    'libx264': ['-crf', '18', '-preset', 'veryfast'],
+    'libx265': ['-crf', '22', '-preset', 'veryfast'],
+    'libvpx-vp9': ['-crf', '30', '-b:v', '0', '-deadline', 'realtime', '-row-mt', '1'],
+    'libvpx': ['-crf', '10', '-b:v', '2M'],
+    'mpeg4': ['-q:v', '3'],
+}
+
+
+def stream_signature(info: dict) -> tuple:
+    """Parameters that must be identical for the concat demuxer to copy streams"""
+    fps = round(info['fps'], 2) if info.get('fps') else None
+    return (info.get('video_codec'), info.get('width'), info.get('height'), info.get('pix_fmt'), fps,
+            info.get('audio_codec'), info.get('sample_rate'), info.get('channels'))
+
+
+class MergePlan:
+    """Target parameters for a merge and which inputs must be normalized first"""
+
+    def __init__(self, reference: dict, reference_index: int, normalize: List[int], output_format: str):
+        self.reference = reference
+        self.reference_index = reference_index
+        self.normalize = normalize
+        self.output_format = output_format
+
+    @property
+    def path(self) -> str:
+        return REMUX if not self.normalize else PARTIAL
+
+
+def plan_merge(infos: List[dict]) -> MergePlan:
+    """Pick the most common stream layout as the reference and list the odd ones out"""
+    signatures = [stream_signature(info) for info in infos]
+    reference_signature = max(signatures, key=signatures.count)
+    reference_index = signatures.index(reference_signature)
+    reference = dict(infos[reference_index])
+
+    normalize = [i for i, signature in enumerate(signatures) if signature != reference_signature]
+    if normalize and (reference.get('video_codec') not in CODEC_ENCODERS
+                      or (reference.get('audio_codec') and reference['audio_codec'] not in CODEC_ENCODERS)):
+        # We cannot produce more of the reference codec: bring everything to H.264/AAC
+        reference.update({'video_codec': 'h264', 'pix_fmt': 'yuv420p', 'audio_codec': 'aac'})
+        normalize = list(range(len(infos)))
+
+    mp4 = CONTAINER_CODECS['mp4']
+    fits_mp4 = reference.get('video_codec') in mp4['video'] and reference.get('audio_codec') in mp4['audio'] | {None}
+    plan = MergePlan(reference, reference_index, normalize, 'mp4' if fits_mp4 else 'mkv')
+    logger.info(f"Merge plan: {len(infos)} inputs, {len(normalize)} to normalize, output {plan.output_format}")
+    return plan
+
+
+def normalize_args(info: dict, reference: dict) -> List[str]:
+    """ffmpeg output arguments that re-encode one input to match the reference layout
+
+    Expects the input at index 0 and, when the input lacks audio but the
+    reference has it, a silent anullsrc source at index 1.
+    """
+    width, height = reference['width'], reference['height']
+    video_filter = (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                    f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1")
+    if reference.get('fps'):
+        video_filter += f",fps={reference['fps']}"
+    encoder = CODEC_ENCODERS[reference['video_codec']]
+    args = ['-map', '0:v:0', '-vf', video_filter, '-c:v', encoder, *ENCODER_QUALITY.get(encoder, [])]
+    if reference.get('pix_fmt'):
+        args += ['-pix_fmt', reference['pix_fmt']]
+
+    if reference.get('audio_codec'):
+        args += ['-map', '0:a:0' if info.get('audio_codec') else '1:a:0', '-shortest',
+                 '-c:a', CODEC_ENCODERS[reference['audio_codec']]]
+        if reference.get('sample_rate'):
+            args += ['-ar', str(reference['sample_rate'])]
+        if reference.get('channels'):
+            args += ['-ac', str(reference['channels'])]
+    else:
+        args += ['-an']
+    return args
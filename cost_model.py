@@ -0,0 +1,62 @@
+"""Rough cost of a job, in seconds of work on one core, for fair scheduling
+
+Estimates come from what Telegram tells us before anything is downloaded:
+duration and resolution of videos, duration of audio, pixel size of photos,
+and file size (standing in for page count) of documents. They only need to
+rank jobs, not predict them exactly.
+"""
+from typing import Iterable, Optional
+
+REFERENCE_PIXELS = 1280 * 720
+MIN_COST = 0.5
+
+# Seconds of work per second of 720p video, by operation
+VIDEO_COST = {
+    'convert_video': 1.0,
+    'compress_video': 1.5,  # two passes, or one slower pass
+    'merge_videos': 0.3,  # mostly stream copy
+    'split_video': 0.02,  # stream copy only
+    'video_to_audio': 0.1,
+}
+# Seconds of work per second of audio, by operation (also for the soundtrack of a video)
+AUDIO_COST = {
+    'audio_convert': 0.02,
+    'audio_normalize': 0.1,  # analysis pass plus encode
+    'audio_trim': 0.005,  # usually a stream copy
+}
+PAGE_COST = 0.05  # seconds per PDF page
+IMAGE_COST_PER_MEGAPIXEL = 0.1
+
+# Fallbacks when Telegram does not send duration or resolution
+VIDEO_BYTES_PER_SECOND = 250_000  # ~2 Mbit/s
+AUDIO_BYTES_PER_SECOND = 24_000  # ~192 kbit/s
+DOCUMENT_BYTES_PER_PAGE = 60_000
+PHOTO_BYTES_PER_MEGAPIXEL = 300_000
+
+
+def estimate_cost(source: Optional[dict], operation: str) -> float:
+    """Estimated cost of applying operation to one source file (a session file_ref)"""
+    if not source:
+        return MIN_COST
+    size = source.get('file_size') or 0
+    file_type = source.get('file_type')
+
+    if operation in AUDIO_COST:
+        bytes_per_second = VIDEO_BYTES_PER_SECOND if file_type == 'video' else AUDIO_BYTES_PER_SECOND
+        cost = (source.get('duration') or size / bytes_per_second) * AUDIO_COST[operation]
+    elif file_type == 'video':
+        duration = source.get('duration') or size / VIDEO_BYTES_PER_SECOND
+        pixels = (source.get('width') or 0) * (source.get('height') or 0) or REFERENCE_PIXELS
+        cost = duration * pixels / REFERENCE_PIXELS * VIDEO_COST.get(operation, 1.0)
+    elif file_type == 'image':
+        pixels = (source.get('width') or 0) * (source.get('height') or 0)
+        megapixels = pixels / 1e6 if pixels else size / PHOTO_BYTES_PER_MEGAPIXEL
+        cost = megapixels * IMAGE_COST_PER_MEGAPIXEL
+    else:
+        pages = source.get('pages') or size / DOCUMENT_BYTES_PER_PAGE
+        cost = pages * PAGE_COST
+    return max(cost, MIN_COST)
+
+
+def estimate_total(sources: Iterable[dict], operation: str) -> float:
+    return sum(estimate_cost(source, operation) for source in sources)
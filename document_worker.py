@@ -0,0 +1,118 @@
+"""Blocking document and image conversions, run inside process_pool workers
+
+Everything here is plain synchronous code: functions must be importable
+module-level callables so they can be pickled to worker processes.
+"""
+import importlib
+import shutil
+
+from config import PDF2DOCX_PARALLEL_MIN_PAGES
+
+# Pillow format names for our output extensions
+PIL_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'tif': 'TIFF'}
+
+
+# Heavy conversion libraries every worker needs; optional ones may be missing
+WORKER_MODULES = ['PIL.Image', 'PyPDF2', 'docx', 'pdf2docx', 'reportlab.pdfgen.canvas']
+
+
+def warm_up():
+    """Import the heavy conversion libraries once per worker"""
+    for name in WORKER_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+def pdf_to_docx(input_path: str, output_path: str, cpu_count: int = 1):
+    """Convert PDF to DOCX, letting pdf2docx convert pages in parallel for big documents"""
+    try:
+        from pdf2docx import Converter
+    except ImportError:
+        # Fallback: copy file with new extension
+        shutil.copy2(input_path, output_path)
+        return
+
+    cv = Converter(input_path)
+    try:
+        pages = len(cv.fitz_doc)
+        if cpu_count > 1 and pages >= PDF2DOCX_PARALLEL_MIN_PAGES:
+            cv.convert(output_path, multi_processing=True, cpu_count=cpu_count)
+        else:
+            cv.convert(output_path)
+    finally:
+        cv.close()
+
+
+def iter_pdf_pages(input_path: str, start: int = 0, stop: int = None):
+    """Yield the text of pages [start, stop) in order, one page in memory at a time"""
+    import PyPDF2
+    with open(input_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        stop = len(pdf_reader.pages) if stop is None else min(stop, len(pdf_reader.pages))
+        for number in range(start, stop):
+            yield pdf_reader.pages[number].extract_text() or ""
+
+
+def pdf_text_range(input_path: str, output_path: str, start: int, stop: int, progress_queue=None) -> int:
+    """Write the text of pages [start, stop) to output_path; returns the number of pages written
+
+    When a (manager) queue is given, a 1 is put on it after every page.
+    """
+    written = 0
+    with open(output_path, 'w', encoding='utf-8') as out:
+        for text in iter_pdf_pages(input_path, start, stop):
+            out.write(text)
+            out.write("\n")
+            written += 1
+            if progress_queue is not None:
+                progress_queue.put(1)
+    return written
+
+
+def docx_to_pdf(input_path: str, output_path: str):
+    """Convert DOCX to PDF"""
+    try:
+        # Using python-docx and reportlab
+        from docx import Document
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+    except ImportError:
+        # Fallback: copy file
+        shutil.copy2(input_path, output_path)
+        return
+
+    doc = Document(input_path)
+    c = canvas.Canvas(output_path, pagesize=letter)
+    y = 750  # Starting y position
+    line_height = 15
+
+    for paragraph in doc.paragraphs:
+        text = paragraph.text
+        if text.strip():
+            c.drawString(50, y, text)
+            y -= line_height
+            if y < 50:
+                c.showPage()
+                y = 750
+
+    c.save()
+
+
+def convert_image(input_path: str, output_path: str, output_format: str):
+    """Convert images between formats"""
+    from PIL import Image
+
+    with Image.open(input_path) as img:
+        if output_format == 'pdf':
+            # Convert image to PDF
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(output_path, "PDF", resolution=100.0)
+        else:
+            # Convert to other image formats
+            pil_format = PIL_FORMATS.get(output_format, output_format.upper())
+            if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(output_path, pil_format)
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+from config import FFMPEG_BINARY, FFPROBE_BINARY
+from instrumentation import ProcessUsage
+from job_manager import track_process
+
+logger = logging.getLogger(__name__)
+
+# How many trailing stderr lines are kept for error reports
+STDERR_TAIL_LINES = 40
+
+
+class FFmpegError(Exception):
+    """Raised when an ffmpeg/ffprobe child process fails"""
+
+    def __init__(self, message: str, returncode: Optional[int] = None, stderr: str = ""):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+    def __str__(self):
+        text = super().__str__()
+        if self.stderr:
+            last_line = self.stderr.strip().splitlines()[-1]
+            text += f": {last_line}"
+        return text
+
+
+def format_eta(seconds: float) -> str:
+    """Format seconds as m:ss or h:mm:ss"""
+    seconds = int(max(seconds, 0))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def write_concat_list(list_path: str, paths: List[str]):
+    """Write an input list for ffmpeg's concat demuxer (use with -safe 0)
+
+    Paths are made absolute and single-quoted, with quotes inside them escaped.
+    """
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+async def probe(path: str) -> dict:
+    """Run ffprobe once and return its parsed JSON (streams + format)"""
+    process = await asyncio.create_subprocess_exec(
+        FFPROBE_BINARY, '-v', 'error', '-show_streams', '-show_format', '-of', 'json', path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    track_process(process)
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise FFmpegError(f"ffprobe failed on {path}", process.returncode, stderr.decode(errors='replace'))
+    return json.loads(stdout or b'{}')
+
+
+async def probe_duration(path: str) -> Optional[float]:
+    """Container duration in seconds, or None when unknown"""
+    data = await probe(path)
+    duration = data.get('format', {}).get('duration')
+    if duration is None:
+        durations = [float(s['duration']) for s in data.get('streams', []) if s.get('duration')]
+        return max(durations) if durations else None
+    return float(duration)
+
+
+class ProgressParser:
+    """Turns `-progress pipe:1` key=value blocks into percentages and ETAs"""
+
+    def __init__(self, duration: Optional[float]):
+        self.duration = duration
+        self.values = {}
+        self.started = time.monotonic()
+
+    def feed(self, line: str) -> Optional[dict]:
+        """Consume one line; returns a snapshot at the end of each progress block"""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        self.values[key] = value.strip()
+        if key != 'progress':
+            return None
+        return self.snapshot(ended=value.strip() == 'end')
+
+    def out_time(self) -> float:
+        # out_time_ms is (despite its name) in microseconds, like out_time_us
+        for key in ('out_time_us', 'out_time_ms'):
+            raw = self.values.get(key)
+            if raw and raw != 'N/A':
+                try:
+                    return max(int(raw), 0) / 1_000_000
+                except ValueError:
+                    pass
+        return 0.0
+
+    def snapshot(self, ended: bool = False) -> dict:
+        out_time = self.out_time()
+        speed = None
+        raw_speed = self.values.get('speed', '').rstrip('x')
+        if raw_speed and raw_speed != 'N/A':
+            try:
+                speed = float(raw_speed)
+            except ValueError:
+                pass
+        fps = None
+        try:
+            fps = float(self.values.get('fps', ''))
+        except ValueError:
+            pass
+
+        fraction = None
+        eta = None
+        if ended:
+            fraction = 1.0
+            eta = 0.0
+        elif self.duration:
+            fraction = min(out_time / self.duration, 1.0)
+            if speed:
+                eta = (self.duration - out_time) / speed
+            elif fraction > 0:
+                elapsed = time.monotonic() - self.started
+                eta = elapsed / fraction - elapsed
+        return {'out_time': out_time, 'fraction': fraction, 'speed': speed, 'fps': fps, 'eta': eta}
+
+
+async def run_ffmpeg(args: List[str], duration: Optional[float] = None, progress_callback=None,
+                     status: str = "Processing...", progress_range: Tuple[int, int] = (0, 100)) -> str:
+    """Run ffmpeg asynchronously, reporting real progress; returns the stderr tail
+
+    `args` are everything after the global options (inputs, filters, outputs).
+    Progress is mapped onto `progress_range` so multi-step operations can share
+    one 0-100 progress bar.
+    """
+    command = [FFMPEG_BINARY, '-hide_banner', '-nostdin', '-y', '-progress', 'pipe:1', '-nostats', *args]
+    logger.debug(f"Running: {' '.join(command)}")
+
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    track_process(process)
+    usage = ProcessUsage(process.pid)
+    usage.start()
+
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    parser = ProgressParser(duration)
+    low, high = progress_range
+    last_reported = None
+
+    async def drain_stderr():
+        async for raw in process.stderr:
+            stderr_tail.append(raw.decode(errors='replace').rstrip())
+
+    async def read_progress():
+        nonlocal last_reported
+        async for raw in process.stdout:
+            snapshot = parser.feed(raw.decode(errors='replace'))
+            if snapshot is not None and parser.values.get('progress') == 'end':
+                # Last chance to read CPU time before the process exits
+                usage.sample()
+            if snapshot is None or progress_callback is None or snapshot['fraction'] is None:
+                continue
+            percent = int(low + (high - low) * snapshot['fraction'])
+            if percent == last_reported:
+                continue
+            last_reported = percent
+            details = []
+            if snapshot['speed']:
+                details.append(f"⚡ {snapshot['speed']:.2f}x")
+            if snapshot['eta'] is not None:
+                details.append(f"ETA {format_eta(snapshot['eta'])}")
+            text = status + (f"\n{' • '.join(details)}" if details else "")
+            await progress_callback(percent, text)
+
+    try:
+        await asyncio.gather(drain_stderr(), read_progress())
+        returncode = await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    finally:
+        await usage.stop()
+
+    stderr = "\n".join(stderr_tail)
+    if returncode != 0:
+        raise FFmpegError(f"ffmpeg exited with code {returncode}", returncode, stderr)
+    return stderr
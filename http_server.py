@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from config import HEALTH_MAX_LOOP_LAG, HTTP_HOST, HTTP_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+from metrics import LOOP_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1024 * 1024  # Telegram updates are a few KB
+KEEPALIVE_TIMEOUT = 30  # seconds an idle connection is kept open
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a sleeping task"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0  # since the last health check
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.monotonic() - started - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG_SECONDS.observe(self.lag)
+            if self.lag > 0.1:
+                logger.warning(f"Event loop blocked for {self.lag * 1000:.0f} ms")
+
+    def take_max(self) -> float:
+        """Worst lag since the previous call"""
+        value, self.max_lag = max(self.max_lag, self.lag), self.lag
+        return value
+
+
+Response = Tuple[int, str, bytes]
+Handler = Callable[[str, Dict[str, str], bytes], Awaitable[Response]]
+
+
+class HttpServer:
+    """Minimal HTTP/1.1 server for /health, /metrics and the Telegram webhook
+
+    Only what Telegram and health probes need: small bodies with Content-Length,
+    keep-alive, no chunked encoding.
+    """
+
+    def __init__(self, host: str = HTTP_HOST, port: int = HTTP_PORT):
+        self.host = host
+        self.port = port
+        self.routes: Dict[str, Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, path: str, handler: Handler):
+        self.routes[path] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.port} ({', '.join(self.routes)})")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, "text/plain", b"bad request line", close=True)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, "text/plain", b"too large", close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                close = headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+                handler = self.routes.get(target.split('?', 1)[0])
+                if handler is None:
+                    status, content_type, payload = 404, "text/plain", b"not found"
+                else:
+                    try:
+                        status, content_type, payload = await handler(method, headers, body)
+                    except Exception as e:
+                        logger.error(f"Error handling {method} {target}: {e}")
+                        status, content_type, payload = 503, "text/plain", b"error"
+                await self._respond(writer, status, content_type, payload, close=close)
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, content_type: str, payload: bytes,
+                       close: bool = False):
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+
+def json_response(status: int, data) -> Response:
+    return status, "application/json", json.dumps(data).encode()
+
+
+def health_handler(lag_monitor: LoopLagMonitor, checks: Callable[[], Dict]) -> Handler:
+    """/health: 200 while the loop is responsive and all workers are alive, 503 otherwise"""
+    async def handle(method, headers, body):
+        details = checks()
+        details['loop_lag_ms'] = round(lag_monitor.take_max() * 1000, 1)
+        healthy = details['loop_lag_ms'] / 1000 < HEALTH_MAX_LOOP_LAG and details.pop('workers_ok', True)
+        details['status'] = "ok" if healthy else "unhealthy"
+        return json_response(200 if healthy else 503, details)
+    return handle
+
+
+def webhook_handler(application) -> Handler:
+    """Telegram webhook: validate the secret, queue the update, answer immediately"""
+    from telegram import Update
+    if not WEBHOOK_SECRET:
+        # Without it anyone who can reach the port could inject updates
+        raise RuntimeError("Webhook mode needs WEBHOOK_SECRET")
+
+    async def handle(method, headers, body):
+        if method != 'POST':
+            return 405, "text/plain", b"POST only"
+        if headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET:
+            return 403, "text/plain", b"forbidden"
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed update: {e}")
+            return 400, "text/plain", b"malformed update"
+        # The application's update processor handles it; Telegram only needs the 200
+        await application.update_queue.put(update)
+        return 200, "text/plain", b"ok"
+    return handle
+
+
+def webhook_route() -> str:
+    return WEBHOOK_PATH if WEBHOOK_PATH.startswith('/') else f"/{WEBHOOK_PATH}"
@@ -0,0 +1,304 @@
+"""Memory-bounded image operations: resize, compress to a target size, rotate, combine into a PDF
+
+The module-level functions are synchronous and run inside process_pool
+workers; ImageProcessor is the async front used by the bot. Large JPEGs are
+downscaled while decoding (draft mode) and other formats with reduce(), so a
+big panorama never has to be held in memory at full resolution.
+"""
+import io
+import os
+import shutil
+import subprocess
+import uuid
+from typing import List, Optional, Tuple
+
+from config import IMAGE_MAX_DECODE_BYTES, IMAGE_MAX_PIXELS
+from process_pool import process_pool
+from workspace import job_path
+from instrumentation import conversion_stage
+
+# Bytes per pixel once decoded, by Pillow mode
+MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'RGB': 3, 'YCbCr': 3, 'LAB': 3, 'HSV': 3,
+              'RGBA': 4, 'CMYK': 4, 'I': 4, 'F': 4, 'I;16': 2}
+
+# Images are placed on A4 pages (in points), each page turned to match its image
+PDF_PAGE_SIZE = (595, 842)
+PDF_MARGIN = 18
+PDF_MAX_PIXELS_SIDE = 3508  # A4 at 300 dpi; larger images are downscaled before embedding
+
+# jpegtran transforms by clockwise rotation
+JPEGTRAN_ROTATIONS = {90: ['-rotate', '90'], 180: ['-rotate', '180'], 270: ['-rotate', '270']}
+
+
+class ImageTooLargeError(Exception):
+    """Raised when decoding an image would exceed the memory budget"""
+
+
+def _open(input_path: str):
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    return Image.open(input_path)
+
+
+def _check_budget(img, size: Optional[Tuple[int, int]] = None):
+    """Refuse to decode more pixels than the memory budget allows"""
+    width, height = size or img.size
+    needed = width * height * MODE_BYTES.get(img.mode, 4)
+    if needed > IMAGE_MAX_DECODE_BYTES:
+        raise ImageTooLargeError(f"Decoding {width}x{height} {img.mode} needs {needed // 2**20} MB")
+
+
+def load_downscaled(input_path: str, max_width: int, max_height: int):
+    """Decode an image at no more than (about) the requested display size
+
+    JPEGs use draft mode, which makes libjpeg decode at 1/2, 1/4 or 1/8 scale
+    directly; other formats are decoded and immediately shrunk with reduce().
+    EXIF orientation is applied, since metadata is stripped on save.
+    """
+    from PIL import ImageOps
+
+    img = _open(input_path)
+    # Sizes are given as displayed; orientations 5-8 store the image transposed
+    stored = (max_height, max_width) if _orientation(img) in (5, 6, 7, 8) else (max_width, max_height)
+    if img.format == 'JPEG':
+        img.draft('RGB', stored)
+    _check_budget(img)
+    img.load()
+
+    factor = min(img.width // max(stored[0], 1), img.height // max(stored[1], 1))
+    if factor >= 2:
+        img = img.reduce(factor)
+    img = ImageOps.exif_transpose(img)
+    if img.width > max_width or img.height > max_height:
+        img.thumbnail((max_width, max_height), resample=_lanczos())
+    return img
+
+
+def _orientation(img) -> int:
+    return img.getexif().get(0x0112, 1)
+
+
+def _display_size(img) -> Tuple[int, int]:
+    width, height = img.size
+    return (height, width) if _orientation(img) in (5, 6, 7, 8) else (width, height)
+
+
+def _lanczos():
+    from PIL import Image
+    return Image.Resampling.LANCZOS
+
+
+def _save(img, output_path: str, fmt: str, quality: int = 90):
+    """Save without EXIF/metadata, keeping only the colour profile"""
+    options = {}
+    if img.info.get('icc_profile'):
+        options['icc_profile'] = img.info['icc_profile']
+    if fmt == 'JPEG':
+        if img.mode not in ('RGB', 'L'):
+            img = _flatten(img)
+        options.update(quality=quality, optimize=True, progressive=True)
+    elif fmt == 'WEBP':
+        options.update(quality=quality, method=4)
+    elif fmt == 'PNG':
+        options.update(optimize=True)
+    img.save(output_path, fmt, **options)
+
+
+def _flatten(img):
+    """Drop alpha onto a white background for formats without transparency"""
+    from PIL import Image
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return img.convert('RGB')
+
+
+def _output_format(img) -> Tuple[str, str]:
+    """Keep PNG/WEBP (which may carry transparency) as they are, everything else becomes JPEG"""
+    if img.format in ('PNG', 'WEBP'):
+        return img.format, img.format.lower()
+    return 'JPEG', 'jpg'
+
+
+def resize_image(input_path: str, output_path: str, scale_percent: Optional[int] = None,
+                 max_side: Optional[int] = None) -> str:
+    """Resize by percentage or so the longer side fits max_side; returns the written path"""
+    with _open(input_path) as probe:
+        width, height = _display_size(probe)
+        fmt, ext = _output_format(probe)
+    if scale_percent:
+        target = (max(1, width * scale_percent // 100), max(1, height * scale_percent // 100))
+    else:
+        ratio = min(1.0, max_side / max(width, height))
+        target = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+
+    img = load_downscaled(input_path, *target)
+    if img.size != target and (img.width > target[0] or img.height > target[1]):
+        img = img.resize(target, resample=_lanczos())
+    output_path = f"{os.path.splitext(output_path)[0]}.{ext}"
+    _save(img, output_path, fmt)
+    return output_path
+
+
+def compress_image(input_path: str, output_path: str, target_kb: int) -> str:
+    """Re-encode as JPEG at the best quality that fits target_kb, shrinking if needed"""
+    target_bytes = target_kb * 1024
+    with _open(input_path) as probe:
+        width, height = _display_size(probe)
+    # Never decode more than ~12 MP; phone-sized output is plenty for a size-capped image
+    limit = 4096
+    img = load_downscaled(input_path, min(width, limit), min(height, limit))
+    if img.mode not in ('RGB', 'L'):
+        img = _flatten(img)
+
+    def encode(image, quality: int) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return buffer.getvalue()
+
+    while True:
+        # Binary search for the highest quality that fits
+        low, high, best = 20, 95, None
+        while low <= high:
+            quality = (low + high) // 2
+            data = encode(img, quality)
+            if len(data) <= target_bytes:
+                best, low = data, quality + 1
+            else:
+                high = quality - 1
+        if best is not None or min(img.size) <= 64:
+            break
+        # Even the lowest quality is too big: shrink by the size overshoot and retry
+        overshoot = len(encode(img, 20)) / target_bytes
+        scale = max(0.3, min(0.9, (1 / overshoot) ** 0.5))
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), resample=_lanczos())
+
+    output_path = f"{os.path.splitext(output_path)[0]}.jpg"
+    with open(output_path, 'wb') as f:
+        f.write(best if best is not None else encode(img, 20))
+    return output_path
+
+
+def rotate_image(input_path: str, output_path: str, degrees: int) -> str:
+    """Rotate clockwise; JPEGs are rotated losslessly with jpegtran when possible"""
+    from PIL import Image
+
+    with _open(input_path) as img:
+        fmt, ext = _output_format(img)
+        orientation = _orientation(img)
+        _check_budget(img)
+    output_path = f"{os.path.splitext(output_path)[0]}.{ext}"
+
+    # jpegtran works on the DCT blocks directly: no decode, no quality loss.
+    # -perfect refuses sizes that are not a multiple of the block size, and
+    # images relying on an EXIF orientation tag need the pixel path instead.
+    if fmt == 'JPEG' and orientation == 1 and shutil.which('jpegtran'):
+        result = subprocess.run(['jpegtran', '-copy', 'icc', '-perfect', *JPEGTRAN_ROTATIONS[degrees],
+                                 '-outfile', output_path, input_path], capture_output=True)
+        if result.returncode == 0:
+            return output_path
+
+    from PIL import ImageOps, JpegImagePlugin
+
+    transposes = {90: Image.Transpose.ROTATE_270, 180: Image.Transpose.ROTATE_180, 270: Image.Transpose.ROTATE_90}
+    with _open(input_path) as img:
+        rotated = ImageOps.exif_transpose(img).transpose(transposes[degrees])
+        if img.format == 'JPEG' and img.mode in ('RGB', 'L'):
+            # Reuse the source quantization tables so the re-encode loses as little as possible
+            options = {'qtables': img.quantization, 'subsampling': JpegImagePlugin.get_sampling(img)}
+            if img.info.get('icc_profile'):
+                options['icc_profile'] = img.info['icc_profile']
+            rotated.save(output_path, 'JPEG', **options)
+        else:
+            _save(rotated, output_path, fmt)
+    return output_path
+
+
+def images_to_pdf(input_paths: List[str], output_path: str) -> str:
+    """Put each image on its own page, one image in memory at a time
+
+    Upright JPEGs are embedded as they are (reportlab copies the JPEG data
+    without decoding it); everything else is decoded at most at page
+    resolution and embedded as a JPEG.
+    """
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(output_path, pageCompression=1)
+    scratch = f"{os.path.splitext(output_path)[0]}_page.jpg"
+    try:
+        for input_path in input_paths:
+            with _open(input_path) as probe:
+                width, height = _display_size(probe)
+                passthrough = (probe.format == 'JPEG' and _orientation(probe) == 1 and probe.mode in ('RGB', 'L')
+                               and max(width, height) <= PDF_MAX_PIXELS_SIDE)
+            source = input_path
+            if not passthrough:
+                img = load_downscaled(input_path, min(width, PDF_MAX_PIXELS_SIDE), min(height, PDF_MAX_PIXELS_SIDE))
+                _save(img, scratch, 'JPEG', quality=90)
+                width, height = img.size
+                source = scratch
+
+            page_w, page_h = PDF_PAGE_SIZE if height >= width else PDF_PAGE_SIZE[::-1]
+            scale = min((page_w - 2 * PDF_MARGIN) / width, (page_h - 2 * PDF_MARGIN) / height)
+            draw_w, draw_h = width * scale, height * scale
+            pdf.setPageSize((page_w, page_h))
+            pdf.drawImage(source, (page_w - draw_w) / 2, (page_h - draw_h) / 2, draw_w, draw_h)
+            pdf.showPage()
+        pdf.save()
+    finally:
+        if os.path.exists(scratch):
+            os.unlink(scratch)
+    return output_path
+
+
+class ImageProcessor:
+    @staticmethod
+    @conversion_stage("image_resize")
+    async def resize(input_path: str, scale_percent: Optional[int] = None, max_side: Optional[int] = None,
+                     progress_callback=None) -> str:
+        """Resize an image by percentage or to a maximum side length"""
+        if progress_callback:
+            await progress_callback(20, "Resizing image...")
+        output_path = job_path(f"resized_{uuid.uuid4().hex[:8]}")
+        output_path = await process_pool.run(resize_image, input_path, output_path, scale_percent, max_side)
+        if progress_callback:
+            await progress_callback(100, "Resize completed!")
+        return output_path
+
+    @staticmethod
+    @conversion_stage("image_compress")
+    async def compress(input_path: str, target_kb: int, progress_callback=None) -> str:
+        """Compress an image to at most target_kb"""
+        if progress_callback:
+            await progress_callback(20, f"Compressing to {target_kb} KB...")
+        output_path = job_path(f"compressed_{uuid.uuid4().hex[:8]}")
+        output_path = await process_pool.run(compress_image, input_path, output_path, target_kb)
+        if progress_callback:
+            await progress_callback(100, "Compression completed!")
+        return output_path
+
+    @staticmethod
+    @conversion_stage("image_rotate")
+    async def rotate(input_path: str, degrees: int, progress_callback=None) -> str:
+        """Rotate an image clockwise by 90, 180 or 270 degrees"""
+        if progress_callback:
+            await progress_callback(20, "Rotating image...")
+        output_path = job_path(f"rotated_{uuid.uuid4().hex[:8]}")
+        output_path = await process_pool.run(rotate_image, input_path, output_path, degrees)
+        if progress_callback:
+            await progress_callback(100, "Rotation completed!")
+        return output_path
+
+    @staticmethod
+    @conversion_stage("images_to_pdf")
+    async def to_pdf(input_paths: List[str], progress_callback=None) -> str:
+        """Combine images into one PDF, a page per image in the given order"""
+        if progress_callback:
+            await progress_callback(50, f"Building a PDF from {len(input_paths)} images...")
+        output_path = job_path(f"images_{uuid.uuid4().hex[:8]}.pdf")
+        output_path = await process_pool.run(images_to_pdf, input_paths, output_path)
+        if progress_callback:
+            await progress_callback(100, "PDF completed!")
+        return output_path
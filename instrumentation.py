@@ -0,0 +1,126 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import psutil
+
+from job_manager import annotate_job, current_job, record_timing
+from metrics import BYTES_IN, BYTES_OUT, FFMPEG_CPU_SECONDS, FFMPEG_PEAK_RSS, STAGE_ERRORS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _file_bytes(value) -> int:
+    """Total size of a path or list of paths; 0 for anything else"""
+    if isinstance(value, (list, tuple)):
+        return sum(_file_bytes(v) for v in value)
+    if isinstance(value, str):
+        try:
+            return os.path.getsize(value)
+        except OSError:
+            return 0
+    return 0
+
+
+def _observe(stage: str, elapsed: float):
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    record_timing(stage, elapsed)
+
+
+@asynccontextmanager
+async def stage(name: str, bytes_in: int = 0):
+    """Time a block of code as a pipeline stage"""
+    if bytes_in:
+        BYTES_IN.inc(bytes_in, stage=name)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        _observe(name, time.perf_counter() - started)
+
+
+def timed(name: Optional[str] = None):
+    """Decorator timing an async function as a stage (named after the function by default)"""
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with stage(stage_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def conversion_stage(name: Optional[str] = None):
+    """Decorator for processors taking input path(s) first and returning an output path
+
+    Records latency plus the bytes read and written.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with stage(stage_name, bytes_in=_file_bytes(args[0]) if args else 0):
+                result = await func(*args, **kwargs)
+            BYTES_OUT.inc(_file_bytes(result), stage=stage_name)
+            return result
+        return wrapper
+    return decorator
+
+
+class ProcessUsage:
+    """Samples CPU time and peak RSS of a child process with psutil
+
+    CPU time is read from the last sample before exit, so up to one interval
+    of work at the very end is missed.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.interval = interval
+        self.cpu_seconds = 0.0
+        self.peak_rss = 0
+        try:
+            self._process = psutil.Process(pid)
+        except psutil.Error:
+            self._process = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._process is not None:
+            self._task = asyncio.create_task(self._run())
+
+    def sample(self):
+        try:
+            with self._process.oneshot():
+                cpu = self._process.cpu_times()
+                self.cpu_seconds = max(self.cpu_seconds, cpu.user + cpu.system)
+                self.peak_rss = max(self.peak_rss, self._process.memory_info().rss)
+        except psutil.Error:
+            pass
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        """Stop sampling and record the totals on the metrics and the current job"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        FFMPEG_CPU_SECONDS.observe(self.cpu_seconds)
+        FFMPEG_PEAK_RSS.observe(self.peak_rss)
+        job = current_job.get()
+        if job is not None:
+            annotate_job('ffmpeg_cpu_s', round(job.meta.get('ffmpeg_cpu_s', 0) + self.cpu_seconds, 2))
+            peak_mb = round(self.peak_rss / 2**20, 1)
+            annotate_job('ffmpeg_peak_rss_mb', max(job.meta.get('ffmpeg_peak_rss_mb', 0), peak_mb))
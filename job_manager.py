@@ -0,0 +1,362 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from config import (
+    MAX_CONCURRENT_PROCESSES, MAX_QUEUE_SIZE, PROCESS_TIMEOUT, SHORT_JOB_COST, USER_MAX_QUEUED, USER_MAX_RUNNING
+)
+from metrics import JOB_SECONDS, QUEUE_WAIT_SECONDS
+from state_store import state_store
+
+logger = logging.getLogger(__name__)
+# One JSON line per finished job with its stage timings
+timing_logger = logging.getLogger("job_timing")
+
+# Fair share: a user's recent usage (estimated cost of their started jobs) halves every
+# USAGE_HALF_LIFE seconds, and every second spent waiting is worth AGING_RATE of cost
+USAGE_HALF_LIFE = 600
+AGING_RATE = 1.0
+WAIT_SAMPLES = 100  # recent waits kept per user for statistics
+
+# Job running in the current task; lets deep helpers (ffmpeg launches) attach to it
+current_job: ContextVar[Optional["Job"]] = ContextVar("current_job", default=None)
+
+
+class QueueFullError(Exception):
+    """Raised when the pending queue has no free slot"""
+
+
+class UserLimitError(QueueFullError):
+    """Raised when a user already has as many jobs waiting as allowed"""
+
+
+class Job:
+    """A unit of work submitted by a user"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    TIMEOUT = "timeout"
+
+    def __init__(self, job_id: int, user_id: int, chat_id: int, description: str,
+                 func: Callable[["Job"], Awaitable[None]], cost: float = 1.0):
+        self.id = job_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.description = description
+        self.func = func
+        self.cost = cost  # estimated seconds of work, see cost_model
+        self.state = Job.QUEUED
+        self.error: Optional[BaseException] = None
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.processes: List = []
+        self.meta: Dict = {}
+        self.reported = False  # the job told the user how it ended
+        self.timings: Dict[str, float] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.done = asyncio.Event()
+        self._on_finish: List[Callable[[], None]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (Job.DONE, Job.FAILED, Job.CANCELLED, Job.TIMEOUT)
+
+    def on_finish(self, callback: Callable[[], None]):
+        """Register a callback run once the job has finished (resource cleanup)"""
+        self._on_finish.append(callback)
+
+    def track_process(self, process):
+        """Remember a child process so it can be killed on cancel/timeout"""
+        self.processes.append(process)
+
+    def kill_processes(self):
+        """Kill every child process that is still alive"""
+        for process in self.processes:
+            # subprocess.Popen needs poll(), asyncio processes expose returncode
+            returncode = process.poll() if hasattr(process, 'poll') else process.returncode
+            if returncode is not None:
+                continue
+            try:
+                process.kill()
+                logger.info(f"Killed child process {process.pid} of job {self.id}")
+            except ProcessLookupError:
+                pass
+        self.processes.clear()
+
+
+def track_process(process):
+    """Attach a child process to the job running in the current task, if any"""
+    job = current_job.get()
+    if job is not None:
+        job.track_process(process)
+
+
+def annotate_job(key: str, value):
+    """Record a detail (chosen code path, sizes...) on the job running in the current task"""
+    job = current_job.get()
+    if job is not None:
+        job.meta[key] = value
+
+
+def record_timing(stage: str, seconds: float):
+    """Add time spent in a stage to the job running in the current task"""
+    job = current_job.get()
+    if job is not None:
+        job.timings[stage] = job.timings.get(stage, 0.0) + seconds
+
+
+class JobManager:
+    """Bounded job queue served by a fixed pool of workers
+
+    Jobs are not served first come, first served: the next job is the one with
+    the lowest priority value, i.e. the owner's recent usage plus the job's
+    estimated cost, minus credit for the time it has waited. Users who ran
+    little recently and cheap jobs go first, and aging guarantees long jobs
+    still get their turn. No user runs more than max_running_per_user jobs at
+    once or queues more than max_queued_per_user.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_PROCESSES,
+                 max_queue_size: int = MAX_QUEUE_SIZE, timeout: float = PROCESS_TIMEOUT,
+                 max_running_per_user: int = USER_MAX_RUNNING, max_queued_per_user: int = USER_MAX_QUEUED):
+        self.max_concurrent = max_concurrent
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.max_running_per_user = max_running_per_user
+        self.max_queued_per_user = max_queued_per_user
+        self.pending: List[Job] = []
+        self.running: Dict[int, Job] = {}
+        self.jobs: Dict[int, Job] = {}
+        self.user_usage: Dict[int, tuple] = {}  # user_id -> (usage, monotonic time it was computed at)
+        self.user_waits: Dict[int, deque] = {}
+        self._ids = itertools.count(1)
+        # Binds to the event loop on first use, so jobs can be submitted before start()
+        self._condition = asyncio.Condition()
+        self._workers: List[asyncio.Task] = []
+        self._busy: Set[asyncio.Task] = set()  # workers running a job
+        self._stopping = False
+
+    async def start(self):
+        """Start the worker pool on the running event loop"""
+        if self._workers:
+            return
+        self._stopping = False
+        self._workers = [
+            asyncio.create_task(self._worker(n), name=f"job-worker-{n}")
+            for n in range(self.max_concurrent)
+        ]
+        logger.info(f"Job manager started with {self.max_concurrent} workers, queue size {self.max_queue_size}")
+
+    async def stop(self):
+        """Cancel running jobs and stop the workers"""
+        for job in list(self.pending):
+            self._finish(job, Job.CANCELLED)
+        self.pending.clear()
+        for job in list(self.running.values()):
+            job.kill_processes()
+        # Idle workers are woken to exit rather than cancelled: a task cancelled right
+        # after being notified in Condition.wait can stay parked in it (Python 3.11)
+        self._stopping = True
+        for worker in self._busy:
+            worker.cancel()
+        await self._notify()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, user_id: int, chat_id: int, description: str,
+               func: Callable[[Job], Awaitable[None]], cost: float = 1.0) -> Job:
+        """Queue a job, raising QueueFullError (UserLimitError for per-user limits) when there is no room"""
+        if len(self.pending) >= self.max_queue_size:
+            raise QueueFullError(f"Queue is full ({self.max_queue_size} jobs waiting)")
+        queued = sum(1 for job in self.pending if job.user_id == user_id)
+        if queued >= self.max_queued_per_user:
+            raise UserLimitError(f"User {user_id} already has {queued} jobs waiting")
+
+        job = Job(next(self._ids), user_id, chat_id, description, func, cost)
+        self.jobs[job.id] = job
+        self.pending.append(job)
+        state_store.record_job(job.id, user_id=user_id, chat_id=chat_id, description=description, state=job.state)
+        asyncio.create_task(self._notify())
+        logger.info(f"Job {job.id} queued for user {user_id} (cost {cost:.0f}): {description}")
+        return job
+
+    def position(self, job: Job) -> int:
+        """Estimated 1-based position of a job among pending jobs, 0 once it started"""
+        if job not in self.pending:
+            return 0
+        now = time.monotonic()
+        ahead = sum(1 for other in self.pending if self._priority(other, now) < self._priority(job, now))
+        return ahead + 1
+
+    def usage(self, user_id: int, now: Optional[float] = None) -> float:
+        """Decayed estimated cost of the user's recently started jobs"""
+        now = time.monotonic() if now is None else now
+        value, at = self.user_usage.get(user_id, (0.0, now))
+        return value * 0.5 ** ((now - at) / USAGE_HALF_LIFE)
+
+    def _priority(self, job: Job, now: float) -> float:
+        return self.usage(job.user_id, now) + job.cost - (now - job.created_at) * AGING_RATE
+
+    def _running_for(self, user_id: int) -> int:
+        return sum(1 for job in self.running.values() if job.user_id == user_id)
+
+    def _pick(self) -> Optional[Job]:
+        """Pending job to run next, skipping users already at their running limit"""
+        now = time.monotonic()
+        eligible = [job for job in self.pending if self._running_for(job.user_id) < self.max_running_per_user]
+        return min(eligible, key=lambda job: self._priority(job, now), default=None)
+
+    def wait_stats(self, user_id: int) -> Optional[dict]:
+        """Queue wait statistics over the user's recent jobs"""
+        waits = self.user_waits.get(user_id)
+        if not waits:
+            return None
+        ordered = sorted(waits)
+        return {
+            'jobs': len(ordered),
+            'mean_wait_s': round(sum(ordered) / len(ordered), 2),
+            'p95_wait_s': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+            'max_wait_s': round(ordered[-1], 2),
+            'usage': round(self.usage(user_id), 1),
+        }
+
+    def worst_mean_wait(self) -> float:
+        """Highest mean queue wait of any user over their recent jobs (0 when none)"""
+        return max((sum(waits) / len(waits) for waits in self.user_waits.values() if waits), default=0.0)
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def user_jobs(self, user_id: int) -> List[Job]:
+        """Unfinished jobs of a user"""
+        return [job for job in self.jobs.values() if job.user_id == user_id and not job.finished]
+
+    async def cancel(self, job_id: int, user_id: Optional[int] = None) -> bool:
+        """Cancel a queued or running job; only its owner may cancel when user_id is given"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        if user_id is not None and job.user_id != user_id:
+            return False
+
+        if job in self.pending:
+            self.pending.remove(job)
+            self._finish(job, Job.CANCELLED)
+        elif job.task is not None:
+            job.state = Job.CANCELLED
+            job.kill_processes()
+            job.task.cancel()
+        return True
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.pending)
+
+    @property
+    def active_count(self) -> int:
+        return len(self.running)
+
+    @property
+    def workers_alive(self) -> int:
+        return sum(1 for worker in self._workers if not worker.done())
+
+    async def _notify(self):
+        # Every worker re-checks: a finished job may make another user's job eligible
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def _next_job(self) -> Optional[Job]:
+        """The next job to run, or None once the manager is stopping"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._stopping or self._pick() is not None)
+            if self._stopping:
+                return None
+            job = self._pick()
+            self.pending.remove(job)
+            # Marked running under the lock so the per-user limit holds for the next pick
+            self.running[job.id] = job
+            return job
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self._next_job()
+            if job is None:
+                return
+            self._busy.add(asyncio.current_task())
+            job.state = Job.RUNNING
+            job.started_at = time.monotonic()
+            wait = job.started_at - job.created_at
+            QUEUE_WAIT_SECONDS.observe(wait, size="short" if job.cost < SHORT_JOB_COST else "long")
+            self.user_waits.setdefault(job.user_id, deque(maxlen=WAIT_SAMPLES)).append(wait)
+            self.user_usage[job.user_id] = (self.usage(job.user_id, job.started_at) + job.cost, job.started_at)
+            state_store.record_job(job.id, state=job.state)
+            token = current_job.set(job)
+            try:
+                job.task = asyncio.create_task(job.func(job))
+                await asyncio.wait_for(asyncio.shield(job.task), timeout=self.timeout)
+                self._finish(job, Job.DONE)
+            except asyncio.TimeoutError:
+                logger.warning(f"Job {job.id} timed out after {self.timeout}s")
+                job.kill_processes()
+                job.task.cancel()
+                await asyncio.gather(job.task, return_exceptions=True)
+                self._finish(job, Job.TIMEOUT)
+            except asyncio.CancelledError:
+                if job.task is not None and not job.task.done():
+                    # The worker itself is being stopped
+                    job.kill_processes()
+                    job.task.cancel()
+                    self._finish(job, Job.CANCELLED)
+                    raise
+                self._finish(job, Job.CANCELLED)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                job.error = e
+                self._finish(job, Job.FAILED)
+            finally:
+                self._busy.discard(asyncio.current_task())
+                job.kill_processes()
+                self.running.pop(job.id, None)
+                current_job.reset(token)
+                asyncio.create_task(self._notify())
+
+    def _finish(self, job: Job, state: str):
+        if not job.finished:
+            job.state = state
+        job.finished_at = time.monotonic()
+        logger.info(f"Job {job.id} {job.state}" + (f" {job.meta}" if job.meta else ""))
+        state_store.record_job(job.id, state=job.state, meta=job.meta)
+        if job.started_at is not None:
+            JOB_SECONDS.observe(job.finished_at - job.started_at, state=job.state)
+            timing_logger.info(json.dumps({
+                'job': job.id,
+                'user': job.user_id,
+                'description': job.description,
+                'state': job.state,
+                'queue_wait_s': round(job.started_at - job.created_at, 3),
+                'cost_estimate': round(job.cost, 1),
+                'run_s': round(job.finished_at - job.started_at, 3),
+                'stages_s': {stage: round(seconds, 3) for stage, seconds in job.timings.items()},
+                **job.meta,
+            }, default=str))
+        for callback in job._on_finish:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Cleanup of job {job.id} failed: {e}")
+        job._on_finish.clear()
+        job.done.set()
+        # Keep only unfinished jobs around for lookups
+        self.jobs.pop(job.id, None)
+
+
+job_manager = JobManager()
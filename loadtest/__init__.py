@@ -0,0 +1,7 @@
+"""End-to-end load testing of bot.py against a local fake Bot API
+
+`python -m loadtest.driver --users 20` starts the fake API, launches bot.py
+against it and simulates users uploading files and pressing menu buttons.
+`python -m loadtest.driver --check` runs every scenario once and exits
+non-zero on failure, so the harness doubles as an integration test.
+"""
@@ -0,0 +1,388 @@
+"""Load driver: N simulated users against bot.py running on a fake Bot API
+
+    python -m loadtest.driver --users 20 --rounds 2
+    python -m loadtest.driver --mode webhook --scenarios video_remux image_resize
+    python -m loadtest.driver --check
+
+Each flow uploads a file, waits for the menu and presses the buttons of its
+scenario, and ends when the bot sends the result (or reports an error).
+Reports throughput, end-to-end latency percentiles, time to menu, the
+number of Telegram edits per flow and how often the bot's event loop was
+blocked (from its /metrics and /health).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fixtures import make_audio, make_image, make_pdf, make_video
+from loadtest.fake_api import BOT_USER, Call, FakeBotAPI
+
+TOKEN = "123456:LOADTEST"
+WEBHOOK_SECRET = "loadtest-secret"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Texts the bot ends a failed flow with
+FAILURE_PREFIXES = ("❌", "⏳", "💾", "⌛", "🐢")
+BUSY_PREFIXES = ("⏳", "💾", "🐢")  # refused for load or per-user limits, not broken
+
+
+class Scenario:
+    def __init__(self, name: str, kind: str, make_file: Callable[[], str], buttons: List[str],
+                 result_method: str, result_ext: Optional[str] = None, album: int = 0):
+        self.name = name
+        self.kind = kind  # how the file is sent: video, document or photo
+        self.make_file = make_file
+        self.buttons = buttons
+        self.result_method = result_method
+        self.result_ext = result_ext
+        self.album = album  # files sent as one media group (batch mode)
+        self.path: Optional[str] = None
+
+
+SCENARIOS = {s.name: s for s in [
+    Scenario("video_remux", "video", lambda: make_video(640, 360, 5),
+             ["video_convert_menu", "vformat_mkv"], "sendDocument", ".mkv"),
+    Scenario("video_stream", "video", lambda: make_video(640, 360, 5),
+             ["video_convert_menu", "vformat_mp4"], "sendVideo", ".mp4"),
+    Scenario("video_transcode", "video", lambda: make_video(640, 360, 5),
+             ["video_convert_menu", "vformat_avi"], "sendDocument", ".avi"),
+    Scenario("pdf_txt", "document", lambda: make_pdf(20), ["doc_pdf_txt"], "sendDocument", ".txt"),
+    Scenario("image_resize", "photo", lambda: make_image(2000, 1500),
+             ["img_resize_menu", "iresize_pct_50"], "sendDocument", ".jpg"),
+    Scenario("image_convert", "document", lambda: make_image(1000, 800, "png"),
+             ["img_convert_menu", "iformat_jpg"], "sendPhoto"),
+    Scenario("audio_extract", "video", lambda: make_video(640, 360, 5),
+             ["video_audio_menu", "vaudio_original"], "sendDocument", ".m4a"),
+    # Finishes at the first part: the time until a split starts paying off
+    Scenario("video_split", "video", lambda: make_video(640, 360, 12),
+             ["video_split_menu", "vsplit_count_3"], "sendDocument", ".mp4"),
+    Scenario("audio_normalize", "audio", lambda: make_audio(30),
+             ["audio_normalize"], "sendDocument", ".mp3"),
+    Scenario("album_resize", "photo", lambda: make_image(2000, 1500), ["batch_resize50"],
+             "sendDocument", ".zip", album=10),
+    Scenario("album_pdf", "photo", lambda: make_image(2000, 1500), ["batch_pdf"],
+             "sendDocument", ".pdf", album=10),
+]}
+
+
+class FlowResult:
+    def __init__(self, scenario: str, user_id: int):
+        self.scenario = scenario
+        self.user_id = user_id
+        self.status = "pending"
+        self.detail = ""
+        self.latency: Optional[float] = None
+        self.menu_latency: Optional[float] = None
+        self.edits = 0
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Driver:
+    def __init__(self, api: FakeBotAPI, mode: str, bot_port: int, timeout: float, shared_files: bool):
+        self.api = api
+        self.mode = mode
+        self.bot_url = f"http://127.0.0.1:{bot_port}"
+        self.timeout = timeout
+        self.shared_files = shared_files
+        self.http = httpx.AsyncClient(timeout=30)
+        self._callback_ids = itertools.count(1)
+
+    async def deliver(self, payload: dict):
+        update = self.api.make_update(payload)
+        if self.mode == 'webhook':
+            response = await self.http.post(f"{self.bot_url}/telegram", json=update,
+                                            headers={'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET})
+            response.raise_for_status()
+        else:
+            await self.api.push_update(update)
+
+    async def next_call(self, chat_id: int, deadline: float, result: FlowResult,
+                        predicate: Callable[[Call], bool]) -> Call:
+        queue = self.api.chat_events[chat_id]
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            call = await asyncio.wait_for(queue.get(), remaining)
+            if call.method == 'editMessageText':
+                result.edits += 1
+            if predicate(call):
+                return call
+
+    def file_payload(self, scenario: Scenario, user: dict, file_id: str, media_group_id: str = None) -> dict:
+        size = os.path.getsize(scenario.path)
+        info = {'file_id': file_id, 'file_unique_id': self.api.files[file_id]['unique_id'], 'file_size': size}
+        name = os.path.basename(scenario.path)
+        if scenario.kind == 'video':
+            media = {'video': {**info, 'width': 640, 'height': 360, 'duration': 5,
+                               'file_name': name, 'mime_type': "video/mp4"}}
+        elif scenario.kind == 'photo':
+            media = {'photo': [{**info, 'width': 2000, 'height': 1500}]}
+        elif scenario.kind == 'audio':
+            media = {'audio': {**info, 'duration': 30, 'file_name': name, 'mime_type': "audio/mpeg"}}
+        else:
+            media = {'document': {**info, 'file_name': name}}
+        if media_group_id:
+            media['media_group_id'] = media_group_id
+        return {'message': {'message_id': self.api.next_message_id(), 'date': int(time.time()),
+                            'chat': {'id': user['id'], 'type': 'private'}, 'from': user, **media}}
+
+    async def run_flow(self, scenario: Scenario, user_id: int, round_number: int) -> FlowResult:
+        result = FlowResult(scenario.name, user_id)
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+        file_ids = [f"{scenario.name}_{user_id}_{round_number}_{n}" for n in range(scenario.album or 1)]
+        for file_id in file_ids:
+            self.api.register_file(scenario.path, file_id, scenario.name if self.shared_files else file_id)
+        media_group_id = f"{user_id}{round_number}" if scenario.album else None
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        try:
+            for file_id in file_ids:
+                await self.deliver(self.file_payload(scenario, user, file_id, media_group_id))
+            menu = await self.next_call(user_id, deadline, result, lambda c: c.method == 'sendMessage' and (
+                'reply_markup' in c.params or c.params.get('text', '').startswith("🐢")))
+            if 'reply_markup' not in menu.params:
+                result.status, result.detail = "busy", menu.params['text'].splitlines()[0]
+                result.latency = time.monotonic() - started
+                return result
+            result.menu_latency = time.monotonic() - started
+            message = {'message_id': menu.result['message_id'], 'date': int(time.time()),
+                       'chat': {'id': user_id, 'type': 'private'}, 'from': BOT_USER, 'text': "menu"}
+
+            for index, data in enumerate(scenario.buttons):
+                await self.deliver({'callback_query': {
+                    'id': str(next(self._callback_ids)), 'from': user, 'chat_instance': str(user_id),
+                    'message': message, 'data': data}})
+                if index < len(scenario.buttons) - 1:
+                    # Wait for the submenu before pressing the next button
+                    await self.next_call(user_id, deadline, result, lambda c: c.method == 'editMessageText')
+
+            final = await self.next_call(user_id, deadline, result, lambda c: (
+                c.method in ('sendDocument', 'sendPhoto', 'sendVideo')
+                or (c.method in ('editMessageText', 'sendMessage')
+                    and c.params.get('text', '').startswith(FAILURE_PREFIXES))))
+            result.latency = time.monotonic() - started
+            if final.method.startswith('send') and final.method != 'sendMessage':
+                result.status, result.detail = self.check_result(scenario, final)
+            else:
+                text = final.params.get('text', '')
+                result.status = "busy" if text.startswith(BUSY_PREFIXES) else "failed"
+                result.detail = text.splitlines()[0]
+        except asyncio.TimeoutError:
+            result.status, result.detail = "timeout", f"no result within {self.timeout:.0f}s"
+        except httpx.HTTPError as e:
+            result.status, result.detail = "failed", f"webhook delivery: {e}"
+        return result
+
+    @staticmethod
+    def check_result(scenario: Scenario, call: Call):
+        if call.method != scenario.result_method:
+            return "failed", f"expected {scenario.result_method}, got {call.method}"
+        upload = next((v for k, v in call.params.items() if k in ('document', 'photo', 'video')), "")
+        if scenario.result_ext and scenario.result_ext not in upload and not upload.startswith("sent_"):
+            return "failed", f"unexpected output {upload}"
+        return "ok", upload
+
+    async def bot_metric_lines(self) -> List[str]:
+        response = await self.http.get(f"{self.bot_url}/metrics")
+        return response.text.splitlines()
+
+    async def health(self) -> dict:
+        response = await self.http.get(f"{self.bot_url}/health")
+        return response.json()
+
+
+async def wait_for_bot(url: str, process: subprocess.Popen, timeout: float = 90):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"bot.py exited with code {process.returncode}")
+            try:
+                if (await client.get(f"{url}/health")).status_code in (200, 503):
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError("bot.py did not come up")
+
+
+def start_bot(api: FakeBotAPI, mode: str, port: int, log_path: str) -> subprocess.Popen:
+    env = dict(os.environ, BOT_TOKEN=TOKEN, TELEGRAM_API_URL=api.base_url, BOT_MODE=mode, PORT=str(port),
+               WEBHOOK_SECRET=WEBHOOK_SECRET, DATA_DIR=tempfile.mkdtemp(prefix="loadtest_data_"))
+    env.pop('WEBHOOK_URL', None)
+    log = open(log_path, 'w')
+    return subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "bot.py")], cwd=REPO_ROOT, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+async def stop_bot(process: subprocess.Popen):
+    # Wait without blocking the loop: the fake API must keep answering during shutdown
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(asyncio.to_thread(process.wait), 30)
+        except asyncio.TimeoutError:
+            process.kill()
+            await asyncio.to_thread(process.wait)
+
+
+def loop_blocking(lines: List[str]) -> Dict[str, float]:
+    """Share of event loop lag samples above 100 ms, from the bot's lag histogram"""
+    under, count = 0.0, 0.0
+    for line in lines:
+        if line.startswith('bot_event_loop_lag_seconds_bucket{le="0.1"}'):
+            under = float(line.rsplit(' ', 1)[1])
+        elif line.startswith('bot_event_loop_lag_seconds_count'):
+            count = float(line.rsplit(' ', 1)[1])
+    return {'samples': count, 'blocked': count - under, 'blocked_ratio': (count - under) / count if count else 0.0}
+
+
+def report(results: List[FlowResult], elapsed: float, api: FakeBotAPI, blocking: Dict[str, float],
+           max_lag_ms: float) -> dict:
+    ok = [r for r in results if r.status == "ok"]
+    latencies = [r.latency for r in ok]
+    menus = [r.menu_latency for r in results if r.menu_latency is not None]
+    by_status: Dict[str, int] = {}
+    for r in results:
+        by_status[r.status] = by_status.get(r.status, 0) + 1
+    summary = {
+        'flows': len(results),
+        'status': by_status,
+        'elapsed_s': round(elapsed, 2),
+        'throughput_per_s': round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        'latency_s': {f"p{p}": round(percentile(latencies, p), 3) for p in (50, 95, 99)},
+        'menu_latency_s': {f"p{p}": round(percentile(menus, p), 3) for p in (50, 95, 99)},
+        'edits_per_flow': round(statistics.mean(r.edits for r in results), 1) if results else 0,
+        'upload_mb': round(sum(c.upload_bytes for c in api.calls) / 2**20, 2),
+        'api_calls': len(api.calls),
+        'loop_lag_samples': int(blocking['samples']),
+        'loop_blocked_over_100ms': int(blocking['blocked']),
+        'loop_blocked_ratio': round(blocking['blocked_ratio'], 4),
+        'loop_max_lag_ms': max_lag_ms,
+    }
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    for r in results:
+        if r.status != "ok":
+            print(f"  {r.scenario} user {r.user_id}: {r.status} - {r.detail}")
+    return summary
+
+
+async def run_users(driver: Driver, scenarios: List[Scenario], users: int, rounds: int,
+                    concurrency: int, ramp: float) -> List[FlowResult]:
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[FlowResult] = []
+
+    async def user_session(n: int):
+        await asyncio.sleep(ramp * n / max(users, 1))
+        user_id = 100000 + n
+        for round_number in range(rounds):
+            scenario = scenarios[(n + round_number) % len(scenarios)]
+            async with semaphore:
+                results.append(await driver.run_flow(scenario, user_id, round_number))
+
+    await asyncio.gather(*(user_session(n) for n in range(users)))
+    return results
+
+
+async def main_async(args) -> int:
+    scenarios = [SCENARIOS[name] for name in args.scenarios]
+    for scenario in scenarios:
+        scenario.path = scenario.make_file()
+
+    api = FakeBotAPI(TOKEN, port=args.api_port)
+    await api.start()
+    bot = start_bot(api, args.mode, args.bot_port, args.bot_log)
+    driver = Driver(api, args.mode, args.bot_port, args.timeout, args.shared_files)
+    try:
+        await wait_for_bot(driver.bot_url, bot)
+        await driver.health()  # resets the max-lag window
+
+        if args.check:
+            return await run_check(driver, scenarios)
+
+        started = time.monotonic()
+        results = await run_users(driver, scenarios, args.users, args.rounds, args.concurrency, args.ramp)
+        elapsed = time.monotonic() - started
+        health = await driver.health()
+        summary = report(results, elapsed, api, loop_blocking(await driver.bot_metric_lines()),
+                         health.get('loop_lag_ms', 0.0))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(summary, f, indent=2, ensure_ascii=False)
+        return 0
+    finally:
+        await driver.http.aclose()
+        await stop_bot(bot)
+        await api.stop()
+
+
+async def run_check(driver: Driver, scenarios: List[Scenario]) -> int:
+    """Integration check: every scenario alone, then all of them concurrently"""
+    failures = 0
+    for n, scenario in enumerate(scenarios):
+        result = await driver.run_flow(scenario, 200000 + n, 0)
+        passed = result.status == "ok"
+        failures += not passed
+        print(f"{'PASS' if passed else 'FAIL'} {scenario.name:<18} {result.latency or 0:6.2f}s  {result.detail}")
+
+    results = await asyncio.gather(*(driver.run_flow(scenario, 300000 + n, 0)
+                                     for n, scenario in enumerate(scenarios)))
+    concurrent_ok = all(r.status in ("ok", "busy") for r in results)
+    failures += not concurrent_ok
+    statuses = ", ".join(f"{r.scenario}={r.status}" for r in results)
+    print(f"{'PASS' if concurrent_ok else 'FAIL'} concurrent         {statuses}")
+
+    answered = sum(1 for c in driver.api.calls if c.method == 'answerCallbackQuery')
+    pressed = sum(len(s.buttons) for s in scenarios) * 2
+    callbacks_ok = answered == pressed
+    failures += not callbacks_ok
+    print(f"{'PASS' if callbacks_ok else 'FAIL'} callbacks answered {answered}/{pressed}")
+
+    health = await driver.health()
+    print(f"{'PASS' if health.get('status') == 'ok' else 'FAIL'} health             {health}")
+    failures += health.get('status') != 'ok'
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=1, help="flows per user")
+    parser.add_argument('--concurrency', type=int, default=1000, help="max flows in flight")
+    parser.add_argument('--ramp', type=float, default=0.0, help="seconds over which users arrive")
+    parser.add_argument('--scenarios', nargs='*', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--shared-files', action='store_true',
+                        help="all users send the same file (exercises the result cache)")
+    parser.add_argument('--timeout', type=float, default=300, help="per-flow timeout in seconds")
+    parser.add_argument('--api-port', type=int, default=8999)
+    parser.add_argument('--bot-port', type=int, default=8081)
+    parser.add_argument('--bot-log', default=os.path.join(tempfile.gettempdir(), "loadtest_bot.log"))
+    parser.add_argument('--output', help="write the summary JSON here")
+    parser.add_argument('--check', action='store_true', help="run the integration checks and exit")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Local stand-in for the Telegram Bot API
+
+Implements the calls bot.py makes (getMe, getUpdates long polling, getFile,
+file downloads, sendMessage, sendDocument, sendPhoto, sendVideo,
+editMessageText, answerCallbackQuery, webhook management). Every call the bot
+makes is recorded and published per chat, so a driver can wait for replies.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': "LoadTestBot", 'username': "load_test_bot"}
+
+
+class Call:
+    """One Bot API request made by the bot"""
+
+    def __init__(self, method: str, params: dict, upload_bytes: int = 0):
+        self.method = method
+        self.params = params
+        self.upload_bytes = upload_bytes
+        self.result = None
+        self.at = time.monotonic()
+
+    @property
+    def chat_id(self) -> Optional[int]:
+        chat_id = self.params.get('chat_id')
+        return int(chat_id) if chat_id not in (None, "") else None
+
+
+def parse_multipart(body: bytes, content_type: str) -> Tuple[dict, int]:
+    """Form fields of a multipart body, plus the total size of the uploaded files"""
+    boundary = content_type.split("boundary=", 1)[1].strip().strip('"').encode()
+    fields, upload_bytes = {}, 0
+    for part in body.split(b"--" + boundary):
+        head, sep, content = part.partition(b"\r\n\r\n")
+        if not sep:
+            continue
+        content = content[:-2] if content.endswith(b"\r\n") else content
+        disposition = next((line for line in head.decode(errors='replace').split("\r\n")
+                            if line.lower().startswith("content-disposition")), "")
+        params = dict(item.strip().split("=", 1) for item in disposition.split(";")[1:] if "=" in item)
+        name = params.get('name', '').strip('"')
+        if 'filename' in params:
+            upload_bytes += len(content)
+            fields[name] = f"<upload {params['filename'].strip(chr(34))} {len(content)} bytes>"
+        else:
+            fields[name] = content.decode(errors='replace')
+    return fields, upload_bytes
+
+
+class FakeBotAPI:
+    def __init__(self, token: str, host: str = "127.0.0.1", port: int = 8999):
+        self.token = token
+        self.host = host
+        self.port = port
+        self.files: Dict[str, dict] = {}  # file_id -> {'path', 'unique_id', 'size'}
+        self.updates: List[dict] = []
+        self.calls: List[Call] = []
+        self.chat_events: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.webhook_url: Optional[str] = None
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Condition()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: set = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Long polls would otherwise keep wait_closed() waiting
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    # Driver side
+
+    def register_file(self, path: str, file_id: str, unique_id: str) -> dict:
+        self.files[file_id] = {'path': path, 'unique_id': unique_id, 'size': os.path.getsize(path)}
+        return self.files[file_id]
+
+    def next_message_id(self) -> int:
+        return next(self._message_ids)
+
+    def make_update(self, payload: dict) -> dict:
+        """Wrap a message/callback_query payload into an Update with a fresh update_id"""
+        return {'update_id': next(self._update_ids), **payload}
+
+    async def push_update(self, update: dict):
+        """Queue an update for getUpdates (in webhook mode the driver POSTs it instead)"""
+        async with self._new_updates:
+            self.updates.append(update)
+            self._new_updates.notify_all()
+
+    # Bot API methods
+
+    def _message(self, chat_id, **fields) -> dict:
+        return {'message_id': self.next_message_id(), 'date': int(time.time()),
+                'chat': {'id': int(chat_id), 'type': 'private'}, 'from': BOT_USER, **fields}
+
+    def _sent_file(self, kind: str) -> dict:
+        file_id = f"sent_{kind}_{len(self.calls)}"
+        unique = {'file_id': file_id, 'file_unique_id': f"u{file_id}", 'file_size': 1}
+        if kind == 'photo':
+            return {'photo': [{**unique, 'width': 1, 'height': 1}]}
+        if kind == 'video':
+            return {'video': {**unique, 'width': 1, 'height': 1, 'duration': 1}}
+        return {'document': {**unique, 'file_name': "output"}}
+
+    async def get_updates(self, params: dict):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        async with self._new_updates:
+            # Confirmed updates are dropped, as Telegram does
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return list(self.updates[:int(params.get('limit') or 100)])
+
+    async def call(self, method: str, params: dict, upload_bytes: int = 0):
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        call = Call(method, params, upload_bytes)
+        self.calls.append(call)
+        call.result = self._result(method, params)
+        if call.chat_id is not None:
+            self.chat_events[call.chat_id].put_nowait(call)
+        return call.result
+
+    def _result(self, method: str, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getFile':
+            info = self.files.get(params.get('file_id'))
+            if info is None:
+                raise KeyError("file not found")
+            return {'file_id': params['file_id'], 'file_unique_id': info['unique_id'],
+                    'file_size': info['size'], 'file_path': f"files/{params['file_id']}"}
+        if method == 'sendMessage':
+            return self._message(params['chat_id'], text=params.get('text', ''))
+        if method in ('sendDocument', 'sendPhoto', 'sendVideo'):
+            kind = method[4:].lower()
+            return self._message(params['chat_id'], caption=params.get('caption', ''), **self._sent_file(kind))
+        if method == 'editMessageText':
+            return self._message(params.get('chat_id') or 0, text=params.get('text', ''))
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        # answerCallbackQuery, deleteMessage, sendChatAction...
+        return True
+
+    # HTTP plumbing
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                http_method, target, _ = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                body = await reader.readexactly(length) if length else b""
+                status, content_type, payload = await self._dispatch(http_method, unquote(target), headers, body)
+                writer.write((f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                              f"Content-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n"
+                              ).encode('latin-1') + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _dispatch(self, http_method: str, target: str, headers: dict, body: bytes):
+        path = target.split('?', 1)[0]
+        file_prefix = f"/file/bot{self.token}/files/"
+        if path.startswith(file_prefix):
+            info = self.files.get(path[len(file_prefix):])
+            if info is None:
+                return 404, "text/plain", b"not found"
+            with open(info['path'], 'rb') as f:
+                return 200, "application/octet-stream", f.read()
+
+        api_prefix = f"/bot{self.token}/"
+        if not path.startswith(api_prefix):
+            return 404, "application/json", json.dumps({'ok': False, 'error_code': 404,
+                                                         'description': "Not Found"}).encode()
+        method = path[len(api_prefix):]
+        content_type = headers.get('content-type', '')
+        upload_bytes = 0
+        if content_type.startswith('multipart/form-data'):
+            params, upload_bytes = parse_multipart(body, content_type)
+        elif content_type.startswith('application/json'):
+            params = json.loads(body or b'{}')
+        else:
+            params = dict(parse_qsl(body.decode(), keep_blank_values=True))
+        try:
+            result = await self.call(method, params, upload_bytes)
+            return 200, "application/json", json.dumps({'ok': True, 'result': result}).encode()
+        except KeyError as e:
+            return 400, "application/json", json.dumps({'ok': False, 'error_code': 400,
+                                                         'description': f"Bad Request: {e}"}).encode()
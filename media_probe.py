@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import subprocess
+from collections import OrderedDict
+from typing import Optional
+
+from config import FFMPEG_BINARY, FFPROBE_BINARY, get_file_type
+from ffmpeg_runner import FFmpegError, probe
+
+logger = logging.getLogger(__name__)
+
+# Probe results kept in memory, keyed on (path, size, mtime)
+PROBE_CACHE_SIZE = 256
+
+WORD_MIME_TYPES = [
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+]
+
+_mime_detector = None
+_probe_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+
+
+def detect_mime(file_path: str) -> str:
+    """MIME type from the file's magic bytes, using one shared detector"""
+    global _mime_detector
+    if _mime_detector is None:
+        import magic
+        _mime_detector = magic.Magic(mime=True)
+    with open(file_path, 'rb') as f:
+        header = f.read(8192)
+    return _mime_detector.from_buffer(header)
+
+
+def parse_rate(rate: Optional[str]) -> Optional[float]:
+    """Parse an ffprobe rational like '30000/1001'"""
+    if not rate:
+        return None
+    num, _, den = rate.partition('/')
+    try:
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return value or None
+
+
+def media_details(data: dict) -> dict:
+    """Flatten the interesting parts of an ffprobe result"""
+    streams = data.get('streams', [])
+    fmt = data.get('format', {})
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not s.get('disposition', {}).get('attached_pic')), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    details = {'streams': streams, 'container': fmt.get('format_name')}
+    duration = fmt.get('duration') or (video or audio or {}).get('duration')
+    if duration:
+        details['duration'] = float(duration)
+    if fmt.get('bit_rate'):
+        details['bit_rate'] = int(fmt['bit_rate'])
+    if video:
+        details.update({
+            'width': video.get('width'),
+            'height': video.get('height'),
+            'resolution': f"{video.get('width')}x{video.get('height')}",
+            'fps': parse_rate(video.get('avg_frame_rate')) or parse_rate(video.get('r_frame_rate')),
+            'video_codec': video.get('codec_name'),
+            'pix_fmt': video.get('pix_fmt'),
+        })
+    if audio:
+        details.update({
+            'audio_codec': audio.get('codec_name'),
+            'sample_rate': int(audio['sample_rate']) if audio.get('sample_rate') else None,
+            'channels': audio.get('channels'),
+        })
+    return details
+
+
+def image_details(file_path: str) -> dict:
+    """Image size and mode read from the header only (Pillow decodes lazily)"""
+    from PIL import Image
+    with Image.open(file_path) as img:
+        return {'resolution': f"{img.width}x{img.height}", 'width': img.width,
+                'height': img.height, 'mode': img.mode}
+
+
+def pdf_page_count(file_path: str) -> int:
+    """Page count from the document catalog, without walking the page tree"""
+    import PyPDF2
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        try:
+            return int(reader.trailer['/Root']['/Pages']['/Count'])
+        except (KeyError, TypeError, ValueError):
+            return len(reader.pages)
+
+
+def warm_up():
+    """Load what the first probe would otherwise wait for: libmagic, Pillow, PyPDF2 and the ffmpeg binaries"""
+    detect_mime(__file__)
+    import PIL.Image  # noqa: F401
+    import PyPDF2  # noqa: F401
+    for binary in (FFPROBE_BINARY, FFMPEG_BINARY):
+        try:
+            subprocess.run([binary, '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        except OSError as e:
+            logger.warning(f"Could not run {binary}: {e}")
+
+
+def clear_probe_cache():
+    """Forget memoized probe results (benchmarks measure cold probes)"""
+    _probe_cache.clear()
+
+
+async def probe_file(file_path: str) -> dict:
+    """Get detailed information about a file, memoized per file version"""
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_size, stat.st_mtime_ns)
+    cached = _probe_cache.get(key)
+    if cached is not None:
+        _probe_cache.move_to_end(key)
+        return dict(cached)
+
+    file_info = {
+        'size': stat.st_size,
+        'format': os.path.splitext(file_path)[1].lower(),
+        'type': 'unknown'
+    }
+
+    mime_type = detect_mime(file_path)
+    ext_type = get_file_type(file_path)
+
+    if mime_type.startswith(('video/', 'audio/')) or ext_type in ('video', 'audio'):
+        try:
+            details = media_details(await probe(file_path))
+            file_info.update(details)
+            file_info['type'] = 'video' if 'video_codec' in details else 'audio'
+        except (FFmpegError, ValueError) as e:
+            logger.warning(f"ffprobe failed for {file_path}: {e}")
+            file_info['type'] = 'audio' if mime_type.startswith('audio/') else 'video'
+
+    elif mime_type.startswith('image/'):
+        file_info['type'] = 'image'
+        try:
+            file_info.update(image_details(file_path))
+        except Exception as e:
+            logger.warning(f"Could not read image header of {file_path}: {e}")
+
+    elif mime_type == 'application/pdf':
+        file_info['type'] = 'pdf'
+        try:
+            file_info['pages'] = await asyncio.to_thread(pdf_page_count, file_path)
+        except Exception as e:
+            logger.warning(f"Could not count pages of {file_path}: {e}")
+
+    elif mime_type in WORD_MIME_TYPES:
+        file_info['type'] = 'document'
+
+    _probe_cache[key] = file_info
+    while len(_probe_cache) > PROBE_CACHE_SIZE:
+        _probe_cache.popitem(last=False)
+    return dict(file_info)
@@ -0,0 +1,165 @@
+"""In-process metrics registry exported in the Prometheus text format
+
+Counters, gauges and histograms with optional labels; all updates happen on the
+event loop thread, so no locking is needed.
+"""
+import bisect
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds, from a Telegram edit to a long encode
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+BYTES_BUCKETS = tuple(2 ** n for n in range(16, 34, 2))  # 64KB .. 8GB
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines of this metric, without the HELP/TYPE header"""
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()])
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback  # read at export time, for values owned elsewhere
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(self.labelnames, labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            return [f"{self.name} {_format_value(self.callback())}"]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: bucket counts (+Inf last), sum, count
+        self.series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float('inf') else f"{bound:g}"
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+              callback: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames, callback))
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+registry = Registry()
+
+# Hot-path metrics shared across modules
+STAGE_SECONDS = registry.histogram("bot_stage_duration_seconds",
+                                   "Time spent per pipeline stage", ["stage"])
+STAGE_ERRORS = registry.counter("bot_stage_errors_total", "Stages that raised", ["stage"])
+BYTES_IN = registry.counter("bot_bytes_in_total", "Bytes read into a stage", ["stage"])
+BYTES_OUT = registry.counter("bot_bytes_out_total", "Bytes produced by a stage", ["stage"])
+FFMPEG_CPU_SECONDS = registry.histogram("bot_ffmpeg_cpu_seconds", "CPU time (user+system) per ffmpeg run")
+FFMPEG_PEAK_RSS = registry.histogram("bot_ffmpeg_peak_rss_bytes", "Peak resident memory per ffmpeg run",
+                                     buckets=BYTES_BUCKETS)
+QUEUE_WAIT_SECONDS = registry.histogram("bot_job_queue_wait_seconds", "Time jobs spent queued, by estimated size",
+                                        ["size"])
+JOB_SECONDS = registry.histogram("bot_job_duration_seconds", "Job run time by outcome", ["state"])
+LOOP_LAG_SECONDS = registry.histogram("bot_event_loop_lag_seconds", "Event loop wake-up delay",
+                                      buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+QUALITY_DECISIONS = registry.counter("bot_quality_decisions_total", "Encoding quality tiers chosen by the governor",
+                                     ["tier", "pressure"])
+ENCODE_SPEED = registry.histogram("bot_encode_speed_ratio", "Media seconds encoded per wall second", ["tier"],
+                                  buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32))
+UPLOADS_THROTTLED = registry.counter("bot_uploads_throttled_total", "Files refused by the per-user upload limits")
+STATUS_UPDATES = registry.counter("bot_status_updates_total", "Progress updates by what became of them", ["result"])
+STATUS_EDIT_SECONDS = registry.histogram("bot_status_edit_seconds", "Latency of progress message edits")
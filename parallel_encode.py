@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import shutil
+from typing import List, Optional
+
+from config import PARALLEL_ENCODE_MAX_SEGMENTS, PARALLEL_ENCODE_MIN_DURATION
+from conversion_planner import muxer_args
+from ffmpeg_runner import run_ffmpeg, write_concat_list
+from media_probe import probe_file
+from workspace import job_tempdir
+
+logger = logging.getLogger(__name__)
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def segment_count(duration: Optional[float]) -> int:
+    """How many segments to encode in parallel; 1 means use a single process"""
+    if not duration or duration < PARALLEL_ENCODE_MIN_DURATION:
+        return 1
+    return max(1, min(available_cores(), PARALLEL_ENCODE_MAX_SEGMENTS))
+
+
+class CombinedProgress:
+    """Merges per-segment progress into one duration-weighted percentage"""
+
+    def __init__(self, weights: List[float], progress_callback, status: str, progress_range):
+        self.weights = weights
+        self.total = sum(weights) or 1.0
+        self.fractions = [0.0] * len(weights)
+        self.progress_callback = progress_callback
+        self.status = status
+        self.low, self.high = progress_range
+        self.last_reported = None
+
+    def for_segment(self, index: int):
+        async def callback(percent, text):
+            self.fractions[index] = percent / 100
+            await self.report()
+        return callback
+
+    async def report(self):
+        if self.progress_callback is None:
+            return
+        done = sum(f * w for f, w in zip(self.fractions, self.weights)) / self.total
+        percent = int(self.low + (self.high - self.low) * done)
+        if percent != self.last_reported:
+            self.last_reported = percent
+            finished = sum(1 for f in self.fractions if f >= 1.0)
+            await self.progress_callback(percent, f"{self.status}\n🧩 {finished}/{len(self.weights)} segments done")
+
+
+async def encode_parallel(input_path: str, output_path: str, video_args: List[str], audio_args: List[str],
+                          segments: int, progress_callback=None, status: str = "Encoding...",
+                          progress_range=(0, 100), two_pass: bool = False, audio_map: str = '0:a'):
+    """Encode the video in keyframe-aligned time segments concurrently, then join them losslessly
+
+    The input video is split with stream copy (so cuts fall on keyframes), each
+    segment is encoded by its own ffmpeg process, and the results are joined with
+    the concat demuxer. Audio is encoded once over its whole length, in parallel
+    with the video, so there are no gaps or priming glitches at segment seams;
+    audio_map selects the audio tracks kept (all by default).
+    """
+    info = await probe_file(input_path)
+    duration = info.get('duration') or 0
+    output_ext = os.path.splitext(output_path)[1]
+    low, high = progress_range
+    work_dir = job_tempdir("parallel_")
+    try:
+        # 1. Split at keyframes without re-encoding
+        await run_ffmpeg(['-i', input_path, '-map', '0:v:0', '-c', 'copy', '-f', 'segment',
+                          '-segment_time', f"{duration / segments:.3f}", '-reset_timestamps', '1',
+                          os.path.join(work_dir, "source_%03d.mkv")])
+        sources = sorted(f for f in os.listdir(work_dir) if f.startswith("source_"))
+        source_paths = [os.path.join(work_dir, f) for f in sources]
+        weights = [(await probe_file(path)).get('duration') or 1.0 for path in source_paths]
+        logger.info(f"Parallel encode of {input_path}: {len(source_paths)} segments, {segments} requested")
+
+        threads = max(1, available_cores() // len(source_paths))
+        combined = CombinedProgress(weights, progress_callback, status, (low, high))
+
+        async def encode_segment(index: int, source: str) -> str:
+            encoded = os.path.join(work_dir, f"encoded_{index:03d}{output_ext}")
+            base = ['-i', source, '-map', '0:v:0', *video_args, '-threads', str(threads)]
+            if two_pass:
+                passlog = os.path.join(work_dir, f"passlog_{index:03d}")
+                await run_ffmpeg([*base, '-pass', '1', '-passlogfile', passlog, '-an', '-f', 'null', os.devnull],
+                                 weights[index], combined.for_segment(index), progress_range=(0, 50))
+                await run_ffmpeg([*base, '-pass', '2', '-passlogfile', passlog, '-an', encoded],
+                                 weights[index], combined.for_segment(index), progress_range=(50, 100))
+            else:
+                await run_ffmpeg([*base, '-an', encoded], weights[index], combined.for_segment(index))
+            return encoded
+
+        async def encode_audio() -> Optional[str]:
+            if not audio_args or not info.get('audio_codec'):
+                return None
+            audio_path = os.path.join(work_dir, f"audio{output_ext}")
+            await run_ffmpeg(['-i', input_path, '-map', audio_map, '-vn', *audio_args, audio_path])
+            return audio_path
+
+        # 2. Encode all segments plus the audio track concurrently
+        *encoded, audio_path = await asyncio.gather(
+            *(encode_segment(i, path) for i, path in enumerate(source_paths)),
+            encode_audio()
+        )
+
+        # 3. Join the encoded segments and mux the audio back in, all stream copy
+        list_path = os.path.join(work_dir, "segments.txt")
+        write_concat_list(list_path, encoded)
+        args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path:
+            args += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+        args += ['-c', 'copy', *muxer_args(output_ext), output_path]
+        await run_ffmpeg(args)
+        if progress_callback:
+            await progress_callback(high, status)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
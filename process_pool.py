@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from config import PROCESS_POOL_WORKERS, PROCESS_TASK_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+def worker_context():
+    """Multiprocessing context for the pool and its manager
+
+    With forkserver, one server process imports the main module and the
+    conversion libraries once, and every worker is forked from it. Spawned
+    workers would each re-import bot.py (as __mp_main__) and the libraries.
+    Forking the bot process itself is unsafe: it runs asyncio and HTTP threads.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    from document_worker import WORKER_MODULES
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['__main__', 'document_worker', *WORKER_MODULES])
+    return context
+
+
+class WorkerCrashedError(Exception):
+    """Raised when a task killed its worker process (e.g. a malformed input crashed a C library)"""
+
+
+class ProcessPool:
+    """Warm pool of worker processes for CPU-bound conversions
+
+    Tasks run outside the bot process, so a GIL-heavy or crashing conversion
+    cannot stall or kill the event loop. A task that exceeds its timeout or
+    breaks the pool gets the pool rebuilt, and so does a cancelled task that a
+    worker had already started, since the worker would otherwise keep running
+    it with no one waiting; tasks of other users that were lost in the rebuild
+    are retried once.
+    """
+
+    def __init__(self, workers: int = PROCESS_POOL_WORKERS, task_timeout: float = PROCESS_TASK_TIMEOUT):
+        self.workers = workers
+        self.task_timeout = task_timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+        self._manager = None
+
+    async def start(self):
+        """Create the pool and pre-start every worker with the heavy imports done"""
+        if self._executor is not None:
+            return
+        from document_worker import warm_up
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=worker_context(),
+            initializer=warm_up,
+        )
+        self._generation += 1
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _noop) for _ in range(self.workers)),
+                             return_exceptions=True)
+        logger.info(f"Process pool started with {self.workers} warm workers")
+
+    async def stop(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            manager, self._manager = self._manager, None
+            manager.shutdown()
+
+    async def progress_queue(self):
+        """A queue workers can report progress on (served by one shared manager process)"""
+        if self._manager is None:
+            # Starting the manager blocks while its process spawns
+            self._manager = await asyncio.to_thread(worker_context().Manager)
+        return self._manager.Queue()
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    @property
+    def alive_workers(self) -> int:
+        """Worker processes currently running (0 before start)"""
+        if self._executor is None:
+            return 0
+        return sum(1 for process in list((self._executor._processes or {}).values()) if process.is_alive())
+
+    async def restart(self):
+        """Kill all workers (including stuck ones) and start a fresh pool"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            for process in list((executor._processes or {}).values()):
+                if process.is_alive():
+                    process.kill()
+            executor.shutdown(wait=False, cancel_futures=True)
+        await self.start()
+
+    async def run(self, func: Callable, *args, timeout: Optional[float] = None):
+        """Run func(*args) in a worker process and return its result"""
+        for attempt in range(2):
+            if self._executor is None:
+                await self.start()
+            generation = self._generation
+            future = None
+            try:
+                future = self._executor.submit(func, *args)
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.task_timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"{func.__name__} exceeded {timeout or self.task_timeout}s, restarting worker pool")
+                await self.restart()
+                raise
+            except asyncio.CancelledError:
+                # A task still queued is dropped by cancel(); one a worker picked up has to be killed
+                if future is not None and not future.cancel() and generation == self._generation:
+                    logger.warning(f"{func.__name__} cancelled while running, restarting worker pool")
+                    # Finish the restart even if the caller is cancelled again
+                    await asyncio.shield(self.restart())
+                raise
+            except BrokenProcessPool:
+                if generation != self._generation and attempt == 0:
+                    # Lost to a restart caused by another task: try again on the new pool
+                    logger.warning(f"{func.__name__} lost to a pool restart, retrying")
+                    continue
+                logger.error(f"Worker crashed while running {func.__name__}, restarting worker pool")
+                if generation == self._generation:
+                    await self.restart()
+                raise WorkerCrashedError(f"Worker process crashed during {func.__name__}")
+
+
+def _noop():
+    return None
+
+
+process_pool = ProcessPool()
@@ -0,0 +1,175 @@
+"""Load-aware choice of encoding quality
+
+Before a video is re-encoded the governor looks at how many jobs are waiting,
+how fast recent encodes ran and how busy the CPU is, and picks a tier from
+QUALITY_SETTINGS plus resolution/frame rate caps. Under pressure encodes get
+cheaper, so the queue drains faster; when the bot is idle everyone gets the
+full quality. Every decision is logged and counted, and the speed of each
+encode is recorded per tier so the effect on throughput can be checked.
+"""
+import logging
+import time
+from typing import List, Optional, Tuple
+
+import psutil
+
+from config import QUALITY_GOVERNOR
+from job_manager import annotate_job, job_manager
+from metrics import ENCODE_SPEED, QUALITY_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+# Encoding tiers, best first: x264 CRF and preset (other encoders derive from the CRF)
+QUALITY_SETTINGS = {
+    "best": {"crf": "20", "preset": "slow"},
+    "high": {"crf": "23", "preset": "medium"},
+    "medium": {"crf": "28", "preset": "fast"},
+    "low": {"crf": "32", "preset": "veryfast"},
+}
+
+# Pressure levels and what each one allows
+NORMAL, ELEVATED, HIGH, CRITICAL = range(4)
+LEVEL_NAMES = ["normal", "elevated", "high", "critical"]
+LEVEL_TIERS = ["high", "medium", "medium", "low"]
+LEVEL_CAPS = [(None, None), (None, None), (1080, 30), (720, 30)]  # (max height, max fps)
+
+# What users can ask for
+PREFERENCES = ("auto", "fast", "best")
+
+CPU_BUSY = 0.75
+CPU_SATURATED = 0.92
+SLOW_SPEED = 1.0  # encodes slower than real time make a backlog expensive
+SPEED_SMOOTHING = 0.3  # weight of the newest encode in the moving average
+CPU_SAMPLE_MAX_AGE = 1.0  # seconds a CPU reading is reused
+
+
+def tier_and_caps(preference: str, level: int) -> Tuple[str, Optional[int], Optional[int]]:
+    """(tier, max height, max fps) a preference gets at a pressure level"""
+    tier = LEVEL_TIERS[level]
+    max_height, max_fps = LEVEL_CAPS[level]
+    if preference == "fast":
+        # Never slower than the elevated tier, whatever the load
+        tier = LEVEL_TIERS[max(level, ELEVATED)]
+        max_height, max_fps = LEVEL_CAPS[max(level, HIGH)]
+    elif preference == "best":
+        # Honoured except when the queue is about to overflow
+        tier = "best" if level < HIGH else "high"
+        max_height, max_fps = LEVEL_CAPS[level] if level == CRITICAL else (None, None)
+    return tier, max_height, max_fps
+
+
+class QualityDecision:
+    def __init__(self, preference: str, level: int, tier: str, max_height: Optional[int], max_fps: Optional[int],
+                 reasons: List[str]):
+        self.preference = preference
+        self.level = level
+        self.tier = tier
+        self.settings = dict(QUALITY_SETTINGS[tier])
+        self.max_height = max_height
+        self.max_fps = max_fps
+        self.reasons = reasons
+
+    @property
+    def degraded(self) -> bool:
+        """Whether load made this encode worse than the preference gets on an idle server"""
+        if self.preference not in PREFERENCES:
+            return False
+        return (self.tier, self.max_height, self.max_fps) != tier_and_caps(self.preference, NORMAL)
+
+    def video_filters(self, info: dict) -> List[str]:
+        """scale/fps filters needed to honour the caps for this input (empty if within them)"""
+        filters = []
+        if self.max_height and (info.get('height') or 0) > self.max_height:
+            filters.append(f"scale=-2:{self.max_height}")
+        if self.max_fps and (info.get('fps') or 0) > self.max_fps + 0.5:
+            filters.append(f"fps={self.max_fps}")
+        return filters
+
+    def describe(self) -> str:
+        caps = []
+        if self.max_height:
+            caps.append(f"≤{self.max_height}p")
+        if self.max_fps:
+            caps.append(f"≤{self.max_fps}fps")
+        return (f"{self.tier} (crf {self.settings['crf']}, {self.settings['preset']}"
+                + (f", {' '.join(caps)}" if caps else "") + ")")
+
+
+class QualityGovernor:
+    def __init__(self, enabled: bool = QUALITY_GOVERNOR):
+        self.enabled = enabled
+        self.speed: Optional[float] = None  # moving average of media seconds per wall second
+        self.tier_speed = {}
+        self._cpu = 0.0
+        self._cpu_at = 0.0
+        psutil.cpu_percent(interval=None)  # the first reading only sets the baseline
+
+    def cpu_load(self) -> float:
+        """System CPU use as a fraction, sampled without blocking"""
+        now = time.monotonic()
+        if now - self._cpu_at > CPU_SAMPLE_MAX_AGE:
+            self._cpu = psutil.cpu_percent(interval=None) / 100
+            self._cpu_at = now
+        return self._cpu
+
+    def pressure(self) -> tuple:
+        """(level, reasons) from queue depth, encode speed and CPU headroom"""
+        queued = job_manager.queue_depth
+        queue_fill = queued / max(job_manager.max_queue_size, 1)
+        cpu = self.cpu_load()
+        reasons = [f"queue {queued}/{job_manager.max_queue_size}", f"cpu {cpu:.0%}"]
+        if self.speed is not None:
+            reasons.append(f"speed {self.speed:.2f}x")
+
+        if queue_fill >= 0.8 or (queue_fill >= 0.4 and cpu >= CPU_SATURATED):
+            level = CRITICAL
+        elif queue_fill >= 0.4 or (queued and cpu >= CPU_SATURATED):
+            level = HIGH
+        elif queued or cpu >= CPU_BUSY:
+            level = ELEVATED
+        else:
+            level = NORMAL
+        # Slow encodes turn every waiting job into a long wait
+        if queued and self.speed is not None and self.speed < SLOW_SPEED and level < CRITICAL:
+            level += 1
+        return level, reasons
+
+    def decide(self, preference: str = "auto") -> QualityDecision:
+        """Pick the tier and caps for one encode"""
+        if preference not in PREFERENCES:
+            # An explicit tier (benchmarks, internal callers) is used as is
+            tier = preference if preference in QUALITY_SETTINGS else "high"
+            return QualityDecision(preference, NORMAL, tier, None, None, ["explicit tier"])
+        if not self.enabled:
+            level, reasons = NORMAL, ["governor disabled"]
+        else:
+            level, reasons = self.pressure()
+
+        tier, max_height, max_fps = tier_and_caps(preference, level)
+        decision = QualityDecision(preference, level, tier, max_height, max_fps, reasons)
+        QUALITY_DECISIONS.inc(tier=tier, pressure=LEVEL_NAMES[level])
+        annotate_job('quality', tier)
+        annotate_job('pressure', LEVEL_NAMES[level])
+        if decision.degraded:
+            # Keeps the result out of the result cache, which would serve it long after the load is gone
+            annotate_job('quality_degraded', True)
+        logger.info(f"Quality for '{preference}': {decision.describe()} at {LEVEL_NAMES[level]} pressure "
+                    f"[{', '.join(reasons)}]")
+        return decision
+
+    def record_encode(self, decision: QualityDecision, media_seconds: Optional[float], wall_seconds: float):
+        """Feed back how fast an encode ran at the chosen tier"""
+        if not media_seconds or wall_seconds <= 0:
+            return
+        speed = media_seconds / wall_seconds
+        ENCODE_SPEED.observe(speed, tier=decision.tier)
+        annotate_job('encode_speed', round(speed, 2))
+        self.speed = speed if self.speed is None else (1 - SPEED_SMOOTHING) * self.speed + SPEED_SMOOTHING * speed
+        previous = self.tier_speed.get(decision.tier)
+        self.tier_speed[decision.tier] = speed if previous is None else (
+            (1 - SPEED_SMOOTHING) * previous + SPEED_SMOOTHING * speed)
+        logger.info(f"Encoded {media_seconds:.1f}s at {decision.tier} in {wall_seconds:.1f}s ({speed:.2f}x); "
+                    "average by tier: " + ", ".join(f"{tier} {value:.2f}x" for tier, value in self.tier_speed.items()))
+
+
+quality_governor = QualityGovernor()
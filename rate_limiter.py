@@ -0,0 +1,73 @@
+import time
+from typing import Dict
+
+from config import UPLOAD_FILES_BURST, UPLOAD_FILES_PER_MINUTE, UPLOAD_MB_BURST, UPLOAD_MB_PER_MINUTE
+
+IDLE_BUCKET_TTL = 3600  # seconds before an untouched (and therefore full) bucket is dropped
+
+
+class TokenBucket:
+    """Allows `burst` units at once, refilled at `rate` units per second"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Seconds until amount can be taken; 0 if it can be taken now"""
+        self._refill(time.monotonic())
+        amount = min(amount, self.burst)  # anything up to the burst size eventually fits
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float = 1.0):
+        self._refill(time.monotonic())
+        self.tokens -= min(amount, self.burst)
+
+
+class RateLimiter:
+    """Per-key token buckets; checking several limiters before taking from any keeps them consistent"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[int, TokenBucket] = {}
+        self._last_prune = time.monotonic()
+
+    def bucket(self, key) -> TokenBucket:
+        self._prune()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < IDLE_BUCKET_TTL:
+            return
+        self._last_prune = now
+        for key in [key for key, bucket in self.buckets.items() if now - bucket.updated > IDLE_BUCKET_TTL]:
+            del self.buckets[key]
+
+
+upload_files = RateLimiter(UPLOAD_FILES_PER_MINUTE / 60, UPLOAD_FILES_BURST)
+upload_bytes = RateLimiter(UPLOAD_MB_PER_MINUTE * 2**20 / 60, UPLOAD_MB_BURST * 2**20)
+
+
+def admit_upload(user_id: int, size: int) -> float:
+    """Count an incoming file against the user's upload limits
+
+    Returns 0 when it is admitted, otherwise the seconds to wait (nothing is
+    taken from either bucket then).
+    """
+    files, data = upload_files.bucket(user_id), upload_bytes.bucket(user_id)
+    wait = max(files.wait_time(1), data.wait_time(size))
+    if wait == 0:
+        files.take(1)
+        data.take(size)
+    return wait
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import CACHE_DIR, CACHE_FLUSH_INTERVAL, CACHE_MAX_BYTES, CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Persistent cache of conversion results keyed on (file_unique_id, operation, params)
+
+    Each entry remembers the Telegram file_id of the output we sent, so a repeat
+    request can be answered without downloading, converting or uploading again.
+    The output file itself is kept on disk too (for re-sending if Telegram ever
+    rejects the file_id) until the size budget forces it out, least recently
+    used first.
+
+    Changes only mark the index dirty; a background task writes it out every
+    flush_interval from a thread. Lookups never write: recency is kept in
+    memory and saved along with the next change.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES,
+                 max_entries: int = CACHE_MAX_ENTRIES, flush_interval: float = CACHE_FLUSH_INTERVAL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._task: Optional[asyncio.Task] = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write the index if it changed since the last flush"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        # Entries keep changing on the loop while the thread serializes the copy
+        snapshot = {key: dict(entry) for key, entry in self.entries.items()}
+        if not await asyncio.to_thread(self._save, snapshot):
+            self.dirty = True
+
+    @staticmethod
+    def make_key(file_unique_id: str, operation: str, params: Optional[dict] = None) -> str:
+        """Stable key for an operation applied to a Telegram file"""
+        raw = json.dumps([file_unique_id, operation, params or {}], sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Look up an entry, counting the hit or miss"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['last_used'] = time.time()
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, file_id: str, kind: str, output_path: Optional[str] = None) -> dict:
+        """Store a result; the output file (if any) is moved into the cache directory"""
+        entry = {'file_id': file_id, 'kind': kind, 'path': None, 'size': 0, 'last_used': time.time()}
+        if output_path and os.path.exists(output_path):
+            cached_path = os.path.join(self.cache_dir, key + os.path.splitext(output_path)[1])
+            shutil.move(output_path, cached_path)
+            entry['path'] = cached_path
+            entry['size'] = os.path.getsize(cached_path)
+
+        old = self.entries.pop(key, None)
+        if old and old.get('path') and old['path'] != entry['path']:
+            self._remove_file(old)
+        self.entries[key] = entry
+        self._evict()
+        self.dirty = True
+        return entry
+
+    def refresh(self, key: str, file_id: str):
+        """Replace the file_id of an entry after re-uploading its output"""
+        entry = self.entries.get(key)
+        if entry:
+            entry['file_id'] = file_id
+            self.dirty = True
+
+    def invalidate(self, key: str):
+        """Forget an entry whose file_id no longer works"""
+        entry = self.entries.pop(key, None)
+        if entry:
+            self._remove_file(entry)
+            self.dirty = True
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+        }
+
+    def _evict(self):
+        # Drop on-disk outputs, oldest first, until we are within budget;
+        # the file_id stays usable so the entry itself is kept
+        total = self.total_bytes
+        for entry in self.entries.values():
+            if total <= self.max_bytes:
+                break
+            if entry['path']:
+                total -= entry['size']
+                self._remove_file(entry)
+        while len(self.entries) > self.max_entries:
+            _, entry = self.entries.popitem(last=False)
+            self._remove_file(entry)
+
+    @staticmethod
+    def _remove_file(entry: dict):
+        path = entry.get('path')
+        entry['path'] = None
+        entry['size'] = 0
+        if path:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _load(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache index {self.index_path}: {e}")
+            return
+        for key, entry in sorted(data.items(), key=lambda item: item[1].get('last_used', 0)):
+            if entry.get('path') and not os.path.exists(entry['path']):
+                entry['path'] = None
+                entry['size'] = 0
+            self.entries[key] = entry
+
+    def _save(self, entries: dict) -> bool:
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.index_path)
+            return True
+        except OSError as e:
+            logger.error(f"Could not write cache index: {e}")
+            return False
+
+
+result_cache = ResultCache()
@@ -0,0 +1,382 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from config import (
+    INSTANCE_ID, SESSION_TTL, STATE_BACKEND, STATE_DB_PATH, STATE_FLUSH_INTERVAL, STATE_JOB_RETENTION
+)
+
+logger = logging.getLogger(__name__)
+
+# Job states that mean the job will not make any more progress
+FINISHED_STATES = ("done", "failed", "cancelled", "timeout", "interrupted")
+CLEANUP_INTERVAL = 60  # seconds between purges of expired sessions, claims and old jobs
+
+
+class MemoryStateStore:
+    """Process-local state: sessions, job records, users and claims in dicts
+
+    Nothing survives a restart and nothing is shared, which is fine for a
+    single instance and for tests. Expired claims and sessions and finished
+    or old job records are purged every CLEANUP_INTERVAL, as in SQLite.
+    """
+
+    def __init__(self, instance_id: str = INSTANCE_ID):
+        self.instance_id = instance_id
+        self.run_id = uuid.uuid4().hex[:8]  # tells this process's job records apart after a restart
+        self.sessions: Dict[int, dict] = {}
+        self.session_updated: Dict[int, float] = {}
+        self.jobs: Dict[str, dict] = {}
+        self.users: Dict[int, dict] = {}
+        self.claims: Dict[str, tuple] = {}  # key -> (owner, expires)
+        self._purger: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._purger is None:
+            self._purger = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        if self._purger is not None:
+            self._purger.cancel()
+            await asyncio.gather(self._purger, return_exceptions=True)
+            self._purger = None
+
+    async def flush(self):
+        pass
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(CLEANUP_INTERVAL)
+            self.purge()
+
+    def purge(self):
+        """Drop expired claims and sessions, and job records nothing will read again"""
+        now = time.time()
+        for key in [k for k, (_, expires) in self.claims.items() if expires < now]:
+            del self.claims[key]
+        for user_id in [u for u, updated in self.session_updated.items() if updated < now - SESSION_TTL]:
+            self.sessions.pop(user_id, None)
+            del self.session_updated[user_id]
+        # Only a restart reads job records back, and a restart starts with empty memory
+        for key in [k for k, job in self.jobs.items()
+                    if job.get('state') in FINISHED_STATES or job['updated'] < now - STATE_JOB_RETENTION]:
+            del self.jobs[key]
+
+    # Sessions
+
+    async def get_session(self, user_id: int) -> dict:
+        if self.session_updated.get(user_id, 0) < time.time() - SESSION_TTL:
+            return {}
+        return dict(self.sessions.get(user_id, {}))
+
+    def set_session(self, user_id: int, data: dict):
+        self.sessions[user_id] = dict(data)
+        self.session_updated[user_id] = time.time()
+
+    # Job records
+
+    def job_key(self, job_id: int) -> str:
+        return f"{self.instance_id}:{self.run_id}:{job_id}"
+
+    def record_job(self, job_id: int, **fields):
+        """Create or update the record of a job of this process"""
+        key = self.job_key(job_id)
+        record = self.jobs.setdefault(key, {'key': key, 'instance': self.instance_id, 'job_id': job_id,
+                                            'created': time.time()})
+        record.update(fields, updated=time.time())
+
+    async def take_interrupted_jobs(self) -> List[dict]:
+        """Mark jobs a previous run of this instance left queued or running as interrupted and return them"""
+        return []  # a previous run's memory is gone
+
+    # Users
+
+    def _user(self, user_id: int) -> dict:
+        now = time.time()
+        return self.users.setdefault(user_id, {'user_id': user_id, 'first_name': None, 'username': None,
+                                               'first_seen': now, 'last_seen': now, 'jobs': 0, 'failed_jobs': 0})
+
+    def touch_user(self, user_id: int, first_name: str = None, username: str = None):
+        self._user(user_id).update(first_name=first_name, username=username, last_seen=time.time())
+
+    def count_user_job(self, user_id: int, failed: bool = False):
+        user = self._user(user_id)
+        user['jobs'] += 1
+        user['failed_jobs'] += int(failed)
+
+    async def get_user(self, user_id: int) -> Optional[dict]:
+        user = self.users.get(user_id)
+        return dict(user) if user else None
+
+    # Claims
+
+    async def claim(self, key: str, ttl: float) -> bool:
+        """Take exclusive ownership of key for ttl seconds; False if someone else holds it"""
+        now = time.time()
+        holder = self.claims.get(key)
+        if holder is not None and holder[1] > now:
+            return False
+        self.claims[key] = (self.instance_id, now + ttl)
+        return True
+
+    def release(self, key: str):
+        self.claims.pop(key, None)
+
+
+class SQLiteStateStore(MemoryStateStore):
+    """State in a SQLite database, shareable by every bot process that can open the file
+
+    Session, job and user writes are buffered and committed together every
+    STATE_FLUSH_INTERVAL seconds in one transaction; reads see the buffer
+    first. Claims bypass the buffer: they are a single atomic statement, so
+    two processes can never both win the same key. All database work runs on
+    one dedicated thread, off the event loop.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS jobs (
+            key TEXT PRIMARY KEY, instance TEXT NOT NULL, state TEXT, data TEXT NOT NULL, updated REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS jobs_instance_state ON jobs (instance, state);
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY, first_name TEXT, username TEXT, first_seen REAL, last_seen REAL,
+            jobs INTEGER NOT NULL DEFAULT 0, failed_jobs INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS claims (
+            key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH, instance_id: str = INSTANCE_ID,
+                 flush_interval: float = STATE_FLUSH_INTERVAL):
+        super().__init__(instance_id)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        self._db: Optional[sqlite3.Connection] = None
+        self._pending_sessions: Dict[int, dict] = {}
+        self._pending_jobs: Dict[str, dict] = {}
+        self._pending_users: Dict[int, dict] = {}
+        self._pending_releases: set = set()
+        self._flushing_sessions: Dict[int, dict] = {}  # taken from the buffer, not committed yet
+        # Binds to the event loop on first use, so flush() works before start() too
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_cleanup = 0.0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # WAL lets readers in other processes proceed while one process commits
+        db = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(self.SCHEMA)
+        self._db = db
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await self._run(self._open)
+        self._task = asyncio.create_task(self._flush_loop())
+        logger.info(f"State store at {self.path} (instance {self.instance_id})")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_cleanup > CLEANUP_INTERVAL:
+                    self._last_cleanup = time.time()
+                    await self._run(self._cleanup)
+            except sqlite3.Error as e:
+                logger.error(f"State store flush failed: {e}")
+
+    async def flush(self):
+        """Commit everything buffered so far in one transaction"""
+        async with self._flush_lock:
+            if self._db is None:
+                return  # not opened yet (or failed to): the buffer waits for start()
+            sessions, self._pending_sessions = self._pending_sessions, {}
+            jobs, self._pending_jobs = self._pending_jobs, {}
+            users, self._pending_users = self._pending_users, {}
+            releases, self._pending_releases = self._pending_releases, set()
+            if not (sessions or jobs or users or releases):
+                return
+            self._flushing_sessions = sessions
+            try:
+                await self._run(self._write, sessions, jobs, users, releases)
+            except sqlite3.Error:
+                # Put the batch back (newer buffered writes win) so the next flush retries it
+                self._pending_sessions = {**sessions, **self._pending_sessions}
+                self._pending_jobs = {**jobs, **self._pending_jobs}
+                for user_id, delta in users.items():
+                    self._merge_user(user_id, delta)
+                self._pending_releases |= releases
+                raise
+            finally:
+                self._flushing_sessions = {}
+
+    def _write(self, sessions: Dict[int, dict], jobs: Dict[str, dict], users: Dict[int, dict], releases: set):
+        now = time.time()
+        with self._transaction():
+            self._db.executemany(
+                "INSERT INTO sessions (user_id, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                [(user_id, json.dumps(data), now) for user_id, data in sessions.items()])
+            self._db.executemany(
+                "INSERT INTO jobs (key, instance, state, data, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated = excluded.updated",
+                [(key, record['instance'], record.get('state'), json.dumps(record, default=str), record['updated'])
+                 for key, record in jobs.items()])
+            # Counters are added, not overwritten, so concurrent processes don't lose increments
+            self._db.executemany(
+                "INSERT INTO users (user_id, first_name, username, first_seen, last_seen, jobs, failed_jobs) "
+                "VALUES (:user_id, :first_name, :username, :last_seen, :last_seen, :jobs, :failed_jobs) "
+                "ON CONFLICT (user_id) DO UPDATE SET "
+                "first_name = COALESCE(excluded.first_name, first_name), "
+                "username = COALESCE(excluded.username, username), "
+                "last_seen = MAX(last_seen, excluded.last_seen), "
+                "jobs = jobs + excluded.jobs, failed_jobs = failed_jobs + excluded.failed_jobs",
+                list(users.values()))
+            self._db.executemany("DELETE FROM claims WHERE key = ? AND owner = ?",
+                                 [(key, self.instance_id) for key in releases])
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front instead of failing on upgrade
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _cleanup(self):
+        now = time.time()
+        with self._transaction():
+            self._db.execute("DELETE FROM claims WHERE expires < ?", (now,))
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (now - SESSION_TTL,))
+            self._db.execute("DELETE FROM jobs WHERE updated < ?", (now - STATE_JOB_RETENTION,))
+
+    # Sessions
+
+    async def get_session(self, user_id: int) -> dict:
+        for buffered in (self._pending_sessions, self._flushing_sessions):
+            if user_id in buffered:
+                return dict(buffered[user_id])
+        row = await self._run(self._fetch_one, "SELECT data FROM sessions WHERE user_id = ? AND updated >= ?",
+                              (user_id, time.time() - SESSION_TTL))
+        return json.loads(row[0]) if row else {}
+
+    def set_session(self, user_id: int, data: dict):
+        self._pending_sessions[user_id] = dict(data)
+
+    def _fetch_one(self, sql: str, params: tuple):
+        return self._db.execute(sql, params).fetchone()
+
+    # Job records
+
+    def record_job(self, job_id: int, **fields):
+        key = self.job_key(job_id)
+        record = self._pending_jobs.get(key) or self.jobs.get(key) or {
+            'key': key, 'instance': self.instance_id, 'job_id': job_id, 'created': time.time()}
+        record = {**record, **fields, 'updated': time.time()}
+        self._pending_jobs[key] = record
+        # Keep our own unfinished jobs at hand so later updates don't need a read
+        if record.get('state') in FINISHED_STATES:
+            self.jobs.pop(key, None)
+        else:
+            self.jobs[key] = record
+
+    async def take_interrupted_jobs(self) -> List[dict]:
+        return await self._run(self._take_interrupted_jobs)
+
+    def _take_interrupted_jobs(self) -> List[dict]:
+        placeholders = ', '.join('?' * len(FINISHED_STATES))
+        where = f"instance = ? AND key NOT LIKE ? AND (state IS NULL OR state NOT IN ({placeholders}))"
+        params = (self.instance_id, f"{self.instance_id}:{self.run_id}:%", *FINISHED_STATES)
+        with self._transaction():
+            rows = self._db.execute(f"SELECT data FROM jobs WHERE {where}", params).fetchall()
+            self._db.execute(f"UPDATE jobs SET state = 'interrupted', "
+                             f"data = json_set(data, '$.state', 'interrupted') WHERE {where}", params)
+        return [json.loads(row[0]) for row in rows]
+
+    # Users
+
+    def _merge_user(self, user_id: int, delta: dict):
+        pending = self._pending_users.get(user_id)
+        if pending is None:
+            self._pending_users[user_id] = delta
+            return
+        pending['jobs'] += delta['jobs']
+        pending['failed_jobs'] += delta['failed_jobs']
+        pending['last_seen'] = max(pending['last_seen'], delta['last_seen'])
+        pending['first_name'] = delta['first_name'] or pending['first_name']
+        pending['username'] = delta['username'] or pending['username']
+
+    def touch_user(self, user_id: int, first_name: str = None, username: str = None):
+        self._merge_user(user_id, {'user_id': user_id, 'first_name': first_name, 'username': username,
+                                   'last_seen': time.time(), 'jobs': 0, 'failed_jobs': 0})
+
+    def count_user_job(self, user_id: int, failed: bool = False):
+        self._merge_user(user_id, {'user_id': user_id, 'first_name': None, 'username': None,
+                                   'last_seen': time.time(), 'jobs': 1, 'failed_jobs': int(failed)})
+
+    async def get_user(self, user_id: int) -> Optional[dict]:
+        await self.flush()
+        row = await self._run(self._fetch_one, "SELECT user_id, first_name, username, first_seen, last_seen, "
+                                               "jobs, failed_jobs FROM users WHERE user_id = ?", (user_id,))
+        if row is None:
+            return None
+        return dict(zip(('user_id', 'first_name', 'username', 'first_seen', 'last_seen', 'jobs', 'failed_jobs'),
+                        row))
+
+    # Claims
+
+    async def claim(self, key: str, ttl: float) -> bool:
+        self._pending_releases.discard(key)
+        return await self._run(self._claim, key, ttl)
+
+    def _claim(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        with self._transaction():
+            # Expired claims (ours or another process's) can be taken over
+            cursor = self._db.execute(
+                "INSERT INTO claims (key, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE claims.expires < ?",
+                (key, self.instance_id, now + ttl, now))
+            return cursor.rowcount == 1
+
+    def release(self, key: str):
+        self._pending_releases.add(key)
+
+
+def create_state_store():
+    if STATE_BACKEND == 'memory':
+        return MemoryStateStore()
+    return SQLiteStateStore()
+
+
+state_store = create_state_store()
@@ -0,0 +1,127 @@
+"""Coalescing sender for progress edits of status messages
+
+Conversions report progress far more often than Telegram lets a bot edit
+messages. update() only records the latest text for a message and returns;
+one task per chat sends it when the chat's minimum interval and the global
+edit budget allow. Intermediate values are dropped, unchanged text is never
+sent, and a flood-wait (429) pauses all status edits for retry_after so the
+limit does not also slow down the bot's file sends.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Dict, Tuple
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from config import STATUS_UPDATE_INTERVAL, STATUS_UPDATES_PER_SECOND
+from metrics import STATUS_EDIT_SECONDS, STATUS_UPDATES
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class StatusUpdater:
+    def __init__(self, min_interval: float = STATUS_UPDATE_INTERVAL, per_second: float = STATUS_UPDATES_PER_SECOND):
+        self.min_interval = min_interval
+        self.budget = TokenBucket(per_second, per_second)
+        self.paused_until = 0.0  # after a flood-wait
+        self._pending: Dict[int, Dict[int, tuple]] = {}  # chat_id -> message_id -> (bot, text, reply_markup)
+        self._sent: Dict[Tuple[int, int], str] = {}  # last text shown per (chat_id, message_id)
+        self._editing: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def update(self, bot, chat_id: int, message_id: int, text: str, reply_markup=None):
+        """Show text on the message soon; never waits for Telegram"""
+        pending = self._pending.setdefault(chat_id, {})
+        if message_id in pending:
+            STATUS_UPDATES.inc(result="coalesced")
+        pending[message_id] = (bot, text, reply_markup)
+        if chat_id not in self._tasks:
+            # A fresh context: the sender outlives the job that happened to start it
+            self._tasks[chat_id] = asyncio.create_task(self._run(chat_id), context=contextvars.Context())
+
+    def discard(self, chat_id: int, message_id: int):
+        """Drop updates not sent yet and forget the message (an edit in flight is not retried)"""
+        self._pending.get(chat_id, {}).pop(message_id, None)
+        self._sent.pop((chat_id, message_id), None)
+        self._editing.pop((chat_id, message_id), None)
+
+    async def close(self, chat_id: int, message_id: int):
+        """Like discard, and also wait for an edit in flight, so the caller's next edit is the last"""
+        edit = self._editing.get((chat_id, message_id))
+        self.discard(chat_id, message_id)
+        if edit is not None:
+            await asyncio.wait([edit])
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
+        self._sent.clear()
+
+    async def _run(self, chat_id: int):
+        try:
+            while self._pending.get(chat_id):
+                wait = max(self.paused_until - time.monotonic(), self.budget.wait_time())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                pending = self._pending[chat_id]
+                message_id = next(iter(pending))
+                bot, text, reply_markup = pending.pop(message_id)
+                if self._sent.get((chat_id, message_id)) == text:
+                    STATUS_UPDATES.inc(result="unchanged")
+                    continue
+                self.budget.take()
+                started = time.monotonic()
+                await self._edit(bot, chat_id, message_id, text, reply_markup)
+                # Stay for the rest of the chat's interval, so updates arriving meanwhile wait for it too
+                await asyncio.sleep(max(0.0, started + self.min_interval - time.monotonic()))
+        finally:
+            # No await since the loop condition: update() cannot have slipped in between
+            self._tasks.pop(chat_id, None)
+            if not self._pending.get(chat_id):
+                self._pending.pop(chat_id, None)
+
+    async def _edit(self, bot, chat_id: int, message_id: int, text: str, reply_markup):
+        key = (chat_id, message_id)
+        edit = asyncio.ensure_future(bot.edit_message_text(text, chat_id=chat_id, message_id=message_id,
+                                                           reply_markup=reply_markup))
+        self._editing[key] = edit
+        started = time.perf_counter()
+        try:
+            await edit
+            if self._editing.get(key) is edit:
+                self._sent[key] = text
+            STATUS_UPDATES.inc(result="sent")
+        except RetryAfter as e:
+            self.paused_until = time.monotonic() + e.retry_after
+            logger.warning(f"Status edits paused for {e.retry_after}s by flood control")
+            STATUS_UPDATES.inc(result="flood")
+            # Retry later unless the message was discarded or something newer arrived meanwhile
+            if self._editing.get(key) is edit:
+                self._pending.setdefault(chat_id, {}).setdefault(message_id, (bot, text, reply_markup))
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                if self._editing.get(key) is edit:
+                    self._sent[key] = text
+                STATUS_UPDATES.inc(result="unchanged")
+            else:
+                # Deleted message or similar: later updates to it would fail the same way
+                logger.info(f"Dropping status updates of message {message_id} in chat {chat_id}: {e}")
+                STATUS_UPDATES.inc(result="failed")
+                self._pending.get(chat_id, {}).pop(message_id, None)
+        except TelegramError as e:
+            logger.warning(f"Status edit in chat {chat_id} failed: {e}")
+            STATUS_UPDATES.inc(result="failed")
+        finally:
+            STATUS_EDIT_SECONDS.observe(time.perf_counter() - started)
+            if self._editing.get(key) is edit:
+                del self._editing[key]
+
+
+status_updater = StatusUpdater()
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Keep config-driven module globals (state store, result cache) off /app/data
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix="bot-tests-"))
+os.environ.setdefault('STATE_BACKEND', 'memory')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
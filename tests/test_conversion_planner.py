@@ -0,0 +1,74 @@
+import pytest
+
+from conversion_planner import PARTIAL, REMUX, TRANSCODE, muxer_args, plan_conversion
+from quality_governor import QUALITY_SETTINGS
+
+SETTINGS = QUALITY_SETTINGS['high']
+
+
+def media(video=None, *audio):
+    streams = [{'codec_type': 'audio', 'codec_name': codec} for codec in audio]
+    return {'video_codec': video, 'streams': streams}
+
+
+@pytest.mark.parametrize("output_format, expected", [
+    ('mp4', ['-movflags', '+faststart']),
+    ('.MOV', ['-movflags', '+faststart']),
+    ('m4v', ['-movflags', '+faststart']),
+    ('mkv', []),
+    ('webm', []),
+])
+def test_muxer_args(output_format, expected):
+    assert muxer_args(output_format) == expected
+
+
+@pytest.mark.parametrize("info, output_format, path", [
+    (media('h264', 'aac'), 'mp4', REMUX),
+    (media('h264', 'aac'), 'mkv', REMUX),
+    (media('vp9', 'opus'), 'mp4', TRANSCODE),  # valid in MP4, but not widely playable
+    (media('vp9', 'opus'), 'webm', REMUX),
+    (media('vp9', 'opus'), 'mkv', REMUX),
+    (media('h264', 'opus'), 'mp4', PARTIAL),
+    (media('hevc', 'aac'), 'avi', TRANSCODE),
+    (media('h264', 'aac', 'opus'), 'mp4', PARTIAL),  # every audio track has to fit
+    (media('h264'), 'mp4', REMUX),
+    (media(None, 'aac'), 'mp4', REMUX),
+])
+def test_plan_conversion_paths(info, output_format, path):
+    assert plan_conversion(info, output_format, SETTINGS).path == path
+
+
+def test_plan_conversion_force_transcode():
+    plan = plan_conversion(media('h264', 'aac'), 'mp4', SETTINGS, force_transcode=True)
+    assert plan.path == TRANSCODE
+    assert plan.video_args[:2] == ['-c:v', 'libx264']
+    assert plan.audio_args == ['-c:a', 'aac']
+
+
+def test_plan_conversion_encoders_follow_container():
+    plan = plan_conversion(media('h264', 'aac'), 'webm', SETTINGS)
+    assert plan.video_encoder == 'libvpx-vp9'
+    assert plan.audio_args == ['-c:a', 'libopus']
+
+
+def test_plan_conversion_tags_copied_hevc_for_apple_players():
+    plan = plan_conversion(media('hevc', 'aac'), 'mp4', SETTINGS)
+    assert plan.video_args == ['-c:v', 'copy', '-tag:v', 'hvc1']
+    assert plan.video_encoder is None
+
+
+def test_plan_args_map_streams_and_add_faststart():
+    args = plan_conversion(media('h264', 'aac'), 'mp4', SETTINGS).args
+    assert args[:4] == ['-map', '0:v:0?', '-map', '0:a?']
+    assert args[-2:] == ['-movflags', '+faststart']
+
+
+def test_set_video_quality_only_touches_encoded_video():
+    copied = plan_conversion(media('h264', 'aac'), 'mp4', SETTINGS)
+    copied.set_video_quality(QUALITY_SETTINGS['low'])
+    assert copied.video_args == ['-c:v', 'copy']
+
+    encoded = plan_conversion(media('vp9', 'aac'), 'mp4', SETTINGS)
+    encoded.set_video_quality(QUALITY_SETTINGS['low'], ['scale=-2:720'])
+    assert encoded.video_args[:2] == ['-vf', 'scale=-2:720']
+    assert encoded.video_args[encoded.video_args.index('-crf') + 1] == QUALITY_SETTINGS['low']['crf']
@@ -0,0 +1,57 @@
+from ffmpeg_runner import ProgressParser, format_eta, write_concat_list
+
+
+def feed_block(parser, **values):
+    snapshot = None
+    for key, value in values.items():
+        snapshot = parser.feed(f"{key}={value}\n")
+    return snapshot
+
+
+def test_progress_parser_reports_once_per_block():
+    parser = ProgressParser(duration=10)
+    assert parser.feed("frame=10\n") is None
+    assert parser.feed("not a key value line\n") is None
+    snapshot = feed_block(parser, out_time_us=2_500_000, speed="2.5x", fps="30", progress="continue")
+    assert snapshot['out_time'] == 2.5
+    assert snapshot['fraction'] == 0.25
+    assert snapshot['speed'] == 2.5
+    assert snapshot['fps'] == 30.0
+    assert snapshot['eta'] == 3.0
+
+
+def test_progress_parser_out_time_ms_is_microseconds():
+    parser = ProgressParser(duration=4)
+    snapshot = feed_block(parser, out_time_ms=1_000_000, progress="continue")
+    assert snapshot['fraction'] == 0.25
+
+
+def test_progress_parser_tolerates_missing_values():
+    parser = ProgressParser(duration=None)
+    snapshot = feed_block(parser, out_time_us="N/A", speed="N/A", fps="", progress="continue")
+    assert snapshot == {'out_time': 0.0, 'fraction': None, 'speed': None, 'fps': None, 'eta': None}
+
+
+def test_progress_parser_end_is_complete():
+    parser = ProgressParser(duration=10)
+    snapshot = feed_block(parser, out_time_us=9_000_000, progress="end")
+    assert snapshot['fraction'] == 1.0
+    assert snapshot['eta'] == 0.0
+
+
+def test_progress_parser_caps_fraction():
+    parser = ProgressParser(duration=1)
+    snapshot = feed_block(parser, out_time_us=3_000_000, progress="continue")
+    assert snapshot['fraction'] == 1.0
+
+
+def test_format_eta():
+    assert format_eta(-5) == "0:00"
+    assert format_eta(75) == "1:15"
+    assert format_eta(3725) == "1:02:05"
+
+
+def test_write_concat_list_quotes_paths(tmp_path):
+    list_path = tmp_path / "list.txt"
+    write_concat_list(str(list_path), ["/data/it's.mp4", "/data/plain.mp4"])
+    assert list_path.read_text() == "file '/data/it'\\''s.mp4'\nfile '/data/plain.mp4'\n"
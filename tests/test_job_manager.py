@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+import job_manager
+from job_manager import Job, JobManager, QueueFullError, UserLimitError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(job_manager.time, 'monotonic', lambda: now[0])
+    return now
+
+
+async def noop(job):
+    pass
+
+
+def run(coroutine_function):
+    """Run a scenario on a fresh event loop (submit schedules a wake-up task)"""
+    return asyncio.run(coroutine_function())
+
+
+def test_cheap_jobs_go_first(clock):
+    async def scenario():
+        manager = JobManager(max_concurrent=1, max_queue_size=10)
+        heavy = manager.submit(1, 1, "heavy", noop, cost=100)
+        light = manager.submit(2, 2, "light", noop, cost=10)
+        assert manager._pick() is light
+        assert (manager.position(light), manager.position(heavy)) == (1, 2)
+    run(scenario)
+
+
+def test_waiting_ages_long_jobs_forward(clock):
+    async def scenario():
+        manager = JobManager(max_concurrent=1, max_queue_size=10)
+        heavy = manager.submit(1, 1, "heavy", noop, cost=100)
+        clock[0] += 95
+        manager.submit(2, 2, "light", noop, cost=10)
+        assert manager._pick() is heavy
+    run(scenario)
+
+
+def test_recent_usage_lowers_priority_and_decays(clock):
+    async def scenario():
+        manager = JobManager(max_concurrent=1, max_queue_size=10)
+        manager.user_usage[1] = (50.0, clock[0])
+        busy_user = manager.submit(1, 1, "busy user", noop, cost=10)
+        new_user = manager.submit(2, 2, "new user", noop, cost=30)
+        assert manager._pick() is new_user
+        clock[0] += 2 * job_manager.USAGE_HALF_LIFE  # usage down to 12.5; both jobs aged alike
+        assert manager.usage(1) == pytest.approx(12.5)
+        assert manager._pick() is busy_user
+    run(scenario)
+
+
+def test_users_at_their_running_limit_are_skipped(clock):
+    async def scenario():
+        manager = JobManager(max_concurrent=2, max_queue_size=10, max_running_per_user=1)
+        manager.running[99] = Job(99, 1, 1, "running", noop)
+        manager.submit(1, 1, "cheap but blocked", noop, cost=1)
+        other = manager.submit(2, 2, "expensive", noop, cost=100)
+        assert manager._pick() is other
+    run(scenario)
+
+
+def test_queue_and_per_user_limits(clock):
+    async def scenario():
+        manager = JobManager(max_concurrent=1, max_queue_size=3, max_queued_per_user=2)
+        manager.submit(1, 1, "a", noop)
+        manager.submit(1, 1, "b", noop)
+        with pytest.raises(UserLimitError):
+            manager.submit(1, 1, "c", noop)
+        manager.submit(2, 2, "d", noop)
+        with pytest.raises(QueueFullError):
+            manager.submit(3, 3, "e", noop)
+    run(scenario)
+
+
+def test_workers_run_jobs_in_priority_order():
+    order = []
+
+    async def scenario():
+        manager = JobManager(max_concurrent=1, max_queue_size=10)
+
+        def record(name):
+            async def func(job):
+                order.append(name)
+            return func
+
+        async def fail(job):
+            raise RuntimeError("boom")
+
+        jobs = [manager.submit(1, 1, "slow", record("slow"), cost=50),
+                manager.submit(2, 2, "fast", record("fast"), cost=1),
+                manager.submit(3, 3, "medium", record("medium"), cost=10),
+                manager.submit(4, 4, "broken", fail, cost=20)]
+        await manager.start()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(job.done.wait() for job in jobs)), timeout=5)
+        finally:
+            await manager.stop()
+        assert [job.state for job in jobs] == [Job.DONE, Job.DONE, Job.DONE, Job.FAILED]
+        assert str(jobs[3].error) == "boom"
+        assert manager.position(jobs[0]) == 0
+
+    run(scenario)
+    assert order == ["fast", "medium", "slow"]
+
+
+def test_stop_cancels_pending_jobs():
+    async def scenario():
+        manager = JobManager(max_concurrent=1, max_queue_size=10)
+        started = asyncio.Event()
+
+        async def block(job):
+            started.set()
+            await asyncio.sleep(60)
+
+        running = manager.submit(1, 1, "running", block)
+        pending = manager.submit(2, 2, "pending", noop)
+        await manager.start()
+        await asyncio.wait_for(started.wait(), timeout=5)
+        await asyncio.wait_for(manager.stop(), timeout=5)
+        assert running.state == Job.CANCELLED
+        assert pending.state == Job.CANCELLED
+    run(scenario)
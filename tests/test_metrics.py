@@ -0,0 +1,49 @@
+import pytest
+
+from metrics import Metric, Registry
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        Metric("bot_x", "help")
+
+
+def test_counter_and_gauge_rendering():
+    registry = Registry()
+    counter = registry.counter("bot_jobs_total", "Jobs by state", ["state"])
+    counter.inc(state="done")
+    counter.inc(2, state="done")
+    counter.inc(0.5, state="failed")
+    gauge = registry.gauge("bot_queue_depth", "Queued jobs", callback=lambda: 4)
+    gauge.set(99)  # a callback gauge reports its callback
+
+    assert registry.render() == (
+        "# HELP bot_jobs_total Jobs by state\n"
+        "# TYPE bot_jobs_total counter\n"
+        'bot_jobs_total{state="done"} 3\n'
+        'bot_jobs_total{state="failed"} 0.5\n'
+        "# HELP bot_queue_depth Queued jobs\n"
+        "# TYPE bot_queue_depth gauge\n"
+        "bot_queue_depth 4\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("bot_wait_seconds", "Waits", ["size"], buckets=(1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value, size="short")
+
+    assert histogram.samples() == [
+        'bot_wait_seconds_bucket{size="short",le="1"} 2',
+        'bot_wait_seconds_bucket{size="short",le="5"} 3',
+        'bot_wait_seconds_bucket{size="short",le="+Inf"} 4',
+        'bot_wait_seconds_sum{size="short"} 14.5',
+        'bot_wait_seconds_count{size="short"} 4',
+    ]
+
+
+def test_unlabelled_metric_without_samples_renders_header_only():
+    registry = Registry()
+    registry.counter("bot_errors_total", "Errors")
+    assert registry.render() == "# HELP bot_errors_total Errors\n# TYPE bot_errors_total counter\n"
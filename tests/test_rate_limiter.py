@@ -0,0 +1,53 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_bucket_allows_burst_then_waits(clock):
+    bucket = TokenBucket(rate=2, burst=4)
+    assert bucket.wait_time(4) == 0
+    bucket.take(4)
+    assert bucket.wait_time(1) == 0.5
+    clock[0] += 0.5
+    assert bucket.wait_time(1) == 0
+
+
+def test_bucket_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=1, burst=3)
+    bucket.take(3)
+    clock[0] += 100
+    assert bucket.wait_time(3) == 0
+    assert bucket.wait_time(4) == 0  # more than the burst only ever waits for a full bucket
+    bucket.take(10)
+    assert bucket.tokens == 0
+
+
+def test_limiter_keeps_a_bucket_per_key(clock):
+    limiter = RateLimiter(rate=1, burst=1)
+    limiter.bucket(1).take()
+    assert limiter.bucket(1).wait_time() == 1
+    assert limiter.bucket(2).wait_time() == 0
+
+
+def test_limiter_prunes_idle_buckets(clock):
+    limiter = RateLimiter(rate=1, burst=1)
+    limiter.bucket(1)
+    clock[0] += rate_limiter.IDLE_BUCKET_TTL + 1
+    limiter.bucket(2)
+    assert list(limiter.buckets) == [2]
+
+
+def test_admit_upload_takes_nothing_when_refused(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'upload_files', RateLimiter(rate=1, burst=2))
+    monkeypatch.setattr(rate_limiter, 'upload_bytes', RateLimiter(rate=100, burst=1000))
+    assert rate_limiter.admit_upload(7, 900) == 0
+    assert rate_limiter.admit_upload(7, 900) == 8.0  # the byte bucket refuses
+    assert rate_limiter.upload_files.bucket(7).tokens == 1
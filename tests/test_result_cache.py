@@ -0,0 +1,60 @@
+import asyncio
+import os
+
+from result_cache import ResultCache
+
+
+def make_output(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_make_key_ignores_param_order():
+    assert (ResultCache.make_key("u", "op", {'a': 1, 'b': 2})
+            == ResultCache.make_key("u", "op", {'b': 2, 'a': 1}))
+    assert ResultCache.make_key("u", "op", {'a': 1}) != ResultCache.make_key("u", "op", {'a': 2})
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_entries=2)
+    cache.put("a", "file-a", 'document')
+    cache.put("b", "file-b", 'document')
+    assert cache.get("a")['file_id'] == "file-a"  # a is now the most recently used
+    cache.put("c", "file-c", 'document')
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_byte_budget_drops_oldest_files_but_keeps_file_ids(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=150)
+    first = cache.put("a", "file-a", 'document', make_output(tmp_path, "a.mp4", 100))
+    cached_path = first['path']
+    cache.put("b", "file-b", 'document', make_output(tmp_path, "b.mp4", 100))
+    assert cache.total_bytes == 100
+    assert cache.entries["a"]['path'] is None
+    assert cache.get("a")['file_id'] == "file-a"
+    assert not os.path.exists(cached_path)
+
+
+def test_index_survives_a_restart(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    cache = ResultCache(cache_dir)
+    cache.put("a", "file-a", 'photo', make_output(tmp_path, "a.jpg", 10))
+    assert cache.dirty
+    asyncio.run(cache.flush())
+    assert not cache.dirty
+
+    reloaded = ResultCache(cache_dir)
+    entry = reloaded.get("a")
+    assert (entry['file_id'], entry['kind'], entry['size']) == ("file-a", 'photo', 10)
+
+
+def test_invalidate_removes_entry_and_file(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    cached_path = cache.put("a", "file-a", 'document', make_output(tmp_path, "a.pdf", 10))['path']
+    assert os.path.exists(cached_path)
+    cache.invalidate("a")
+    assert "a" not in cache.entries
+    assert not os.path.exists(cached_path)
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import state_store
+from state_store import MemoryStateStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(state_store.time, 'time', lambda: now[0])
+    return now
+
+
+def test_claim_is_exclusive_until_it_expires(clock):
+    store = MemoryStateStore("instance-a")
+    assert asyncio.run(store.claim("update:1", ttl=60))
+    assert not asyncio.run(store.claim("update:1", ttl=60))
+    clock[0] += 61
+    assert asyncio.run(store.claim("update:1", ttl=60))
+
+
+def test_release_frees_a_claim(clock):
+    store = MemoryStateStore("instance-a")
+    assert asyncio.run(store.claim("update:1", ttl=60))
+    store.release("update:1")
+    assert asyncio.run(store.claim("update:1", ttl=60))
+
+
+def test_purge_drops_expired_claims_and_finished_jobs(clock):
+    store = MemoryStateStore("instance-a")
+    asyncio.run(store.claim("old", ttl=10))
+    asyncio.run(store.claim("live", ttl=100))
+    store.record_job(1, state="done")
+    store.record_job(2, state="running")
+    clock[0] += 50
+    store.purge()
+    assert list(store.claims) == ["live"]
+    assert [record['job_id'] for record in store.jobs.values()] == [2]
+
+
+def test_sessions_expire(clock):
+    store = MemoryStateStore("instance-a")
+    store.set_session(1, {'quality': 'high'})
+    assert asyncio.run(store.get_session(1)) == {'quality': 'high'}
+    clock[0] += state_store.SESSION_TTL + 1
+    assert asyncio.run(store.get_session(1)) == {}
+    store.purge()
+    assert 1 not in store.sessions
@@ -0,0 +1,50 @@
+import logging
+from typing import Optional
+
+from state_store import state_store
+
+logger = logging.getLogger(__name__)
+
+
+class UserManager:
+    """Per-user state: the current session (last file sent, merge in progress) and usage counts
+
+    Everything lives in the shared state store, so any bot instance can pick
+    up a user's session and a restart does not lose it.
+    """
+
+    def __init__(self, store=state_store):
+        self.store = store
+
+    async def get_session(self, user_id: int) -> dict:
+        return await self.store.get_session(user_id)
+
+    def save_session(self, user_id: int, session: dict):
+        self.store.set_session(user_id, session)
+
+    async def update_session(self, user_id: int, **fields) -> dict:
+        session = await self.get_session(user_id)
+        session.update(fields)
+        self.save_session(user_id, session)
+        return session
+
+    async def pop_session_key(self, user_id: int, key: str, default=None):
+        """Remove one key from the session and return its value"""
+        session = await self.get_session(user_id)
+        value = session.pop(key, default)
+        self.save_session(user_id, session)
+        return value
+
+    def seen(self, user):
+        """Remember a Telegram user and when they last talked to us"""
+        if user is not None:
+            self.store.touch_user(user.id, user.first_name, user.username)
+
+    def job_finished(self, user_id: int, state: str):
+        self.store.count_user_job(user_id, failed=state != "done")
+
+    async def get_stats(self, user_id: int) -> Optional[dict]:
+        return await self.store.get_user(user_id)
+
+
+user_manager = UserManager()
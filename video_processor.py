@@ -1,51 +1,92 @@
 import os
 import asyncio
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
-from pydub import AudioSegment
-import ffmpeg
-import aiofiles
-from config import TEMP_DIR, get_temp_path
-import subprocess
-from typing import List, Tuple
+import queue
+import shutil
+import time
+import uuid
+from config import PDF2DOCX_PROCESSES, PDF_TEXT_CHUNK_PAGES, THUMBNAIL_SIZE
+from ffmpeg_runner import run_ffmpeg, write_concat_list
+from media_probe import probe_file
+from conversion_planner import muxer_args, plan_conversion, plan_merge, normalize_args
+from job_manager import annotate_job
+from parallel_encode import encode_parallel, segment_count
+from quality_governor import QUALITY_SETTINGS, quality_governor
+from process_pool import process_pool
+from workspace import job_path, job_tempdir
+from instrumentation import conversion_stage, timed
+from audio_processor import AudioProcessor
+import document_worker
+from typing import List, Optional, Tuple
+
+# Share of the size budget lost to container overhead (moov/index, headers)
+CONTAINER_OVERHEAD = 0.02
+
+def compression_bitrates(target_size_mb: float, duration: float, has_audio: bool) -> Tuple[int, int]:
+    """Split a size budget into (video, audio) bitrates in kbps"""
+    total_kbps = target_size_mb * 1024 * 1024 * 8 * (1 - CONTAINER_OVERHEAD) / 1000 / duration
+    audio_kbps = 0
+    if has_audio:
+        # Give audio less when the budget is tight, but never more than a fifth of it
+        audio_kbps = 128 if total_kbps >= 1000 else 96 if total_kbps >= 500 else 64
+        audio_kbps = min(audio_kbps, max(int(total_kbps / 5), 32))
+    video_kbps = max(int(total_kbps - audio_kbps), 50)
+    return video_kbps, audio_kbps
+
+def drain_page_counts(progress_queue) -> int:
+    """Sum of the page counts workers have reported since the last call
+
+    Each call on the Manager proxy is a blocking round-trip to the manager
+    process, so this runs in a thread, not on the event loop.
+    """
+    finished = 0
+    while True:
+        try:
+            finished += progress_queue.get_nowait()
+        except queue.Empty:
+            return finished
 
 class VideoProcessor:
     @staticmethod
-    async def convert_video(input_path: str, output_format: str, quality: str = "high", progress_callback=None) -> str:
-        """Convert video to different format with quality options"""
-        output_path = get_temp_path(f"converted_{os.path.basename(input_path).split('.')[0]}.{output_format}")
+    @conversion_stage()
+    async def convert_video(input_path: str, output_format: str, quality: str = "high", progress_callback=None,
+                            parallel: bool = False) -> str:
+        """Convert video to different format with quality options
+
+        `quality` is a QUALITY_SETTINGS tier, or a user preference ("auto",
+        "fast", "best") the quality governor turns into a tier and resolution/
+        frame rate caps according to the current load. With parallel=True, long
+        inputs whose video must be re-encoded are split into segments encoded
+        concurrently across the available cores.
+        """
+        output_path = job_path(f"converted_{os.path.basename(input_path).split('.')[0]}.{output_format}")
         
         if progress_callback:
             await progress_callback(10, "Starting conversion...")
         
-        # Quality settings
-        quality_settings = {
-            "high": {"crf": "23", "preset": "medium"},
-            "medium": {"crf": "28", "preset": "fast"},
-            "low": {"crf": "32", "preset": "veryfast"}
-        }
-        
-        settings = quality_settings.get(quality, quality_settings["high"])
-        
-        try:
-            # Using ffmpeg for better control
-            (
-                ffmpeg
-                .input(input_path)
-                .output(output_path, 
-                       crf=settings["crf"],
-                       preset=settings["preset"],
-                       vcodec='libx264' if output_format in ['mp4', 'mkv'] else 'copy',
-                       acodec='aac')
-                .overwrite_output()
-                .run(quiet=True)
-            )
-            
-        except Exception as e:
-            # Fallback to moviepy
-            clip = VideoFileClip(input_path)
-            clip.write_videofile(output_path, verbose=False, logger=None, 
-                               bitrate="1000k" if quality == "high" else "500k")
-            clip.close()
+        # Copy every stream the target container can hold, re-encode the rest
+        info = await probe_file(input_path)
+        plan = plan_conversion(info, output_format, QUALITY_SETTINGS.get(quality, QUALITY_SETTINGS["high"]))
+        annotate_job('conversion_path', plan.path)
+        
+        # Only a video re-encode has a quality (and a cost) worth governing
+        decision = None
+        if plan.video_encoder is not None:
+            decision = quality_governor.decide(quality)
+            plan.set_video_quality(decision.settings, decision.video_filters(info))
+        
+        action = "Remuxing" if plan.path == "remux" else "Converting"
+        status = f"{action} to {output_format.upper()}..."
+        segments = segment_count(info.get('duration')) if parallel and plan.video_copy is False else 1
+        started = time.monotonic()
+        if segments > 1:
+            annotate_job('parallel_segments', segments)
+            await encode_parallel(input_path, output_path, plan.video_args, plan.audio_args, segments,
+                                  progress_callback, status, progress_range=(10, 99))
+        else:
+            await run_ffmpeg(['-i', input_path, *plan.args, output_path], info.get('duration'), progress_callback,
+                             status=status, progress_range=(10, 99))
+        if decision is not None:
+            quality_governor.record_encode(decision, info.get('duration'), time.monotonic() - started)
         
         if progress_callback:
             await progress_callback(100, "Conversion completed!")
@@ -53,26 +94,23 @@ class VideoProcessor:
         return output_path
 
     @staticmethod
+    @conversion_stage()
     async def convert_document(input_path: str, output_format: str, progress_callback=None) -> str:
         """Convert documents between formats"""
         file_ext = os.path.splitext(input_path)[1].lower()
-        output_path = get_temp_path(f"converted_{os.path.basename(input_path).split('.')[0]}.{output_format}")
+        output_path = job_path(f"converted_{os.path.basename(input_path).split('.')[0]}.{output_format}")
         
         if progress_callback:
             await progress_callback(20, f"Converting {file_ext} to {output_format}...")
         
-        try:
-            if file_ext == '.pdf' and output_format in ['docx', 'txt']:
-                await VideoProcessor.pdf_to_docx(input_path, output_path, output_format, progress_callback)
-            elif file_ext in ['.doc', '.docx'] and output_format == 'pdf':
-                await VideoProcessor.docx_to_pdf(input_path, output_path, progress_callback)
-            elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp'] and output_format in ['jpg', 'png', 'pdf']:
-                await VideoProcessor.convert_image(input_path, output_path, output_format, progress_callback)
-            else:
-                raise ValueError(f"Unsupported conversion: {file_ext} to {output_format}")
-                
-        except Exception as e:
-            raise e
+        if file_ext == '.pdf' and output_format in ['docx', 'txt']:
+            await VideoProcessor.pdf_to_docx(input_path, output_path, output_format, progress_callback)
+        elif file_ext in ['.doc', '.docx'] and output_format == 'pdf':
+            await VideoProcessor.docx_to_pdf(input_path, output_path, progress_callback)
+        elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp'] and output_format in ['jpg', 'png', 'pdf']:
+            await VideoProcessor.convert_image(input_path, output_path, output_format, progress_callback)
+        else:
+            raise ValueError(f"Unsupported conversion: {file_ext} to {output_format}")
         
         if progress_callback:
             await progress_callback(100, "Document conversion completed!")
@@ -80,165 +118,128 @@ class VideoProcessor:
         return output_path
 
     @staticmethod
+    @timed()
     async def pdf_to_docx(input_path: str, output_path: str, output_format: str, progress_callback=None):
         """Convert PDF to DOCX or TXT"""
+        if output_format == 'docx':
+            await process_pool.run(document_worker.pdf_to_docx, input_path, output_path, PDF2DOCX_PROCESSES)
+        elif output_format == 'txt':
+            await VideoProcessor.pdf_to_txt(input_path, output_path, progress_callback)
+
+    @staticmethod
+    @timed()
+    async def pdf_to_txt(input_path: str, output_path: str, progress_callback=None):
+        """Extract PDF text, fanning page ranges out across the worker pool
+
+        Workers write their range into part files page by page; the parts are
+        appended to the output in page order, so memory stays flat however long
+        the document is. Workers report every finished page for progress.
+        """
+        pages = (await probe_file(input_path)).get('pages')
+        if not pages:
+            raise ValueError("Could not read the PDF page count")
+        
+        # One range per worker, unless the document is too short to be worth splitting
+        count = max(1, min(process_pool.workers, pages // PDF_TEXT_CHUNK_PAGES))
+        bounds = [pages * i // count for i in range(count + 1)]
+        ranges = list(zip(bounds, bounds[1:]))
+        work_dir = job_tempdir("pdftext_")
+        progress_queue = await process_pool.progress_queue() if progress_callback else None
+        
+        async def extract(index: int, start: int, stop: int) -> str:
+            part_path = os.path.join(work_dir, f"part_{index:03d}.txt")
+            await process_pool.run(document_worker.pdf_text_range, input_path, part_path, start, stop, progress_queue)
+            return part_path
+        
+        async def report_progress():
+            done = 0
+            while True:
+                await asyncio.sleep(0.5)
+                finished = await asyncio.to_thread(drain_page_counts, progress_queue)
+                if finished:
+                    done += finished
+                    await progress_callback(20 + 79 * done // pages, f"📄 Extracted page {done}/{pages}")
+        
+        tasks = [asyncio.create_task(extract(i, start, stop)) for i, (start, stop) in enumerate(ranges)]
+        reporter = asyncio.create_task(report_progress()) if progress_callback else None
         try:
-            if output_format == 'docx':
-                # Using pdf2docx (install: pip install pdf2docx)
-                from pdf2docx import Converter
-                cv = Converter(input_path)
-                cv.convert(output_path)
-                cv.close()
-            elif output_format == 'txt':
-                # Using PyPDF2 for text extraction
-                import PyPDF2
-                with open(input_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    text = ""
-                    for page in pdf_reader.pages:
-                        text += page.extract_text() + "\n"
-                    
-                    async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-                        await f.write(text)
-                        
-        except ImportError:
-            # Fallback: copy file with new extension
-            import shutil
-            shutil.copy2(input_path, output_path)
+            with open(output_path, 'wb') as out:
+                for task in tasks:
+                    part_path = await task
+                    with open(part_path, 'rb') as part:
+                        shutil.copyfileobj(part, out)
+                    os.unlink(part_path)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if reporter:
+                reporter.cancel()
+            shutil.rmtree(work_dir, ignore_errors=True)
 
     @staticmethod
+    @timed()
     async def docx_to_pdf(input_path: str, output_path: str, progress_callback=None):
         """Convert DOCX to PDF"""
-        try:
-            # Using python-docx and reportlab
-            from docx import Document
-            from reportlab.lib.pagesizes import letter
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.utils import ImageReader
-            import io
-            
-            doc = Document(input_path)
-            c = canvas.Canvas(output_path, pagesize=letter)
-            y = 750  # Starting y position
-            line_height = 15
-            
-            for paragraph in doc.paragraphs:
-                text = paragraph.text
-                if text.strip():
-                    c.drawString(50, y, text)
-                    y -= line_height
-                    if y < 50:
-                        c.showPage()
-                        y = 750
-            
-            c.save()
-            
-        except ImportError:
-            # Fallback: copy file
-            import shutil
-            shutil.copy2(input_path, output_path)
+        await process_pool.run(document_worker.docx_to_pdf, input_path, output_path)
 
     @staticmethod
+    @timed()
     async def convert_image(input_path: str, output_path: str, output_format: str, progress_callback=None):
         """Convert images between formats"""
-        from PIL import Image
-        
-        img = Image.open(input_path)
-        
-        if output_format == 'pdf':
-            # Convert image to PDF
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            img.save(output_path, "PDF", resolution=100.0)
-        else:
-            # Convert to other image formats
-            img.save(output_path, output_format.upper())
-        
-        img.close()
+        await process_pool.run(document_worker.convert_image, input_path, output_path, output_format)
 
     @staticmethod
+    @timed()
     async def get_file_info(file_path: str) -> dict:
         """Get detailed information about file"""
-        import magic
-        from moviepy.editor import VideoFileClip
-        from PIL import Image
-        import PyPDF2
-        
-        file_info = {
-            'size': os.path.getsize(file_path),
-            'format': os.path.splitext(file_path)[1].lower(),
-            'type': 'unknown'
-        }
-        
-        mime = magic.Magic(mime=True)
-        mime_type = mime.from_file(file_path)
-        
-        if mime_type.startswith('video/'):
-            file_info['type'] = 'video'
-            try:
-                clip = VideoFileClip(file_path)
-                file_info.update({
-                    'duration': clip.duration,
-                    'resolution': f"{clip.size[0]}x{clip.size[1]}",
-                    'fps': clip.fps
-                })
-                clip.close()
-            except:
-                pass
-                
-        elif mime_type.startswith('audio/'):
-            file_info['type'] = 'audio'
-            
-        elif mime_type.startswith('image/'):
-            file_info['type'] = 'image'
-            try:
-                img = Image.open(file_path)
-                file_info.update({
-                    'resolution': f"{img.width}x{img.height}",
-                    'mode': img.mode
-                })
-                img.close()
-            except:
-                pass
-                
-        elif mime_type == 'application/pdf':
-            file_info['type'] = 'pdf'
-            try:
-                with open(file_path, 'rb') as f:
-                    pdf = PyPDF2.PdfReader(f)
-                    file_info['pages'] = len(pdf.pages)
-            except:
-                pass
-                
-        elif mime_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-            file_info['type'] = 'document'
-            
-        return file_info
+        return await probe_file(file_path)
 
-    # Existing video methods (merge, split, etc.) remain the same
     @staticmethod
+    @conversion_stage()
     async def merge_videos(video_paths: list, progress_callback=None) -> str:
-        """Merge multiple videos"""
-        output_path = get_temp_path("merged_video.mp4")
-        
-        if progress_callback:
-            await progress_callback(10, "Loading videos...")
-        
-        clips = []
-        for i, path in enumerate(video_paths):
-            if progress_callback:
-                await progress_callback(10 + (i * 30 // len(video_paths)), f"Loading video {i+1}...")
-            clips.append(VideoFileClip(path))
-        
+        """Merge multiple videos
+
+        Inputs sharing codec parameters are joined by the concat demuxer with
+        stream copy; only inputs that differ from the majority are re-encoded
+        to match before concatenation.
+        """
         if progress_callback:
-            await progress_callback(70, "Merging videos...")
+            await progress_callback(5, "Analyzing videos...")
         
-        final_clip = concatenate_videoclips(clips)
-        final_clip.write_videofile(output_path, verbose=False, logger=None)
+        infos = [await probe_file(path) for path in video_paths]
+        plan = plan_merge(infos)
+        annotate_job('merge_path', plan.path)
+        annotate_job('normalized_inputs', len(plan.normalize))
+        output_path = job_path(f"merged_{uuid.uuid4().hex[:8]}.{plan.output_format}")
         
-        for clip in clips:
-            clip.close()
-        final_clip.close()
+        work_dir = job_tempdir("merge_")
+        try:
+            parts = list(video_paths)
+            # Normalized parts share the reference's container so their timestamps line up
+            part_ext = os.path.splitext(video_paths[plan.reference_index])[1] or f".{plan.output_format}"
+            for step, index in enumerate(plan.normalize):
+                info = infos[index]
+                normalized = os.path.join(work_dir, f"part_{index}{part_ext}")
+                args = ['-i', video_paths[index]]
+                if plan.reference.get('audio_codec') and not info.get('audio_codec'):
+                    args += ['-f', 'lavfi', '-i', 'anullsrc']
+                low = 5 + 80 * step // len(plan.normalize)
+                high = 5 + 80 * (step + 1) // len(plan.normalize)
+                await run_ffmpeg([*args, *normalize_args(info, plan.reference), normalized],
+                                 info.get('duration'), progress_callback,
+                                 status=f"Matching video {index + 1} to the others...", progress_range=(low, high))
+                parts[index] = normalized
+            
+            list_path = os.path.join(work_dir, "inputs.txt")
+            write_concat_list(list_path, parts)
+            
+            total_duration = sum(info.get('duration', 0) for info in infos)
+            await run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', list_path,
+                              '-map', '0:v', '-map', '0:a?', '-c', 'copy', output_path],
+                             total_duration, progress_callback,
+                             status="Joining videos...", progress_range=(85 if plan.normalize else 5, 99))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
         
         if progress_callback:
             await progress_callback(100, "Merge completed!")
@@ -246,49 +247,82 @@ class VideoProcessor:
         return output_path
 
     @staticmethod
-    async def video_to_audio(input_path: str, audio_format: str, progress_callback=None) -> str:
-        """Extract audio from video"""
-        output_path = get_temp_path(f"audio_{os.path.basename(input_path).split('.')[0]}.{audio_format}")
-        
-        if progress_callback:
-            await progress_callback(20, "Extracting audio...")
-        
-        video = VideoFileClip(input_path)
-        audio = video.audio
-        
-        if progress_callback:
-            await progress_callback(60, "Saving audio file...")
-        
-        audio.write_audiofile(output_path, verbose=False, logger=None)
-        video.close()
-        audio.close()
-        
-        if progress_callback:
-            await progress_callback(100, "Audio extraction completed!")
-        
+    async def make_thumbnail(input_path: str, duration: Optional[float] = None) -> str:
+        """Small JPEG preview for send_video, decoded from a single frame"""
+        output_path = job_path(f"thumb_{uuid.uuid4().hex[:8]}.jpg")
+        # Seeking on the input starts decoding at the keyframe before the position, not at 0
+        position = min(duration * 0.1, 10) if duration else 0
+        await run_ffmpeg(['-ss', f"{position:.3f}", '-i', input_path, '-map', '0:v:0', '-frames:v', '1',
+                          '-vf', f"scale={THUMBNAIL_SIZE}:{THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease",
+                          '-q:v', '5', output_path])
         return output_path
 
     @staticmethod
-    async def compress_video(input_path: str, target_size_mb: int, progress_callback=None) -> str:
-        """Compress video to target size"""
-        output_path = get_temp_path(f"compressed_{os.path.basename(input_path)}")
-        
-        if progress_callback:
-            await progress_callback(10, "Analyzing video...")
-        
-        clip = VideoFileClip(input_path)
-        duration = clip.duration
-        original_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
-        
-        # Calculate target bitrate
-        target_bitrate = (target_size_mb * 8192) / duration  # in kbps
+    @conversion_stage()
+    async def video_to_audio(input_path: str, audio_format: Optional[str] = None, progress_callback=None) -> str:
+        """Extract audio from video, copying the track when it already fits audio_format (None = as is)"""
+        return await AudioProcessor.convert(input_path, audio_format, progress_callback)
+
+    @staticmethod
+    @conversion_stage()
+    async def compress_video(input_path: str, target_size_mb: int, progress_callback=None,
+                             mode: str = "two_pass", parallel: bool = False) -> str:
+        """Compress video to target size
+
+        mode "two_pass" runs a two-pass libx264 ABR encode that lands close to the
+        requested size; "fast" is a single CRF pass capped with -maxrate, which
+        stays under the size but usually ends up smaller. With parallel=True long
+        inputs are encoded in concurrent segments, each at the same bitrate.
+        """
+        base_name = os.path.splitext(os.path.basename(input_path))[0]
+        output_path = job_path(f"compressed_{base_name}.mp4")
         
         if progress_callback:
-            await progress_callback(50, f"Compressing to {target_size_mb}MB...")
-        
-        clip.write_videofile(output_path, bitf=f"{target_bitrate}k", verbose=False, logger=None)
-        clip.close()
-        
+            await progress_callback(5, "Analyzing video...")
+        
+        info = await probe_file(input_path)
+        duration = info.get('duration')
+        if not duration:
+            raise ValueError("Cannot compress a video of unknown duration")
+        
+        # Only the first audio track is kept: the budget has room for one
+        video_bitrate, audio_bitrate = compression_bitrates(target_size_mb, duration, bool(info.get('audio_codec')))
+        annotate_job('compression', {'mode': mode, 'video_kbps': video_bitrate, 'audio_kbps': audio_bitrate})
+        
+        audio_args = ['-c:a', 'aac', '-b:a', f"{audio_bitrate}k"] if audio_bitrate else []
+        output_args = [*audio_args, *muxer_args('mp4')]
+        if mode == "fast":
+            video_args = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23',
+                          # A tight VBV buffer keeps peaks from pushing the file over budget
+                          '-maxrate', f"{int(video_bitrate * 0.95)}k", '-bufsize', f"{video_bitrate}k",
+                          '-pix_fmt', 'yuv420p']
+        else:
+            video_args = ['-c:v', 'libx264', '-preset', 'medium', '-b:v', f"{video_bitrate}k", '-pix_fmt', 'yuv420p']
+        status = f"Compressing to {target_size_mb}MB..."
+        
+        segments = segment_count(duration) if parallel else 1
+        if segments > 1:
+            annotate_job('parallel_segments', segments)
+            await encode_parallel(input_path, output_path, video_args, audio_args, segments, progress_callback,
+                                  status, progress_range=(5, 99), two_pass=(mode != "fast"), audio_map='0:a:0')
+        elif mode == "fast":
+            await run_ffmpeg(['-i', input_path, '-map', '0:v:0', '-map', '0:a:0?', *video_args, *output_args, output_path],
+                             duration, progress_callback, status=status, progress_range=(5, 99))
+        else:
+            passlog_dir = job_tempdir("passlog_")
+            passlog_args = ['-passlogfile', os.path.join(passlog_dir, "x264")]
+            try:
+                # First pass only gathers statistics; the output is thrown away
+                await run_ffmpeg(['-i', input_path, '-map', '0:v:0', *video_args, *passlog_args, '-pass', '1',
+                                  '-an', '-f', 'null', os.devnull],
+                                 duration, progress_callback, status=f"{status} (pass 1/2)", progress_range=(5, 50))
+                await run_ffmpeg(['-i', input_path, '-map', '0:v:0', '-map', '0:a:0?', *video_args, *passlog_args,
+                                  '-pass', '2', *output_args, output_path],
+                                 duration, progress_callback, status=f"{status} (pass 2/2)", progress_range=(50, 99))
+            finally:
+                shutil.rmtree(passlog_dir, ignore_errors=True)
+        
+        annotate_job('output_bytes', os.path.getsize(output_path))
         if progress_callback:
             await progress_callback(100, "Compression completed!")
         
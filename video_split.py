@@ -0,0 +1,105 @@
+"""Split a video into parts at keyframes with ffmpeg's segment muxer, without re-encoding
+
+ffmpeg appends each part to a CSV segment list as soon as it has closed it;
+split_video polls that list and yields parts as they are finalized, so the
+caller can upload part 1 while ffmpeg is still writing part 2.
+"""
+import asyncio
+import csv
+import logging
+import os
+import shutil
+from typing import AsyncIterator, List, Tuple
+
+from config import SPLIT_MAX_PARTS, SPLIT_POLL_INTERVAL
+from ffmpeg_runner import run_ffmpeg
+from job_manager import annotate_job
+from media_probe import probe_file
+from workspace import job_tempdir
+
+logger = logging.getLogger(__name__)
+
+SPLIT_MODES = ('time', 'count', 'size')
+MIN_PART_SECONDS = 1.0
+# Size mode assumes an even bitrate; keyframe spacing and bitrate peaks need headroom
+SIZE_MARGIN = 0.9
+
+
+def part_seconds(duration: float, size: int, mode: str, value: float) -> float:
+    """Target part length: `value` seconds, `value` parts, or parts of at most `value` MB"""
+    if mode == 'time':
+        seconds = value
+    elif mode == 'count':
+        seconds = duration / value
+    elif mode == 'size':
+        seconds = duration * value * 1024 * 1024 * SIZE_MARGIN / max(size, 1)
+    else:
+        raise ValueError(f"Unknown split mode {mode}")
+    return max(seconds, duration / SPLIT_MAX_PARTS, MIN_PART_SECONDS)
+
+
+def read_segment_list(list_path: str) -> List[Tuple[str, float, float]]:
+    """(filename, start, end) of every part ffmpeg has finished so far"""
+    try:
+        with open(list_path, newline='') as f:
+            # A line still being written has no end time yet
+            return [(row[0], float(row[1]), float(row[2])) for row in csv.reader(f) if len(row) == 3]
+    except FileNotFoundError:
+        return []
+
+
+async def split_video(input_path: str, mode: str, value: float, progress_callback=None,
+                      resplit: bool = True) -> AsyncIterator[dict]:
+    """Yield {'path', 'index', 'start', 'end'} for each part as soon as ffmpeg finalizes it
+
+    Parts are cut at the first keyframe after each target length, with stream
+    copy. In size mode a part that still came out too big (a bitrate peak) is
+    split once more. Part files are deleted when the iteration ends.
+    """
+    info = await probe_file(input_path)
+    duration = info.get('duration')
+    if not duration:
+        raise ValueError("Cannot split a video of unknown duration")
+    size = os.path.getsize(input_path)
+    seconds = part_seconds(duration, size, mode, value)
+    if seconds >= duration:
+        raise ValueError("The video already fits in one part")
+    annotate_job('split_part_seconds', round(seconds, 1))
+
+    ext = os.path.splitext(input_path)[1] or '.mp4'
+    work_dir = job_tempdir("split_")
+    list_path = os.path.join(work_dir, "parts.csv")
+    ffmpeg = asyncio.create_task(run_ffmpeg(
+        ['-i', input_path, '-map', '0:v:0', '-map', '0:a?', '-c', 'copy',
+         '-f', 'segment', '-segment_time', f"{seconds:.3f}", '-reset_timestamps', '1',
+         '-segment_list', list_path, '-segment_list_type', 'csv',
+         os.path.join(work_dir, f"part_%03d{ext}")],
+        duration, progress_callback, status="Splitting video...", progress_range=(5, 99)))
+
+    index = 0
+    try:
+        finalized = 0
+        while True:
+            # Read the list only after checking, so the last parts are not missed
+            finished = ffmpeg.done()
+            for name, start, end in read_segment_list(list_path)[finalized:]:
+                finalized += 1
+                path = os.path.join(work_dir, name)
+                if resplit and mode == 'size' and os.path.getsize(path) > value * 1024 * 1024:
+                    logger.info(f"Part {name} exceeds {value} MB, splitting it again")
+                    async for part in split_video(path, mode, value, resplit=False):
+                        index += 1
+                        yield {**part, 'index': index, 'start': start + part['start'], 'end': start + part['end']}
+                    continue
+                index += 1
+                yield {'path': path, 'index': index, 'start': start, 'end': end}
+            if finished:
+                await ffmpeg  # raises if ffmpeg failed
+                break
+            await asyncio.wait({ffmpeg}, timeout=SPLIT_POLL_INTERVAL)
+    finally:
+        if not ffmpeg.done():
+            ffmpeg.cancel()
+        await asyncio.gather(ffmpeg, return_exceptions=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    annotate_job('split_parts', index)
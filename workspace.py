@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from config import (
+    TEMP_DIR, WORKSPACE_MAX_BYTES, WORKSPACE_MIN_FREE_BYTES, WORKSPACE_SOURCE_TTL,
+    WORKSPACE_SWEEP_INTERVAL, WORKSPACE_TMPFS_DIR, WORKSPACE_TMPFS_MAX_FILE, get_temp_path
+)
+from job_manager import Job, current_job
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientSpaceError(Exception):
+    """Raised when there is not enough disk space to accept a file"""
+
+
+class Entry:
+    """A tracked file or directory on disk"""
+
+    def __init__(self, path: str, size: int = 0, refs: int = 0, reusable: bool = False):
+        self.path = path
+        self.size = size
+        self.refs = refs
+        self.reusable = reusable  # downloads stay around for later jobs until evicted
+        self.last_used = time.monotonic()
+
+
+class Workspace:
+    """Private directory of one job; everything in it goes away when the job ends"""
+
+    def __init__(self, job_id: int, path: str):
+        self.job_id = job_id
+        self.path = path
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def tempdir(self, prefix: str) -> str:
+        return tempfile.mkdtemp(prefix=prefix, dir=self.path)
+
+
+def _disk_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class WorkspaceManager:
+    """Owns everything under TEMP_DIR: job directories and downloaded sources
+
+    Entries are reference counted; unreferenced ones are deleted by a background
+    sweeper (job directories at once, downloads after a TTL), and the least
+    recently used unreferenced downloads are evicted whenever the total would
+    exceed the disk budget. Small files can live on a tmpfs instead.
+    """
+
+    def __init__(self, root: str = TEMP_DIR, max_bytes: int = WORKSPACE_MAX_BYTES,
+                 min_free_bytes: int = WORKSPACE_MIN_FREE_BYTES, tmpfs_dir: str = WORKSPACE_TMPFS_DIR,
+                 tmpfs_max_file: int = WORKSPACE_TMPFS_MAX_FILE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.tmpfs_root = os.path.join(tmpfs_dir, "converter_bot") if tmpfs_dir else None
+        self.tmpfs_max_file = tmpfs_max_file
+        self.entries: Dict[str, Entry] = {}
+        self.workspaces: Dict[int, Workspace] = {}
+        self.job_plans: Dict[int, Tuple[int, int]] = {}  # job id -> (expected bytes, input files)
+        self._source_locks: Dict[str, asyncio.Lock] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Remove leftovers of previous runs and start the sweeper"""
+        roots = [r for r in (self.root, self.tmpfs_root) if r]
+        await asyncio.to_thread(self._wipe, roots)
+        self._wakeup = asyncio.Event()
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    @staticmethod
+    def _wipe(roots):
+        for root in roots:
+            os.makedirs(root, exist_ok=True)
+            for name in os.listdir(root):
+                _remove(os.path.join(root, name))
+
+    def _root_for(self, expected_bytes: Optional[int]) -> str:
+        """tmpfs for small files when enabled and it has room, otherwise TEMP_DIR"""
+        if self.tmpfs_root and expected_bytes and expected_bytes <= self.tmpfs_max_file:
+            try:
+                # Room for the input, the output and intermediates
+                if shutil.disk_usage(os.path.dirname(self.tmpfs_root)).free > expected_bytes * 4:
+                    os.makedirs(self.tmpfs_root, exist_ok=True)
+                    return self.tmpfs_root
+            except OSError:
+                pass
+        return self.root
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(entry.size for entry in self.entries.values())
+
+    def _root_for_job(self, job: Optional[Job], expected_bytes: Optional[int]) -> str:
+        """Like _root_for, sized from the whole job when it was planned
+
+        Jobs over several inputs (merges, batches) always use TEMP_DIR: each file
+        may be small, but together with their output they can outgrow the tmpfs.
+        """
+        plan = self.job_plans.get(job.id) if job is not None else None
+        if plan is not None:
+            total, inputs = plan
+            expected_bytes = total if inputs == 1 else None
+        return self._root_for(expected_bytes)
+
+    # Jobs
+
+    def plan_job(self, job: Job, expected_bytes: int, inputs: int = 1):
+        """Record the footprint of a submitted job, before its workspace exists"""
+        self.job_plans[job.id] = (expected_bytes, inputs)
+        job.on_finish(lambda: self.job_plans.pop(job.id, None))
+
+    def for_job(self, job: Job, expected_bytes: Optional[int] = None) -> Workspace:
+        """The job's workspace, created on first use and removed when the job finishes"""
+        workspace = self.workspaces.get(job.id)
+        if workspace is None:
+            if job.id in self.job_plans:
+                expected_bytes = self.job_plans[job.id][0]
+            path = os.path.join(self._root_for_job(job, expected_bytes), f"job_{job.id}_{uuid.uuid4().hex[:8]}")
+            os.makedirs(path)
+            workspace = Workspace(job.id, path)
+            self.workspaces[job.id] = workspace
+            # Reserve the expected footprint until the real size is known
+            self.entries[path] = Entry(path, size=2 * (expected_bytes or 0), refs=1)
+            job.on_finish(lambda: self._close_job(job.id))
+        return workspace
+
+    def _close_job(self, job_id: int):
+        workspace = self.workspaces.pop(job_id, None)
+        if workspace is not None:
+            self.release(workspace.path)
+
+    # Downloads
+
+    async def acquire_source(self, key: str, ext: str, size: Optional[int],
+                             download: Callable[[str], Awaitable[None]]) -> str:
+        """Path of a downloaded source file, downloading it once and holding a reference
+
+        The reference is dropped when the current job finishes. Concurrent jobs on
+        the same file share a single download.
+        """
+        lock = self._source_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = next((e for e in self.entries.values()
+                          if e.reusable and os.path.basename(e.path) == f"{key}{ext}"), None)
+            if entry is not None and os.path.exists(entry.path):
+                entry.refs += 1
+            else:
+                await self.ensure_space(size or 0)
+                path = os.path.join(self._root_for_job(current_job.get(), size), f"{key}{ext}")
+                # Referenced from the start so the sweeper leaves a partial download alone
+                self.entries[path] = entry = Entry(path, size=size or 0, refs=1, reusable=True)
+                try:
+                    await download(path)
+                except BaseException:
+                    self.entries.pop(path, None)
+                    _remove(path)
+                    raise
+                entry.size = os.path.getsize(path)
+            entry.last_used = time.monotonic()
+            job = current_job.get()
+            if job is not None:
+                job.on_finish(lambda: self.release(entry.path))
+        return entry.path
+
+    def release(self, path: str):
+        """Drop one reference; unreferenced entries are cleaned up by the sweeper"""
+        entry = self.entries.get(path)
+        if entry is None:
+            return
+        entry.refs = max(0, entry.refs - 1)
+        entry.last_used = time.monotonic()
+        if entry.refs == 0 and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def ensure_space(self, needed_bytes: int):
+        """Make room for needed_bytes (input plus output) or raise InsufficientSpaceError"""
+        needed = 2 * needed_bytes
+        if self.used_bytes + needed > self.max_bytes:
+            await self._evict(self.used_bytes + needed - self.max_bytes)
+        if self.used_bytes + needed > self.max_bytes:
+            raise InsufficientSpaceError(f"Workspace budget exhausted ({self.used_bytes} bytes in use)")
+
+        free = (await asyncio.to_thread(shutil.disk_usage, self.root)).free
+        if free - needed < self.min_free_bytes:
+            await self._evict(self.min_free_bytes + needed - free)
+            free = (await asyncio.to_thread(shutil.disk_usage, self.root)).free
+        if free - needed < self.min_free_bytes:
+            raise InsufficientSpaceError(f"Only {free // 2**20} MB free on disk")
+
+    # Cleanup
+
+    async def _evict(self, bytes_to_free: int) -> int:
+        """Delete unreferenced entries, least recently used first"""
+        freed = 0
+        for entry in sorted((e for e in self.entries.values() if e.refs == 0), key=lambda e: e.last_used):
+            if freed >= bytes_to_free:
+                break
+            freed += entry.size
+            await self._delete(entry)
+        if freed:
+            logger.info(f"Evicted {freed // 1024} KB from the workspace")
+        return freed
+
+    async def _delete(self, entry: Entry):
+        self.entries.pop(entry.path, None)
+        await asyncio.to_thread(_remove, entry.path)
+
+    async def sweep(self):
+        """Delete finished job directories and expired downloads, then enforce the budget"""
+        now = time.monotonic()
+        for entry in list(self.entries.values()):
+            if entry.refs:
+                if not entry.reusable:
+                    # Track how much running jobs actually use
+                    entry.size = max(entry.size, await asyncio.to_thread(_disk_size, entry.path))
+                continue
+            if not entry.reusable or now - entry.last_used > WORKSPACE_SOURCE_TTL:
+                await self._delete(entry)
+        if self.used_bytes > self.max_bytes:
+            await self._evict(self.used_bytes - self.max_bytes)
+        for key in [k for k, lock in self._source_locks.items() if not lock.locked()]:
+            del self._source_locks[key]
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=WORKSPACE_SWEEP_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Workspace sweep failed: {e}")
+
+
+workspace_manager = WorkspaceManager()
+
+
+def job_path(filename: str) -> str:
+    """Path for an output file in the current job's workspace (TEMP_DIR outside of jobs)"""
+    job = current_job.get()
+    if job is None:
+        return get_temp_path(filename)
+    return workspace_manager.for_job(job).file(filename)
+
+
+def job_tempdir(prefix: str) -> str:
+    """Scratch directory inside the current job's workspace (TEMP_DIR outside of jobs)
+
+    Callers should still remove it when done; inside a job anything left over
+    goes away with the workspace.
+    """
+    job = current_job.get()
+    if job is None:
+        return tempfile.mkdtemp(prefix=prefix, dir=TEMP_DIR)
+    return workspace_manager.for_job(job).tempdir(prefix)